@@ -0,0 +1,518 @@
+# Benchmark for the whole convert and upload pipeline.
+# Generates a tree of synthetic clips with ffmpeg's test sources, and runs the converter
+# against an in-process fake of the YouTube API, so throughput can be measured
+# and compared between runs without real recordings or a live channel
+
+# Import required modules
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from json import dump, dumps, load
+from pathlib import Path
+from queue import Queue
+from subprocess import CalledProcessError, run
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUpload
+
+import main
+
+
+# Fake of the parts of the YouTube API the script uses.
+# Every call waits for the configured latency, and can fail with a retriable error
+# at the configured rate. Uploads are "sent" at the configured bandwidth
+class FakeYouTube:
+    def __init__(self, latency: float = 0.05, bandwidth: float = None, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        # Videos on the channel, newest first, as (video ID, title) tuples
+        self.uploads = []
+
+        # Maps upload session URIs to the number of bytes received
+        self.sessions = {}
+
+        # Maps the URIs of completed upload sessions to the ID of their video
+        self.finished = {}
+
+        # Counters reported with the results
+        self.counters = dict(api_calls=0, chunks=0, failures=0, bytes_received=0, thumbnails=0)
+
+    # Waits for the latency of a request, and raises a retriable error if one should be injected
+    def request(self):
+        with self.lock:
+            self.counters['api_calls'] += 1
+            fail = self.random.random() < self.failure_rate
+            if fail:
+                self.counters['failures'] += 1
+
+        time.sleep(self.latency)
+
+        if fail:
+            raise HttpError(httplib2.Response({'status': 503}), b'Injected failure')
+
+    # Adds a video to the channel, and returns its ID
+    def add_video(self, title: str) -> str:
+        with self.lock:
+            video_id = f'fake{len(self.uploads):07d}'
+            self.uploads.insert(0, (video_id, title))
+            return video_id
+
+    def create_session(self) -> str:
+        with self.lock:
+            uri = f'https://upload.example/session/{len(self.sessions)}'
+            self.sessions[uri] = 0
+            return uri
+
+    def videos(self):
+        return FakeVideos(self)
+
+    def channels(self):
+        return FakeChannels(self)
+
+    def playlistItems(self):
+        return FakePlaylistItems(self)
+
+    def search(self):
+        return FakeSearch(self)
+
+    def thumbnails(self):
+        return FakeThumbnails(self)
+
+
+# Request that returns the result of a function when executed
+class FakeRequest:
+    def __init__(self, service: FakeYouTube, function):
+        self.service = service
+        self.function = function
+
+    def execute(self):
+        self.service.request()
+        return self.function()
+
+
+class FakeVideos:
+    def __init__(self, service: FakeYouTube):
+        self.service = service
+
+    # Like the real client, only uploads subclassing MediaUpload are accepted
+    def insert(self, part: str, body: dict, media_body):
+        if not isinstance(media_body, MediaUpload):
+            raise TypeError('media_filename must be str or MediaUpload.')
+        return FakeInsertRequest(self.service, body, media_body)
+
+
+class FakeChannels:
+    def __init__(self, service: FakeYouTube):
+        self.service = service
+
+    def list(self, part: str, mine: bool):
+        return FakeRequest(self.service, lambda: dict(
+            items=[dict(contentDetails=dict(relatedPlaylists=dict(uploads='UUfake')))]
+        ))
+
+
+class FakePlaylistItems:
+    def __init__(self, service: FakeYouTube):
+        self.service = service
+
+    # Returns the channel's videos, newest first, a page at a time
+    def list(self, part: str, playlistId: str, maxResults: int = 5, pageToken: str = None):
+        def page():
+            start = int(pageToken or 0)
+            with self.service.lock:
+                videos = self.service.uploads[start:start + maxResults]
+                more = start + maxResults < len(self.service.uploads)
+
+            response = dict(items=[dict(snippet=dict(title=title, resourceId=dict(videoId=video_id)))
+                                   for video_id, title in videos])
+            if more:
+                response['nextPageToken'] = str(start + maxResults)
+            return response
+
+        return FakeRequest(self.service, page)
+
+
+class FakeSearch:
+    def __init__(self, service: FakeYouTube):
+        self.service = service
+
+    # Returns the channel's videos with titles containing the query
+    def list(self, part: str, q: str = '', maxResults: int = 5, **kwargs):
+        def search():
+            with self.service.lock:
+                videos = [video for video in self.service.uploads if q.casefold() in video[1].casefold()]
+
+            return dict(items=[dict(id=dict(kind='youtube#video', videoId=video_id), snippet=dict(title=title))
+                               for video_id, title in videos[:maxResults]])
+
+        return FakeRequest(self.service, search)
+
+
+class FakeThumbnails:
+    def __init__(self, service: FakeYouTube):
+        self.service = service
+
+    def set(self, videoId: str, media_body):
+        def set_thumbnail():
+            with self.service.lock:
+                self.service.counters['thumbnails'] += 1
+            return dict(items=[dict(default=dict(url=f'https://i.example/{videoId}.jpg'))])
+
+        return FakeRequest(self.service, set_thumbnail)
+
+
+# Progress of a resumable upload, like MediaUploadProgress of the Google API client
+class FakeUploadProgress:
+    def __init__(self, resumable_progress: int, total_size: int):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self) -> float:
+        return self.resumable_progress / self.total_size if self.total_size else 0.0
+
+
+# Resumable insert request. Mirrors how the Google API client's HttpRequest uploads
+# a chunk of the media body on each call of next_chunk, and asks how much the server
+# has received before continuing after an error
+class FakeInsertRequest:
+    def __init__(self, service: FakeYouTube, body: dict, media_body):
+        self.service = service
+        self.body = body
+        self.resumable = media_body
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self._in_error_state = False
+
+    def next_chunk(self, http=None, num_retries: int = 0):
+        if self.resumable_uri is None:
+            self.service.request()
+            self.resumable_uri = self.service.create_session()
+
+        # A session from an earlier run doesn't exist on this fake
+        if self.resumable_uri not in self.service.sessions:
+            raise HttpError(httplib2.Response({'status': 404}), b'Upload session not found')
+
+        # Ask how much was received before the error, and continue from there in the same call.
+        # The upload may already be complete if only the response to the last chunk was lost
+        if self._in_error_state:
+            self.service.request()
+            self.resumable_progress = self.service.sessions[self.resumable_uri]
+            self._in_error_state = False
+            if self.resumable_uri in self.service.finished:
+                return None, dict(id=self.service.finished[self.resumable_uri])
+
+        chunk_size = self.resumable.chunksize()
+        data = self.resumable.getbytes(self.resumable_progress, chunk_size)
+
+        try:
+            self.service.request()
+        except HttpError:
+            self._in_error_state = True
+            raise
+
+        if self.service.bandwidth:
+            time.sleep(len(data) / self.service.bandwidth)
+
+        with self.service.lock:
+            self.service.sessions[self.resumable_uri] += len(data)
+            self.service.counters['chunks'] += 1
+            self.service.counters['bytes_received'] += len(data)
+        self.resumable_progress += len(data)
+
+        # Without a known size, a short chunk is the end of the file
+        size = self.resumable.size()
+        if (size is not None and self.resumable_progress >= size) or (size is None and len(data) < chunk_size):
+            video_id = self.service.add_video(self.body['snippet']['title'])
+            self.service.finished[self.resumable_uri] = video_id
+            return None, dict(id=video_id)
+
+        return FakeUploadProgress(self.resumable_progress, size), None
+
+
+# Logging handler collecting the durations of the timing spans logged by the script
+class SpanCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.spans = {}
+
+    def emit(self, record: logging.LogRecord):
+        if hasattr(record, 'stage'):
+            self.spans.setdefault(record.stage, []).append(record.duration)
+
+    # Returns the number of spans, and their total and average duration for each stage
+    def summary(self) -> dict:
+        return {stage: dict(count=len(durations),
+                            total_seconds=round(sum(durations), 3),
+                            mean_seconds=round(sum(durations) / len(durations), 3))
+                for stage, durations in self.spans.items()}
+
+
+# Function for generating the source tree of synthetic clips.
+# Clips that already exist are kept, so the same tree can be reused between runs
+def generate_clips(root: Path, args) -> list:
+    clips = []
+    upload_count = 0
+
+    for folder_number in range(args.folders):
+        lossless_folder = Path(root, f'Game {folder_number}', 'lossless')
+        lossless_folder.mkdir(parents=True, exist_ok=True)
+
+        for clip_number in range(args.clips):
+            index = folder_number * args.clips + clip_number
+
+            # Mark clips for upload spread evenly over the tree
+            upload = int((index + 1) * args.upload_ratio) > int(index * args.upload_ratio)
+            upload_count += upload
+
+            extension = args.containers[index % len(args.containers)]
+            name = f'Clip {index:04d}{" ytupload" if upload else ""}.{extension}'
+            clip = Path(lossless_folder, name)
+            clips.append(clip)
+
+            if clip.exists():
+                continue
+
+            cmd = ['ffmpeg', '-v', 'error', '-y',
+                   '-f', 'lavfi', '-i', f'testsrc2=size={args.resolution}:rate={args.fps}:duration={args.duration}',
+                   '-f', 'lavfi', '-i', f'sine=frequency={220 + index * 10}:sample_rate=48000:duration={args.duration}',
+                   '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0', '-pix_fmt', 'yuv420p',
+                   '-c:a', 'aac', '-shortest', str(clip)]
+            run(cmd, check=True, capture_output=True)
+
+    print(f'Generated {len(clips)} clips in {args.folders} folders, {upload_count} marked for upload')
+    return clips
+
+
+# Function for removing everything a previous run left behind, so every run converts the whole tree
+def clean_outputs(root: Path, workdir: Path):
+    for folder in root.rglob(main.Values.output_folder):
+        shutil.rmtree(folder)
+
+    for filename in ('clip state.sqlite3', 'channel uploads.json'):
+        path = Path(workdir, filename)
+        if path.exists():
+            os.remove(path)
+
+
+# Function for running the converter on the generated tree and measuring it
+def run_benchmark(root: Path, workdir: Path, youtube: FakeYouTube, args) -> dict:
+    values = main.Values()
+    values.recordings_folders = [str(root)]
+    values.state_index_file = str(Path(workdir, 'clip state.sqlite3'))
+    values.channel_index_file = str(Path(workdir, 'channel uploads.json'))
+    values.log_file = str(Path(workdir, 'benchmark.log'))
+    values.preset = args.preset
+    values.crf = args.crf
+    values.jobs = args.jobs
+    values.upload_jobs = args.upload_jobs
+    values.stream_upload = args.stream_upload
+    values.upload_source = args.upload_source
+    values.preview = args.preview
+    values.thumbnail_count = args.thumbnails
+
+    # The staging folder is kept in the work folder, which is the fast drive when benchmarking staging
+    if args.staging:
+        values.staging_folder = str(workdir)
+
+    values.queue = Queue()
+    values.thread_lock = threading.Lock()
+    values.state_index = main.StateIndex(values.state_index_file)
+    values.metadata = main.MetadataService(values.probe_jobs, values.probe_cache_size)
+    values.metrics = main.Metrics(values)
+
+    log_listener = main.setup_logging(values)
+    collector = SpanCollector()
+    logging.getLogger('timing').addHandler(collector)
+
+    # Every upload worker authenticates on its own, so they're all given the fake instead
+    main.get_authenticated_service = lambda values: youtube
+    values.youtube = youtube
+    values.channel_index = main.ChannelIndex(values.channel_index_file, lambda: youtube)
+
+    try:
+        started = time.perf_counter()
+        main.convert_to_av1(values)
+        wall_seconds = time.perf_counter() - started
+
+    finally:
+        logging.getLogger('timing').removeHandler(collector)
+        values.metadata.close()
+        values.state_index.close()
+        log_listener.stop()
+
+    spans = collector.summary()
+    counters = values.metrics.snapshot()['counters']
+    encode_seconds = spans.get('encode', {}).get('total_seconds', 0)
+    upload_seconds = spans.get('upload', {}).get('total_seconds', 0)
+
+    return dict(
+        settings=dict(folders=args.folders, clips=args.clips, duration=args.duration, resolution=args.resolution,
+                      fps=args.fps, preset=args.preset, crf=args.crf, jobs=args.jobs, upload_jobs=args.upload_jobs,
+                      preview=args.preview, thumbnails=args.thumbnails,
+                      latency=args.latency, bandwidth=args.bandwidth, failure_rate=args.failure_rate),
+        wall_seconds=round(wall_seconds, 3),
+        spans=spans,
+        counters=counters,
+        fake_youtube=dict(youtube.counters),
+        # Frames per second of a single encode, and bytes per second of a single upload
+        encode_fps=round(counters['frames_encoded'] / encode_seconds, 2) if encode_seconds else None,
+        upload_bytes_per_second=round(counters['bytes_uploaded'] / upload_seconds) if upload_seconds else None
+    )
+
+
+# Function for printing the results, and how they changed from a previous run if one was given
+def print_results(results: dict, baseline: dict = None):
+    def compare(name: str, value, previous):
+        if value is None:
+            print(f'{name:<28} -')
+        elif previous:
+            print(f'{name:<28} {value:>14,.3f}  ({(value - previous) / previous:+.1%})')
+        else:
+            print(f'{name:<28} {value:>14,.3f}')
+
+    baseline = baseline or {}
+    baseline_spans = baseline.get('spans', {})
+
+    print()
+    compare('Wall time (s)', results['wall_seconds'], baseline.get('wall_seconds'))
+    for stage in ('scan', 'probe', 'encode', 'verify', 'upload'):
+        if stage in results['spans']:
+            compare(f'{stage.capitalize()} time (s, total)', results['spans'][stage]['total_seconds'],
+                    baseline_spans.get(stage, {}).get('total_seconds'))
+    compare('Encode speed (fps)', results['encode_fps'], baseline.get('encode_fps'))
+
+    upload_speed = results['upload_bytes_per_second']
+    previous_speed = baseline.get('upload_bytes_per_second')
+    compare('Upload speed (MB/s)', upload_speed / 1000 / 1000 if upload_speed else None,
+            previous_speed / 1000 / 1000 if previous_speed else None)
+
+    counters = results['counters']
+    print(f'\nConverted {counters["clips_converted"]} clips, {counters["clips_failed"]} failed, '
+          f'uploaded {counters["videos_uploaded"]} videos')
+    print(f'Fake YouTube: {dumps(results["fake_youtube"])}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark converting and uploading synthetic clips '
+                                                 'against a fake YouTube API')
+    parser.add_argument('--workdir', type=Path, default=None,
+                        help='Folder to generate the clips in and keep between runs (default: a temporary folder)')
+    parser.add_argument('--folders', type=int, default=2, help='Number of "lossless" folders (default: 2)')
+    parser.add_argument('--clips', type=int, default=3, help='Number of clips in each folder (default: 3)')
+    parser.add_argument('--duration', type=float, default=10, help='Length of each clip in seconds (default: 10)')
+    parser.add_argument('--resolution', default='1280x720', help='Resolution of the clips (default: 1280x720)')
+    parser.add_argument('--fps', type=int, default=60, help='Frame rate of the clips (default: 60)')
+    parser.add_argument('--container', action='append', dest='containers', choices=['mkv', 'mp4'],
+                        help='Container of the clips. Given multiple times, the clips alternate (default: mkv and mp4)')
+    parser.add_argument('--upload-ratio', type=float, default=0.5,
+                        help='Share of the clips marked for upload (default: 0.5)')
+    parser.add_argument('--existing', type=int, default=0,
+                        help='Number of the clips marked for upload that are already on the fake channel (default: 0)')
+    parser.add_argument('--preset', type=int, default=10, help='SVT-AV1 preset (default: 10)')
+    parser.add_argument('--crf', type=int, default=main.Values.crf, help=f'CRF (default: {main.Values.crf})')
+    parser.add_argument('-j', '--jobs', type=int, default=main.Values.jobs,
+                        help=f'Number of clips to convert at the same time (default: {main.Values.jobs})')
+    parser.add_argument('--upload-jobs', type=int, default=main.Values.upload_jobs,
+                        help=f'Number of videos to upload at the same time (default: {main.Values.upload_jobs})')
+    parser.add_argument('--preview', action='store_true',
+                        help='Also make an H.264 preview of each clip while converting it')
+    parser.add_argument('--thumbnails', type=int, default=0, metavar='COUNT',
+                        help='Number of thumbnails to take from each clip while converting it (default: none)')
+    parser.add_argument('--staging', action='store_true',
+                        help='Copy the next clips to a staging folder in the work folder and convert them there')
+    parser.add_argument('--upload-source', action='store_true',
+                        help='Upload the lossless original instead of the converted clip')
+    parser.add_argument('--stream-upload', action='store_true',
+                        help='Start uploading converted clips while they are still being converted')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds each fake API request takes (default: 0.05)')
+    parser.add_argument('--bandwidth', type=float, default=None, metavar='MBPS',
+                        help='Upload speed of the fake API in megabits per second (default: no limit)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Share of fake API requests failing with a retriable error (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the injected failures (default: 0)')
+    parser.add_argument('-o', '--output', type=Path, default=None, help='Save the results to this JSON file')
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='JSON file with the results of an earlier run to compare with')
+
+    args = parser.parse_args()
+
+    if args.folders < 1 or args.clips < 1:
+        parser.error('--folders and --clips must be at least 1')
+
+    if args.duration <= 0:
+        parser.error('--duration must be above 0')
+
+    if not 0 <= args.upload_ratio <= 1:
+        parser.error('--upload-ratio must be between 0 and 1')
+
+    if not 0 <= args.failure_rate < 1:
+        parser.error('--failure-rate must be at least 0 and below 1')
+
+    if args.thumbnails < 0:
+        parser.error('--thumbnails must be at least 0')
+
+    if args.jobs < 1 or args.upload_jobs < 1:
+        parser.error('--jobs and --upload-jobs must be at least 1')
+
+    if args.compare is not None and not args.compare.is_file():
+        parser.error(f'{args.compare} is not a file')
+
+    if args.containers is None:
+        args.containers = ['mkv', 'mp4']
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    workdir = args.workdir if args.workdir is not None else Path(tempfile.mkdtemp(prefix='clip benchmark '))
+    root = Path(workdir, 'Recordings')
+
+    try:
+        clips = generate_clips(root, args)
+    except CalledProcessError as e:
+        print(f'Failed to generate the clips:\n{e.stderr.decode(errors="replace")}')
+        exit(1)
+    except FileNotFoundError:
+        print('No ffmpeg exectuable was found.')
+        exit(1)
+
+    clean_outputs(root, workdir)
+
+    youtube = FakeYouTube(latency=args.latency,
+                          bandwidth=args.bandwidth * 1000 * 1000 / 8 if args.bandwidth else None,
+                          failure_rate=args.failure_rate, seed=args.seed)
+
+    # Put some of the clips on the channel already, so finding uploaded videos is measured as well
+    marked = [clip for clip in clips if 'ytupload' in clip.name]
+    for clip in marked[:args.existing]:
+        youtube.add_video(main.get_video_title(clip))
+
+    results = run_benchmark(root, workdir, youtube, args)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = load(f)
+
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            dump(results, f, indent=2)
+
+    # Only remove the temporary folder, never one that was given
+    if args.workdir is None:
+        shutil.rmtree(workdir)
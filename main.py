@@ -1,535 +1,4147 @@
-# Import required modules
-import logging
-import os
-import random
-import sys
-import threading
-import time
-from json import loads
-from logging.handlers import QueueHandler
-from pathlib import Path
-from queue import Empty, Queue
-from subprocess import PIPE, STDOUT, CalledProcessError, Popen, run
-
-import httplib2
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.clientsecrets import InvalidClientSecretsError
-from oauth2client.file import Storage
-from oauth2client.tools import run_flow
-from tqdm import tqdm
-
-
-class Values:
-    # List of extensions/containers from which the script will convert to AV1 MP4
-    whitelisted_extensions = ['.mkv', '.mp4']
-
-    # Folder the converted files will be stored in, relative to the folder they came from
-    output_folder = 'AV1'
-
-    # Tell httplib not to handle retrying after errors, as we handle it ourselves
-    httplib2.RETRIES = 1
-
-    # Upload retry attempts before quitting
-    MAX_RETRIES = 10
-
-    # Exceptions that still allow us to retry
-    RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, IOError)
-
-    # Status codes that still allow us to retry
-    RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
-
-    # Name of the oauth file containing the oauth data for the project
-    CLIENT_SECRETS_FILE = 'client_oauth.json'
-
-    # Scopes we'll be using in the API
-    YOUTUBE_SCOPES = ['https://www.googleapis.com/auth/youtube.readonly',
-                      'https://www.googleapis.com/auth/youtube.upload']
-
-    # Name of the service we're using
-    YOUTUBE_API_SERVICE_NAME = "youtube"
-
-    # Version of the service we're using
-    YOUTUBE_API_VERSION = "v3"
-
-    # Add empty youtube variable for storing the youtube API object
-    youtube = None
-
-    # Add empty queue variable for storing the Queue object
-    queue = None
-
-    # Add empty thread lock variable for storing the threading.Lock object
-    thread_lock = None
-
-
-# Logger function and thread
-def logger_process(queue: Queue):
-    # Create logger
-    logger = logging.getLogger()
-
-    # Create format formatted as
-    # <date> <logger name> <log level> <log message>
-    # and the date format as
-    # <numerical day>-<numerical month>-<last 2 digits of year> hh:mm:ss
-    log_format = logging.Formatter(fmt='%(asctime)s %(name)s %(levelname)s %(message)s',
-                                   datefmt='%d-%b-%y %H:%M:%S')
-
-    # Create logging handler that uses a file on disk as the log location
-    # and overwrites on new instances
-    logger_handle = logging.FileHandler(
-        filename='clip converter and uploader.log',
-        mode='w')
-
-    # Apply the format in the handler
-    logger_handle.setFormatter(log_format)
-    # Add the handler to the logger
-    logger.addHandler(logger_handle)
-    # Set minimum required log level severity
-    logger.setLevel(logging.DEBUG)
-
-    # Listen indefinitely for new logs
-    while True:
-        try:
-            # Wait and block until new log is added to the queue
-            log = queue.get()
-
-            # We use None to signal end of execution
-            if log is None:
-                break
-
-            # Call and use the previously created logger handler
-            logger.handle(log)
-
-        # If we use CTLR+C to quit the script early
-        # we wanna make sure the queue is emptied
-        # and the thread can close to help prevent deadlocks
-        except KeyboardInterrupt:
-            try:
-                while True:
-                    _ = queue.get(block=False)
-            except Empty:
-                queue.close()
-
-            break
-
-
-# Returns an object that can be used to interact with the API
-def get_authenticated_service(values: Values):
-    # Create the logger, add the queue handler
-    # and set the minimum log severity
-    logger = logging.getLogger('authenticator')
-    logger.addHandler(QueueHandler(values.queue))
-    logger.setLevel(logging.DEBUG)
-
-    try:
-        # Create a flow object from the oauth file and scopes
-        flow = flow_from_clientsecrets(values.CLIENT_SECRETS_FILE,
-                                       scope=values.YOUTUBE_SCOPES)
-
-        # Create a storage object from a previously saved oauth token
-        # and get the credentials. If it doesn't exist, credentials will be None
-        storage = Storage("%s-oauth2.json" % sys.argv[0])
-        credentials = storage.get()
-
-        # If the credentials didn't already exist or are incorrect
-        # get new credentials and save the token to disk
-        if credentials is None or credentials.invalid:
-            logger.info('No valid credentials found. Running local webserver to authenticate with user')
-            credentials = run_flow(flow, storage)
-
-        # Build and return the object used to interact with the YouTube API
-        return build(values.YOUTUBE_API_SERVICE_NAME, values.YOUTUBE_API_VERSION, http=credentials.authorize(httplib2.Http()))
-
-    # If the oauth file does not exist or is incorrectly formatted/corrupted
-    # and log it
-    except InvalidClientSecretsError as e:
-        print('"client_oath.json" could not be found or had errors')
-        logger.exception(e)
-        exit()
-
-    # Catch any other error and log it as well
-    except Exception as e:
-        print('Unknown error. Check logs for details')
-        logger.exception(e)
-        exit()
-
-
-# Function for uploading the video.
-# This should be multithreaded with the converter
-def upload_video(file: str, values: Values):
-    # Create the logger, add the queue handler
-    # and set the minimum log severity
-    logger = logging.getLogger('uploader')
-    logger.addHandler(QueueHandler(values.queue))
-    logger.setLevel(logging.DEBUG)
-
-    logger.info('Authenticating for upload')
-
-    # We're authenticating again here because the
-    # youtube._http.connections object is an SSLSocket
-    # and cannot be serialized/copied to the new thread.
-    # If this is not done, or the youtube object is not global
-    # the youtube object will lose the entire SSLSocket connection object
-    # and fail with something like:
-    # 'HttpError 401 when requesting None returned
-    # "Request is missing required authentication credentials...'
-    youtube = get_authenticated_service(values)
-
-    logger.info('Creating body for uploading')
-
-    # Remore the upload flag from the filename
-    # that'll be used as the video title
-    filename = str(file).replace(' ytupload', '')
-
-    # Create a body dictionary containing the
-    # video title, description and category
-    # as well as the privacy status
-    body = dict(
-        snippet=dict(
-            title=Path(filename).stem,
-            description='Icon & outro by @Stardust_Buckethead',
-            categoryId='20'
-        ),
-        status=dict(
-            privacyStatus='private'
-        )
-    )
-
-    # Create an insert_request object used
-    # to upload the video, with the body dictonary as the body
-    # and a chunksize of 1 Mebibyte that is resumeable
-    logger.info('Creating insert request')
-    insert_request = youtube.videos().insert(
-        part=','.join(body.keys()),
-        body=body,
-        media_body=MediaFileUpload(file, chunksize=1024 * 1024, resumable=True)
-    )
-
-    resumable_upload(file, insert_request, values)
-
-
-def resumable_upload(filename, insert_request, values: Values):
-    # Create the logger, add the queue handler
-    # and set the minimum log severity
-    logger = logging.getLogger('resumeable_uploader')
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(QueueHandler(values.queue))
-
-    response = None
-    error = None
-    retry = 0
-
-    # Get the size of the file in bytes, and use it as the "goal" in tqdm
-    file_size = os.path.getsize(filename)
-    progress_bar = tqdm(total=file_size, unit='bytes', unit_scale=True, desc='Uploading', position=0)
-    logger.info(f'Uploading {Path(filename).stem}')
-
-    # response will be None until upload is complete
-    while response is None:
-        try:
-            status, response = insert_request.next_chunk()
-            if status:
-
-                # status.resumable_progress returns the total uploaded bytes so far.
-                # By subtracting it from the current progress bar's progress, we add only
-                # the newly uploaded chunk.
-                with values.thread_lock:
-                    progress_bar.update(status.resumable_progress - progress_bar.n)
-
-            if response is not None:
-
-                # When upload is complete, no status is returned, so the last
-                # bit of progress gets handled here, where we instead use
-                # the filesize of the file, to add the remaining progress
-                with values.thread_lock:
-                    progress_bar.update(file_size - progress_bar.n)
-
-                progress_bar.close()
-
-                if 'id' in response:
-                    print(f"Successfully uploaded {Path(filename).stem}\nWith ID {response['id']}\nAt https://studio.youtube.com/video/{response['id']}/edit")
-                else:
-                    exit("The upload failed with an unexpected response: %s" % response)
-
-        except HttpError as e:
-            if e.resp.status in values.RETRIABLE_STATUS_CODES:
-                error = "A retriable HTTP error %d occurred:\n%s" % (e.resp.status,
-                                                                     e.content)
-            else:
-                progress_bar.close()
-                raise
-        except values.RETRIABLE_EXCEPTIONS as e:
-            error = f"A retriable error occurred: {e}"
-
-        if error is not None:
-            print(error)
-            retry += 1
-            if retry > values.MAX_RETRIES:
-                progress_bar.close()
-                exit("No longer attempting to retry.")
-
-            max_sleep = 2 ** retry
-            sleep_seconds = random.random() * max_sleep
-            print(f"Sleeping {sleep_seconds} seconds and then retrying...")
-            time.sleep(sleep_seconds)
-
-
-# Function for searching own channel for the video
-def video_exists_on_channel(filename: str) -> bool:
-
-    # Remove the upload flag from the filename.
-    # As searches return partial matches
-    # doing this will make sure both new and old
-    # videos are found
-    filename = str(filename).replace(' ytupload', '')
-
-    response = values.youtube.search().list(
-        part='snippet',
-        forMine=True,
-        maxResults=1,
-        q=Path(filename).stem,
-        type='video'
-    ).execute()
-
-    total_results = int(response['pageInfo']['totalResults'])
-
-    return total_results != 0
-
-
-# Function for converting clip to AV1
-def convert_to_av1(values: Values):
-    # Create the logger, add the queue handler
-    # and set the minimum log severity
-    logger = logging.getLogger('converter')
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(QueueHandler(values.queue))
-
-    for root, dirs, files in os.walk(r'C:\Users\nichel\Downloads\Recordings'):
-        for dirname in dirs:
-            # If the folder is the "lossless" folder where I keep my edited clips
-            if dirname == 'lossless':
-
-                # Log "lossless" folder location
-                logger.info(f'Found {Path(root, dirname)}!')
-
-                # Get list of files and iterate over them.
-                # If folder is empty, an empty list will be returned, and thus not run
-                for filename in os.listdir(Path(root, dirname)):
-
-                    # I exlusively work with the mp4 and mkv containers.
-                    # If the file does not have either, assume it should be ignored
-                    if Path(filename).suffix.casefold() not in values.whitelisted_extensions:
-                        logger.info(f'Skipping {filename} with reason: Not in an mp4 or mkv container')
-                        continue
-
-                    # Use the root folder variable to create a variable
-                    # containing the path for the converted folder
-                    # and a variable containing the path as well as filename
-                    # for the new converted file
-                    dirname_converted = Path(root, values.output_folder)
-                    full_file_path_converted = Path(root, values.output_folder, f"{os.path.splitext(filename)[0]}.mp4")
-                    full_file_path = Path(root, dirname, filename)
-
-                    # Check if the folder for converted clips does not exist
-                    # and create it, as well as log it, if it does not
-                    # If it fails, it will instead log the exception and continue with the next file/folder
-                    if not os.path.exists(dirname_converted):
-                        try:
-                            os.mkdir(dirname_converted)
-                            logger.info(f'Created {dirname_converted}.')
-                        except OSError as e:
-                            logger.exception(e)
-                            continue
-
-                    upload_thread = threading.Thread(target=upload_video, args=(full_file_path, values))
-
-                    # the phrase "ytupload" in the filename will be used
-                    # to tell the script it should upload the video.
-                    # If it is not in the filename, then it should not be uploaded
-                    if 'ytupload' in filename.casefold():
-                        logger.info('Video is marked for upload. Checking if video has been uploaded...')
-
-                        if video_exists_on_channel(filename):
-                            logger.info(f'{filename} has aleady been uploaded')
-
-                        else:
-                            logger.info('No matching title found on channel. Uploading...')
-                            upload_thread.start()
-
-                    # Check if a file with the same name already exists
-                    # in the converted folder.
-                    # If their frame counts do not match
-                    # delete, log and convert it.
-                    # Otherwise, assume it has aleady been converted and log it
-                    if os.path.exists(full_file_path_converted):
-                        if get_video_length(full_file_path, values) != get_video_length(full_file_path_converted, values):
-                            os.remove(full_file_path_converted)
-                            logger.info(f'Removed converted {filename} with reason: Framecount mismatch')
-
-                        else:
-                            logger.info(f'Skipping {filename} with reason: Already exists')
-                            continue
-
-                    # Log the file we're about to convert
-                    logger.info(f'Converting {filename}.')
-
-                    # Create a list with ffmpeg and it's paramters, for a high-quality medium-slow AV1 encoding
-                    # a CRF of 45 may seem too high, but it's the perfect mix between
-                    # low filesize and good-enough quality for online sharing.
-                    cmd = ['ffmpeg', '-v', 'fatal', '-n', '-i', str(full_file_path),
-                           '-progress', '-', '-c:v', 'libsvtav1', '-preset', '4',
-                           '-crf', '45', '-b:v', '0', '-c:a', 'aac', '-b:a', '192k',
-                           '-movflags', '+faststart', str(full_file_path_converted)]
-
-                    frames = get_video_length(full_file_path, values)
-
-                    ffmpeg_progress_bar = tqdm(total=frames, unit='frames', desc='Converting', position=2)
-
-                    # Run process and args from above in a non-blocking way
-                    # and pipe the stdout and stderr outputs.
-                    # Reading the output is blocking, and therefore stderr is piped to stdout
-                    # to make sure we're always reading from a pipe that has data
-                    # wether it be the progress of the conversion or an error
-                    try:
-                        p = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-
-                        # Run an infinite loop
-                        while True:
-                            # Decode the output to pure text
-                            stdout = p.stdout.readline().decode()
-
-                            # Get rid of newlines. It's not actually required
-                            # but it bothers me knowing each 2nd line is basically empty
-                            # without it
-                            stdout = stdout.replace('\n', '')
-
-                            # if the current string in our output is the frames progress
-                            if 'frame=' in stdout:
-
-                                # Add only the new frames by subtracting the total converted with the total progress
-                                with values.thread_lock:
-                                    ffmpeg_progress_bar.update(int(stdout.split('=')[1]) - ffmpeg_progress_bar.n)
-
-                            # If the current string in our output instead is the returned progress type.
-                            # ffmpeg uses this to display if it's done or not, by being either "continue"
-                            # or "end"
-                            if 'progress=' in stdout:
-
-                                # if the progress is end, it means it's done converting, and we can break out of the loop
-                                if stdout.split('=')[1] == 'end':
-                                    break
-
-                            # If the process exited due to the file already existing
-                            if 'already exists' in stdout:
-                                break
-
-                        ffmpeg_progress_bar.close()
-
-                    except FileNotFoundError:
-                        ffmpeg_progress_bar.close()
-                        logger.exception('Failed to find ffmpeg executable')
-                        print('No ffmpeg exectuable was found.')
-                        exit()
-
-                    except KeyboardInterrupt:
-                        ffmpeg_progress_bar.close()
-                        print('Keyboard interrupt received. Quitting...')
-                        os.remove(full_file_path_converted)
-                        logger.info(f'Removed converted {filename} with reason: Keyboard interrupt')
-                        exit()
-
-                    if upload_thread.is_alive():
-                        upload_thread.join()
-
-            # Log folders ignored by the script
-            else:
-                logger.info(f'Ignoring folder {Path(root, dirname)}.')
-
-
-# Function for getting the length of the original and converted video, in frames
-def get_video_length(filename: str, values: Values) -> int:
-    # Create the logger, add the queue handler
-    # and set the minimum log severity
-    logger = logging.getLogger('video_length')
-    logger.addHandler(QueueHandler(values.queue))
-    logger.setLevel(logging.DEBUG)
-
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
-           '-show_entries', 'stream=nb_frames', '-of', 'json', str(filename)]
-
-    try:
-        p = run(cmd, check=True, capture_output=True)
-
-    except CalledProcessError as e:
-        logger.exception(e)
-        print('Error getting video durations. Check logs for details')
-        if 'Invalid data found when processing input' in e.stderr.decode():
-            os.remove(filename)
-            logger.info(f'Removed converted {filename} with reason: Corruption or unfinished encoding')
-        exit()
-
-    except FileNotFoundError:
-        logger.exception('Failed to find ffprobe executable')
-        print('No ffprobe exectuable was found.')
-        exit()
-
-    try:
-        # ffprobe outputs the file metadata in json format
-        # which lets us easily get the frame count by parsing the json.
-        # The json string consists of a list of streams, where we select
-        # the first stream(video) and get the frame count from it.
-        frames = int(loads(p.stdout)['streams'][0]['nb_frames'])
-        return frames
-
-    except KeyError as e:
-        logger.exception(e)
-        print('Could not find any frames metadata in the video')
-        exit()
-
-
-if __name__ == '__main__':
-    # Instance an object of our values class for easier passing and workflow
-    values = Values()
-
-    # Create and add a multiprocessing queue to our values object
-    values.queue = Queue()
-
-    # Create and add a threading lock to our values object
-    values.thread_lock = threading.Lock()
-
-    # Set the name of the program the logs will appear under.
-    # This will make it easier to see which section of the
-    # script the log appeared from
-    logger = logging.getLogger('main')
-
-    # Add queue handler using our queue inside the object
-    # and set the minimum log severity
-    logger.addHandler(QueueHandler(values.queue))
-    logger.setLevel(logging.DEBUG)
-
-    # create and start logger thread
-    logger_p = threading.Thread(target=logger_process, args=(values.queue,))
-    logger_p.start()
-
-    logger.info('#Starting script#')
-    logger.info(f'Started logging on {logger_p.native_id}')
-
-    # Create and add youtube API interaction object
-    # to our values object
-    values.youtube = get_authenticated_service(values)
-
-    # Later versions do not seem to play nice with the Google API modules
-    # resulting in uploads failing with an error resembling
-    # "Redirected but the response is missing a Location: header"
-    # if a chunksize is specified in MediaFileUpload.
-    # External sources say 0.15.0 and down work, but as I haven't tested this
-    # we will assume only 0.15.0 works, but still allow the script to run
-    if httplib2.__version__ != '0.15.0':
-        logger.warning(f'httplib2 version 0.15.0 is specifically required, but {httplib2.__version__} is installed')
-
-    convert_to_av1(values)
-    # Add None to our queue to let the logger thread know
-    # we're done executing, and should quit
-    values.queue.put(None)
+# Import required modules
+import argparse
+import hashlib
+import hmac
+import ipaddress
+import logging
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from fnmatch import fnmatch
+from heapq import heappop, heappush, nsmallest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from json import dump, dumps, load, loads
+from contextlib import contextmanager
+from functools import cache
+from copy import copy
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from queue import Queue
+from subprocess import PIPE, STDOUT, CalledProcessError, Popen, run
+
+import httplib2
+from tqdm import tqdm
+
+
+class Values:
+    # Filename patterns of the clips the script will convert to AV1 MP4.
+    # Patterns are matched without regard to case
+    include_patterns = ['*.mkv', '*.mp4']
+
+    # Filename and folder name patterns the script will ignore, even if they match the above.
+    # Matching folders are not searched
+    exclude_patterns = []
+
+    # Number of threads walking the subfolders of the recordings folders at the same time
+    scan_jobs = 1
+
+    # Number of found clips the scanner may get ahead of the converter by
+    scan_queue_size = 256
+
+    # Folder the converted files will be stored in, relative to the folder they came from
+    output_folder = 'AV1'
+
+    # Folders containing the recordings, which will be searched for "lossless" folders
+    recordings_folders = [r'C:\Users\nichel\Downloads\Recordings']
+
+    # Whether to run the tuner instead of converting
+    tune = False
+
+    # Whether to split long clips into segments that are converted at the same time.
+    # Finished segments are kept if the script is interrupted, and reused next time
+    segmented = False
+
+    # Clips at least this many seconds long are converted in segments
+    segment_min_seconds = 600
+
+    # Length of each segment in seconds. Segments start on a keyframe, so they are usually a bit longer
+    segment_seconds = 120
+
+    # Number of segments of a clip converted at the same time.
+    # None means one per segment_threads threads of the CPU available to the clip,
+    # which is its worker's share and the shares of the workers that are idle when it starts
+    segment_jobs = None
+
+    # Threads each segment is converted with when segment_jobs is None.
+    # Encoders with fewer threads each make better use of the CPU than a single large one
+    segment_threads = 4
+
+    # Whether to keep running after going through the recordings folders,
+    # and convert new clips as they are added
+    watch = False
+
+    # Seconds a new clip's size and modification time must stay the same
+    # before it's considered finished and converted
+    watch_stable_seconds = 30
+
+    # Seconds between listing the "lossless" folders, when watchdog isn't installed
+    # and file system events can't be used
+    watch_poll_interval = 10
+
+    # Seconds between walking the recordings folders for new "lossless" folders when polling
+    watch_rescan_interval = 600
+
+    # SVT-AV1 preset and constant rate factor used for converting
+    preset = 4
+    crf = 45
+
+    # Bitrate of the AAC audio in the converted clips
+    audio_bitrate = '192k'
+
+    # Whether to also make a small H.264 preview of each clip, for sharing in chat.
+    # It's made from the same decoded frames as the AV1 conversion, so the original is only decoded once.
+    # Previews and thumbnails are only made for clips converted in a single pass
+    preview = False
+
+    # Height, x264 preset, CRF and audio bitrate of the previews
+    preview_height = 720
+    preview_preset = 'veryfast'
+    preview_crf = 28
+    preview_audio_bitrate = '128k'
+
+    # Number of thumbnails taken from keyframes spread over each clip while converting it.
+    # The middle one is used as the thumbnail of the uploaded video. 0 means no thumbnails are made
+    thumbnail_count = 0
+
+    # Width of the thumbnails. YouTube recommends 1280x720
+    thumbnail_width = 1280
+
+    # Name of the file storing the preset and CRF chosen by the tuner.
+    # If it exists, it replaces the preset and CRF above
+    encode_profile_file = 'encode profile.json'
+
+    # Presets and CRFs tried by the tuner
+    tune_presets = [4, 6, 8, 10]
+    tune_crfs = [40, 45, 50]
+
+    # Number of clips the tuner takes a segment from, and the length of each segment in seconds
+    tune_samples = 3
+    tune_segment_seconds = 10
+
+    # How much worse than the current settings the tuner allows the chosen settings to be.
+    # The SSIM may be this much lower, and the size this many times larger
+    tune_ssim_tolerance = 0.002
+    tune_size_tolerance = 0.05
+
+    # Name of the database remembering which clips have been converted and uploaded
+    state_index_file = 'clip state.sqlite3'
+
+    # Tell httplib not to handle retrying after errors, as we handle it ourselves
+    httplib2.RETRIES = 1
+
+    # Upload retry attempts before quitting
+    MAX_RETRIES = 10
+
+    # Exceptions that still allow us to retry
+    RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, IOError)
+
+    # Status codes that still allow us to retry
+    RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+
+    # Name of the oauth file containing the oauth data for the project
+    CLIENT_SECRETS_FILE = 'client_oauth.json'
+
+    # Scopes we'll be using in the API
+    YOUTUBE_SCOPES = ['https://www.googleapis.com/auth/youtube.readonly',
+                      'https://www.googleapis.com/auth/youtube.upload']
+
+    # Name of the service we're using
+    YOUTUBE_API_SERVICE_NAME = "youtube"
+
+    # Version of the service we're using
+    YOUTUBE_API_VERSION = "v3"
+
+    # Where the discovery document describing the API is downloaded from, if there's no copy of it
+    DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{apiVersion}/rest'
+
+    # Name of the file storing the copy of the discovery document
+    discovery_document_file = 'youtube v3 discovery.json'
+
+    # Add empty youtube variable for storing the youtube API object.
+    # It's only created once a clip has to be looked up on the channel
+    youtube = None
+
+    # Add empty backoff variable for storing the AuthenticationBackoff object of the youtube object above,
+    # so a failed authentication isn't tried again for every clip
+    youtube_backoff = None
+
+    # Seconds to wait before authenticating again after a failure that may be temporary, like a network error.
+    # The wait doubles with every failure in a row, up to the maximum
+    auth_retry_seconds = 30
+    auth_retry_max_seconds = 10 * 60
+
+    # Add empty queue variable for storing the Queue object
+    queue = None
+
+    # Name of the log file, which is rotated once it reaches the size below.
+    # This many rotated files are kept
+    log_file = 'clip converter and uploader.log'
+    log_max_bytes = 10 * 1024 * 1024
+    log_backup_count = 5
+
+    # Add empty thread lock variable for storing the threading.Lock object
+    thread_lock = None
+
+    # Number of clips converted at the same time.
+    # SVT-AV1 stops scaling well past around 8 threads per encode,
+    # so by default we run one encode per 8 cores
+    jobs = max(1, (os.cpu_count() or 1) // 8)
+
+    # Add empty queue variable for storing the EncodeScheduler object
+    encode_queue = None
+
+    # Seconds taken off a queued clip's predicted conversion time for every second it waits,
+    # so long clips aren't held back forever by new, shorter clips in watch mode
+    schedule_aging = 1.0
+
+    # Pixels converted per second by a single encode, used to predict conversion times
+    # until a clip has been converted with the current settings.
+    # Roughly 1080p at 30 FPS with the default preset
+    default_encode_speed = 1920 * 1080 * 30
+
+    # Weight kept by the encode speed measured in earlier conversions when a new one is added,
+    # so the predictions follow changes to the machine
+    encode_speed_decay = 0.9
+
+    # Add empty event variable for telling the encode workers to stop early
+    stop_event = None
+
+    # Fast folder the next clips in the queue are copied to while the current ones are converting,
+    # so the encoder and the uploads aren't reading the recordings drive at the same time.
+    # The clips are converted into it as well, and moved to the AV1 folder once verified.
+    # None means clips are converted straight from and into their folders
+    staging_folder = None
+
+    # Number of queued clips copied to the staging folder ahead of the encode workers
+    staging_ahead = 2
+
+    # Space the copies in the staging folder may take up, in bytes.
+    # Copies of clips that are no longer next in the queue are removed to make room
+    staging_budget = 64 * 1024 * 1024 * 1024
+
+    # Size of each read when copying a clip to the staging folder.
+    # Large reads keep the recordings drive reading sequentially
+    staging_read_size = 16 * 1024 * 1024
+
+    # Add empty stager variable for storing the SourceStager object
+    stager = None
+
+    # Add empty state index variable for storing the StateIndex object
+    state_index = None
+
+    # Number of ffprobe processes allowed to run at the same time
+    probe_jobs = 4
+
+    # Number of probed files remembered by the metadata service
+    probe_cache_size = 1024
+
+    # Add empty metadata variable for storing the MetadataService object
+    metadata = None
+
+    # Number of videos uploaded at the same time
+    upload_jobs = 2
+
+    # Number of videos allowed to wait for a free upload worker.
+    # Once reached, anything wanting to queue an upload waits until there's room
+    max_pending_uploads = 16
+
+    # Add empty queue variable for storing the upload job Queue object
+    upload_queue = None
+
+    # Name of the file storing the titles and IDs of the videos on the channel
+    channel_index_file = 'channel uploads.json'
+
+    # Seconds between refreshes of the channel's videos, so videos uploaded by hand
+    # are still found when running in watch mode
+    channel_refresh_seconds = 15 * 60
+
+    # Add empty channel index variable for storing the ChannelIndex object
+    channel_index = None
+
+    # Upload chunks are resized after each chunk, so that a chunk takes
+    # around this many seconds to upload, within the sizes below.
+    # Chunk sizes have to be a multiple of 256 KiB
+    upload_chunk_seconds = 8
+    upload_chunk_min = 1024 * 1024
+    upload_chunk_max = 64 * 1024 * 1024
+
+    # Combined upload speed limit for all upload workers, in bytes per second.
+    # None means there's no limit
+    upload_bandwidth_limit = None
+
+    # Add empty bucket variable for storing the TokenBucket object used to limit upload speed
+    upload_bucket = None
+
+    # Whether to upload the lossless original instead of the converted clip.
+    # The original is then uploaded while it's being converted
+    upload_source = False
+
+    # Whether to start uploading the converted clip while it's still being converted.
+    # The clip is written as a fragmented MP4, which is only ever appended to,
+    # and the last chunk is held back until the conversion has been verified
+    stream_upload = False
+
+    # Port of the local HTTP server exposing live metrics. None means the server isn't started
+    metrics_port = None
+
+    # Port the coordinator listens on for remote encode workers, and the address it listens on.
+    # None means clips are only converted by this machine.
+    # Only this machine can reach it by default, and listening on other addresses requires a token
+    coordinator_port = None
+    coordinator_address = '127.0.0.1'
+
+    # Token remote workers have to send to the coordinator. None means no token is required
+    coordinator_token = None
+
+    # Seconds a remote worker's lease on a clip lasts without a heartbeat,
+    # after which the clip is given to another worker
+    lease_seconds = 60
+
+    # Add empty coordinator variable for storing the Coordinator object
+    coordinator = None
+
+    # URL of the coordinator, when running as a remote encode worker
+    worker_url = None
+
+    # Seconds a remote worker waits before asking again when the coordinator has no clips for it
+    worker_poll_interval = 10
+
+    # Folder remote workers download originals to and convert them in, when they can't read them directly
+    worker_folder = os.path.join(tempfile.gettempdir(), 'clip converter worker')
+
+    # Add empty metrics variable for storing the Metrics object
+    metrics = None
+
+
+# On-disk index of every clip the script has seen, and how far along it is.
+# Clips are identified by their path, size and modification time,
+# so an unchanged clip can be skipped without running ffprobe on it
+class StateIndex:
+    def __init__(self, filename: str):
+        # The connection is shared between the walker, encode and upload threads
+        # so access to it is serialized with a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS clips (
+                                       source TEXT PRIMARY KEY,
+                                       size INTEGER NOT NULL,
+                                       mtime_ns INTEGER NOT NULL,
+                                       settings TEXT NOT NULL,
+                                       converted INTEGER NOT NULL DEFAULT 0,
+                                       verified INTEGER NOT NULL DEFAULT 0,
+                                       uploaded INTEGER NOT NULL DEFAULT 0,
+                                       video_id TEXT,
+                                       updated REAL NOT NULL)''')
+
+            # Resumable upload sessions, so an interrupted upload
+            # can continue where it left off the next time the script runs
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS upload_sessions (
+                                       file TEXT PRIMARY KEY,
+                                       size INTEGER NOT NULL,
+                                       mtime_ns INTEGER NOT NULL,
+                                       resumable_uri TEXT NOT NULL,
+                                       progress INTEGER NOT NULL,
+                                       updated REAL NOT NULL)''')
+
+            # Conversions and uploads by the fingerprint of the original's content,
+            # so a renamed or copied clip can reuse them instead of being converted or uploaded again
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS fingerprints (
+                                       fingerprint TEXT PRIMARY KEY,
+                                       output TEXT,
+                                       settings TEXT,
+                                       video_id TEXT,
+                                       updated REAL NOT NULL)''')
+
+            # Pixels converted and seconds spent converting them for each encode setting,
+            # for predicting how long the next conversions will take
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS encode_speeds (
+                                       settings TEXT PRIMARY KEY,
+                                       pixels REAL NOT NULL,
+                                       seconds REAL NOT NULL,
+                                       updated REAL NOT NULL)''')
+
+    # Returns the stored state of a clip, or None if the clip is unknown
+    # or has changed since it was stored
+    def get(self, source: Path, size: int, mtime_ns: int) -> sqlite3.Row:
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM clips WHERE source = ?', (str(source),)).fetchone()
+
+        if row is None or row['size'] != size or row['mtime_ns'] != mtime_ns:
+            return None
+
+        return row
+
+    # Stores the given states for a clip.
+    # If the clip itself changed, everything we knew about it is forgotten,
+    # and if only the encode settings changed, the conversion states are forgotten
+    def set(self, source: Path, size: int, mtime_ns: int, settings: str, **states):
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT * FROM clips WHERE source = ?', (str(source),)).fetchone()
+
+            if row is None or row['size'] != size or row['mtime_ns'] != mtime_ns:
+                current = dict(converted=0, verified=0, uploaded=0, video_id=None)
+            elif row['settings'] != settings:
+                current = dict(converted=0, verified=0, uploaded=row['uploaded'], video_id=row['video_id'])
+            else:
+                current = dict(converted=row['converted'], verified=row['verified'],
+                               uploaded=row['uploaded'], video_id=row['video_id'])
+
+            current.update(states)
+
+            self.connection.execute('''INSERT OR REPLACE INTO clips
+                                       (source, size, mtime_ns, settings, converted, verified, uploaded, video_id, updated)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                    (str(source), size, mtime_ns, settings, int(current['converted']),
+                                     int(current['verified']), int(current['uploaded']), current['video_id'], time.time()))
+
+    # Returns the resumable upload session of a file, or None if there isn't one
+    # or the file has changed since the session was started
+    def get_upload_session(self, file: Path, size: int, mtime_ns: int) -> sqlite3.Row:
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM upload_sessions WHERE file = ?', (str(file),)).fetchone()
+
+        if row is None or row['size'] != size or row['mtime_ns'] != mtime_ns:
+            return None
+
+        return row
+
+    def set_upload_session(self, file: Path, size: int, mtime_ns: int, resumable_uri: str, progress: int):
+        with self.lock, self.connection:
+            self.connection.execute('''INSERT OR REPLACE INTO upload_sessions
+                                       (file, size, mtime_ns, resumable_uri, progress, updated)
+                                       VALUES (?, ?, ?, ?, ?, ?)''',
+                                    (str(file), size, mtime_ns, resumable_uri, progress, time.time()))
+
+    def clear_upload_session(self, file: Path):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM upload_sessions WHERE file = ?', (str(file),))
+
+    # Returns whether a clip is unchanged and was converted and verified with the given settings
+    def is_verified(self, source: Path, settings: str) -> bool:
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return False
+
+        row = self.get(source, stat.st_size, stat.st_mtime_ns)
+        return row is not None and bool(row['verified']) and row['settings'] == settings
+
+    # Returns the conversion and upload of the clips with the given fingerprint, or None if none have been seen
+    def get_fingerprint(self, fingerprint: str) -> sqlite3.Row:
+        with self.lock:
+            return self.connection.execute('SELECT * FROM fingerprints WHERE fingerprint = ?', (fingerprint,)).fetchone()
+
+    # Stores the conversion or upload of a clip under its fingerprint, keeping the rest of what's known about it
+    def set_fingerprint(self, fingerprint: str, **fields):
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT * FROM fingerprints WHERE fingerprint = ?', (fingerprint,)).fetchone()
+
+            if row is None:
+                current = dict(output=None, settings=None, video_id=None)
+            else:
+                current = dict(output=row['output'], settings=row['settings'], video_id=row['video_id'])
+
+            current.update(fields)
+
+            self.connection.execute('''INSERT OR REPLACE INTO fingerprints (fingerprint, output, settings, video_id, updated)
+                                       VALUES (?, ?, ?, ?, ?)''',
+                                    (fingerprint, current['output'], current['settings'], current['video_id'], time.time()))
+
+    # Returns the pixels per second converted with the given settings in earlier runs, or None if unknown
+    def get_encode_speed(self, settings: str) -> float:
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM encode_speeds WHERE settings = ?', (settings,)).fetchone()
+
+        if row is None or row['seconds'] <= 0:
+            return None
+        return row['pixels'] / row['seconds']
+
+    # Adds a conversion to the speed measured for the given settings.
+    # Earlier conversions are weighted down by decay, so recent conversions count the most
+    def add_encode_speed(self, settings: str, pixels: float, seconds: float, decay: float):
+        with self.lock, self.connection:
+            self.connection.execute('''INSERT INTO encode_speeds (settings, pixels, seconds, updated)
+                                       VALUES (?, ?, ?, ?)
+                                       ON CONFLICT (settings) DO UPDATE SET
+                                       pixels = pixels * ? + excluded.pixels,
+                                       seconds = seconds * ? + excluded.seconds,
+                                       updated = excluded.updated''',
+                                    (settings, pixels, seconds, time.time(), decay, decay))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Live numbers about the encodes, uploads and queues, for seeing throughput problems
+# without reading the logs. Exposed in the Prometheus text format and as JSON by the MetricsServer
+class Metrics:
+    def __init__(self, values: Values):
+        self.values = values
+        self.lock = threading.Lock()
+
+        # Maps clip names to their latest encode or upload numbers
+        self.encodes = {}
+        self.uploads = {}
+
+        # Running totals since the script started
+        self.counters = dict(clips_converted=0, clips_failed=0, videos_uploaded=0, uploads_failed=0,
+                             frames_encoded=0, bytes_uploaded=0)
+
+    def set_encode(self, name: str, **fields):
+        with self.lock:
+            self.encodes.setdefault(name, {}).update(fields)
+
+    def remove_encode(self, name: str):
+        with self.lock:
+            self.encodes.pop(name, None)
+
+    def set_upload(self, name: str, **fields):
+        with self.lock:
+            self.uploads.setdefault(name, {}).update(fields)
+
+    def remove_upload(self, name: str):
+        with self.lock:
+            self.uploads.pop(name, None)
+
+    def increment(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    # Returns a copy of all the numbers, including the current queue depths
+    def snapshot(self) -> dict:
+        queue_depths = dict(
+            encode=self.values.encode_queue.qsize() if self.values.encode_queue is not None else 0,
+            upload=self.values.upload_queue.qsize() if self.values.upload_queue is not None else 0
+        )
+        queue_eta = self.values.encode_queue.eta() if self.values.encode_queue is not None else 0
+
+        with self.lock:
+            return dict(
+                encodes={name: dict(fields) for name, fields in self.encodes.items()},
+                uploads={name: dict(fields) for name, fields in self.uploads.items()},
+                counters=dict(self.counters),
+                queue_depths=queue_depths,
+                queue_eta_seconds=round(queue_eta)
+            )
+
+    # Returns the numbers in the Prometheus text format
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        for counter, value in snapshot['counters'].items():
+            lines.append(f'# TYPE clip_converter_{counter}_total counter')
+            lines.append(f'clip_converter_{counter}_total {value}')
+
+        lines.append('# TYPE clip_converter_queue_depth gauge')
+        for name, depth in snapshot['queue_depths'].items():
+            lines.append(f'clip_converter_queue_depth{{queue="{name}"}} {depth}')
+
+        lines.append('# TYPE clip_converter_queue_eta_seconds gauge')
+        lines.append(f'clip_converter_queue_eta_seconds {snapshot["queue_eta_seconds"]}')
+
+        for group, jobs in (('encode', snapshot['encodes']), ('upload', snapshot['uploads'])):
+            metric_names = sorted({field for fields in jobs.values() for field in fields})
+            for field in metric_names:
+                lines.append(f'# TYPE clip_converter_{group}_{field} gauge')
+                for name, fields in jobs.items():
+                    # Only numbers can be gauges, which leaves out names like the remote worker's
+                    if not isinstance(fields.get(field), (int, float)):
+                        continue
+
+                    # Quotes and backslashes have to be escaped in label values
+                    label = name.replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append(f'clip_converter_{group}_{field}{{clip="{label}"}} {fields[field]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Request handler for the metrics server.
+# /metrics returns the Prometheus text format, and /stats returns JSON
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.server.metrics.prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/stats':
+            body = dumps(self.server.metrics.snapshot()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are already visible through the metrics themselves,
+    # so they aren't printed over the progress bars
+    def log_message(self, format, *args):
+        pass
+
+
+# Function for starting the metrics server in the background on localhost
+def start_metrics_server(values: Values) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', values.metrics_port), MetricsRequestHandler)
+    server.metrics = values.metrics
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+# Returns a string describing the encode settings, stored alongside each clip in the state index.
+# If any of them change, previously converted clips will be converted again
+def get_encode_settings(values: Values) -> str:
+    return f'libsvtav1 preset={values.preset} crf={values.crf} aac {values.audio_bitrate}'
+
+
+# Formatter writing each log record as a single line of JSON, so the logs can be filtered
+# and the timing spans added up without parsing free text.
+# Tracebacks are already part of the message once a record has passed through the queue
+class JsonFormatter(logging.Formatter):
+    # Extra fields added to records by the timing spans
+    extra_fields = ('stage', 'clip', 'duration')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(
+            time=self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            level=record.levelname,
+            logger=record.name,
+            thread=record.threadName,
+            message=record.getMessage()
+        )
+
+        for field in self.extra_fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+
+        return dumps(entry)
+
+
+# Function for setting up logging, once, for the whole script.
+# Every logger passes its records through a single queue handler on the root logger,
+# and a listener thread writes them to a rotating file of JSON lines.
+# Returns the listener, which must be stopped before quitting to write the remaining records
+def setup_logging(values: Values) -> QueueListener:
+    # Create logging handler that uses a file on disk as the log location.
+    # Earlier runs are kept, and the file is rotated once it gets too large
+    file_handler = RotatingFileHandler(
+        filename=values.log_file,
+        maxBytes=values.log_max_bytes,
+        backupCount=values.log_backup_count,
+        encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    # Send every record to the queue, and set minimum required log level severity
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(values.queue))
+    root_logger.setLevel(logging.DEBUG)
+
+    listener = QueueListener(values.queue, file_handler)
+    listener.start()
+    return listener
+
+
+# Context manager logging how long a stage of handling a clip took, like probing or uploading it.
+# The stage, clip and duration in seconds are added to the record as their own fields
+@contextmanager
+def timed(stage: str, clip: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = round(time.perf_counter() - started, 3)
+        logging.getLogger('timing').info(f'{stage} of {clip} took {duration} seconds',
+                                         extra=dict(stage=stage, clip=clip, duration=duration))
+
+
+# Raised when we can't authenticate with YouTube.
+# Permanent failures, like the Google API client or the OAuth file missing, won't go away by trying again
+class AuthenticationError(Exception):
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+# Keeps track of failed attempts at authenticating, and when to try again
+class AuthenticationBackoff:
+    def __init__(self, values: Values):
+        self.values = values
+        self.failures = 0
+        self.retry_at = 0.0
+        self.given_up = False
+
+    # Returns the seconds left until authenticating should be tried again
+    def remaining(self) -> float:
+        return max(0.0, self.retry_at - time.monotonic())
+
+    # Records a failed attempt, and returns the seconds until the next one,
+    # or None if it's not worth trying again
+    def failed(self, error: AuthenticationError) -> float:
+        if error.permanent:
+            self.given_up = True
+            return None
+
+        self.failures += 1
+        delay = min(self.values.auth_retry_max_seconds, self.values.auth_retry_seconds * 2 ** (self.failures - 1))
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+    def succeeded(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+# Returns an object that can be used to interact with the API.
+# Raises AuthenticationError if authenticating fails
+def get_authenticated_service(values: Values):
+    logger = logging.getLogger('authenticator')
+
+    try:
+        # The Google API client takes a while to import, so it's only imported once something needs YouTube
+        from googleapiclient.discovery import build_from_document
+        from oauth2client.client import flow_from_clientsecrets
+        from oauth2client.clientsecrets import InvalidClientSecretsError
+        from oauth2client.file import Storage
+        from oauth2client.tools import run_flow
+
+        # Create a flow object from the oauth file and scopes
+        flow = flow_from_clientsecrets(values.CLIENT_SECRETS_FILE,
+                                       scope=values.YOUTUBE_SCOPES)
+
+        # Create a storage object from a previously saved oauth token
+        # and get the credentials. If it doesn't exist, credentials will be None
+        storage = Storage("%s-oauth2.json" % sys.argv[0])
+        credentials = storage.get()
+
+        # If the credentials didn't already exist or are incorrect
+        # get new credentials and save the token to disk
+        if credentials is None or credentials.invalid:
+            logger.info('No valid credentials found. Running local webserver to authenticate with user')
+            credentials = run_flow(flow, storage)
+
+        # Build and return the object used to interact with the YouTube API,
+        # from a copy of the discovery document instead of downloading it every time
+        return build_from_document(get_discovery_document(values), http=credentials.authorize(httplib2.Http()))
+
+    # This has to be checked first, as the other errors can't be caught without the modules
+    except ImportError as e:
+        print('The Google API client is not installed. Install the modules in requirements.txt to upload')
+        logger.exception(e)
+        raise AuthenticationError('The Google API client is not installed', permanent=True) from e
+
+    # If the oauth file does not exist or is incorrectly formatted/corrupted
+    # and log it
+    except InvalidClientSecretsError as e:
+        print('"client_oath.json" could not be found or had errors')
+        logger.exception(e)
+        raise AuthenticationError('"client_oath.json" could not be found or had errors', permanent=True) from e
+
+    # Catch any other error and log it as well
+    except Exception as e:
+        print('Unknown error. Check logs for details')
+        logger.exception(e)
+        raise AuthenticationError('Unknown error while authenticating') from e
+
+
+# Function for getting the discovery document describing the YouTube API, which the youtube object is built from.
+# The saved copy is used if there is one. Otherwise the copy that comes with the Google API client is used,
+# and it's only downloaded if the client doesn't have one. Either way it's saved for next time
+def get_discovery_document(values: Values) -> str:
+    logger = logging.getLogger('authenticator')
+
+    if os.path.exists(values.discovery_document_file):
+        with open(values.discovery_document_file, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    # Older versions of the Google API client don't come with any discovery documents
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc(values.YOUTUBE_API_SERVICE_NAME, values.YOUTUBE_API_VERSION)
+    except ImportError:
+        document = None
+
+    if document is None:
+        logger.info('Downloading the discovery document of the YouTube API')
+        url = values.DISCOVERY_URL.format(api=values.YOUTUBE_API_SERVICE_NAME, apiVersion=values.YOUTUBE_API_VERSION)
+        response, content = httplib2.Http().request(url)
+        if response.status != 200:
+            raise OSError(f'Downloading the discovery document failed with status {response.status}')
+        document = content.decode('utf-8')
+
+    # Write to a temporary file first, so a crash can't leave a half-written copy behind
+    temp_filename = f'{values.discovery_document_file}.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+        f.write(document)
+    os.replace(temp_filename, values.discovery_document_file)
+
+    return document
+
+
+# Function for getting the main thread's youtube object, used to look clips up on the channel.
+# It authenticates the first time it's called, so runs that only convert never load the Google API client
+# or need a connection. Returns None if authenticating failed, in which case it isn't tried again.
+# Only the main thread looks clips up, so no lock is needed
+def get_youtube(values: Values):
+    logger = logging.getLogger('authenticator')
+
+    if values.youtube_backoff is None:
+        values.youtube_backoff = AuthenticationBackoff(values)
+    backoff = values.youtube_backoff
+
+    if values.youtube is None and not backoff.given_up and not backoff.remaining():
+        logger.info('Authenticating to look up clips on the channel')
+        try:
+            values.youtube = get_authenticated_service(values)
+            backoff.succeeded()
+
+        # get_authenticated_service has already logged the reason
+        except AuthenticationError as e:
+            delay = backoff.failed(e)
+            if delay is None:
+                logger.error('Failed to authenticate. Clips can only be looked up in the saved copy of the channel')
+            else:
+                logger.error('Failed to authenticate. Clips are looked up in the saved copy of the channel '
+                             f'until trying again in {delay} seconds')
+
+    return values.youtube
+
+
+# Raised when an upload can't be completed
+class UploadError(Exception):
+    pass
+
+
+# Token bucket used to limit the combined upload speed of the upload workers.
+# Tokens are bytes, refilled at the given rate, and a worker has to take
+# as many tokens as it's about to upload before it sends a chunk
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Takes the given number of tokens, sleeping until they've been refilled if there aren't enough.
+    # Chunks can be larger than the bucket, so the bucket is allowed to go into debt,
+    # which the next caller then has to wait for
+    def consume(self, amount: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Function for calculating the next upload chunk size from the measured upload speed
+def get_chunk_size(bytes_per_second: float, values: Values) -> int:
+    chunk_size = int(bytes_per_second * values.upload_chunk_seconds)
+
+    # Round down to the nearest 256 KiB, and keep it within the configured sizes
+    chunk_size -= chunk_size % (256 * 1024)
+    return max(values.upload_chunk_min, min(values.upload_chunk_max, chunk_size))
+
+
+# Container for everything an upload worker needs to know to upload a single video
+class UploadJob:
+    def __init__(self, file: Path, job, streaming: bool = False):
+        # Path of the file being uploaded
+        self.file = file
+
+        # The encode job of the clip the file belongs to. Its source identifies the clip in the state index
+        self.job = job
+
+        # Whether the file is still being written by the encoder while it's uploaded
+        self.streaming = streaming
+
+
+# Returns the GrowingFileUpload class. The Google API client only accepts uploads subclassing its MediaUpload,
+# and it's only imported once something needs YouTube, so the class is made the first time it's used
+@cache
+def get_growing_file_upload_class() -> type:
+    from googleapiclient.http import MediaUpload
+
+    # Media upload reading a file while the encoder is still writing it.
+    # The size stays unknown until the encode has finished, which makes the client
+    # send each chunk without a total, and reads block until a whole chunk has been written.
+    # A short read tells the client it has reached the end of the file
+    class GrowingFileUpload(MediaUpload):
+        def __init__(self, upload_job: UploadJob, chunksize: int, values: Values):
+            self.upload_job = upload_job
+            self.values = values
+            self._chunksize = chunksize
+
+        def chunksize(self) -> int:
+            return self._chunksize
+
+        def mimetype(self) -> str:
+            return 'video/mp4'
+
+        # Returns the file being read. Once the conversion has been verified,
+        # the temporary file being uploaded has been renamed to the output
+        def path(self) -> Path:
+            job = self.upload_job.job
+            if job.encoded.is_set() and job.encode_succeeded:
+                return job.output
+            return self.upload_job.file
+
+        # Returns the size of the file once the encode has finished successfully, and None until then
+        def size(self):
+            job = self.upload_job.job
+            if job.encoded.is_set() and job.encode_succeeded:
+                return os.path.getsize(job.output)
+            return None
+
+        def resumable(self) -> bool:
+            return True
+
+        def has_stream(self) -> bool:
+            return False
+
+        def stream(self):
+            return None
+
+        # Waits until the requested bytes have been written, or the encode has finished, and returns them
+        def getbytes(self, begin: int, length: int) -> bytes:
+            job = self.upload_job.job
+
+            while True:
+                finished = job.encoded.is_set()
+
+                if self.values.stop_event.is_set():
+                    raise UploadError('Stopped while streaming the upload')
+
+                # Never send the end of the file for a conversion that failed,
+                # so YouTube never finishes processing a broken video
+                if finished and not job.encode_succeeded:
+                    raise UploadError('The conversion failed while it was being uploaded')
+
+                path = self.path()
+                available = os.path.getsize(path) if os.path.exists(path) else 0
+                if available >= begin + length or finished:
+                    with open(path, 'rb') as f:
+                        f.seek(begin)
+                        return f.read(length)
+
+                job.encoded.wait(0.5)
+
+    return GrowingFileUpload
+
+
+# Function for getting the file that should be uploaded for a clip
+def get_upload_file(job, values: Values) -> Path:
+    return job.source if values.upload_source else job.output
+
+
+# Worker function pulling videos off the upload queue until it receives None
+def upload_worker(worker_id: int, values: Values):
+    logger = logging.getLogger(f'uploader-{worker_id}')
+
+    youtube = None
+    backoff = AuthenticationBackoff(values)
+
+    while True:
+        upload_job = values.upload_queue.get()
+
+        # We use None to signal there are no more videos
+        if upload_job is None:
+            break
+
+        # Keep emptying the queue when stopping early,
+        # so nothing waiting to add an upload gets stuck
+        if values.stop_event.is_set():
+            continue
+
+        # Authenticate once there's something to upload, so runs without uploads don't have to.
+        # After a failure that may be temporary, like a network error, the worker waits and tries again
+        # while holding on to the video, and only gives up on the video after a number of attempts
+        attempts = 0
+        while youtube is None and not backoff.given_up and attempts <= values.MAX_RETRIES:
+            if values.stop_event.wait(backoff.remaining()):
+                break
+            attempts += 1
+            youtube = authenticate_upload_worker(worker_id, values, backoff)
+
+        if youtube is None:
+            if not values.stop_event.is_set():
+                logger.error(f'Not uploading {upload_job.file.stem} with reason: Could not authenticate')
+            continue
+
+        # Any error only fails this upload, including unexpected ones like the credentials failing to refresh.
+        # A worker that stopped would leave the queue to fill up, and whatever's adding to it waiting forever
+        try:
+            # Each worker's progress bar goes on its own line at the top
+            upload_video(upload_job, youtube, values, position=worker_id)
+        except Exception as e:
+            print(f'Failed to upload {upload_job.file.stem}. Check logs for details')
+            logger.exception(e)
+            values.metrics.increment('uploads_failed')
+
+
+# Function for authenticating an upload worker. Returns None if it failed,
+# and records the failure in the worker's backoff
+def authenticate_upload_worker(worker_id: int, values: Values, backoff: AuthenticationBackoff):
+    logger = logging.getLogger(f'uploader-{worker_id}')
+
+    logger.info('Authenticating for upload')
+
+    # Each worker authenticates once, and keeps using the same
+    # youtube object and connection for all of its uploads.
+    # We can't share the main thread's object because the
+    # youtube._http.connections object is an SSLSocket
+    # and cannot be serialized/copied to the new thread.
+    # If this is not done, or the youtube object is not global
+    # the youtube object will lose the entire SSLSocket connection object
+    # and fail with something like:
+    # 'HttpError 401 when requesting None returned
+    # "Request is missing required authentication credentials...'
+    try:
+        youtube = get_authenticated_service(values)
+        backoff.succeeded()
+        return youtube
+
+    # get_authenticated_service has already logged the reason.
+    # Without a youtube object nothing can be uploaded by this worker
+    except AuthenticationError as e:
+        delay = backoff.failed(e)
+        if delay is None:
+            logger.error('Failed to authenticate. Videos given to this worker will not be uploaded')
+        else:
+            logger.error(f'Failed to authenticate. Trying again in {delay} seconds')
+        return None
+
+
+# Function for uploading the video.
+# Runs in an upload worker, using the worker's youtube object
+def upload_video(upload_job: UploadJob, youtube, values: Values, position: int = 0):
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload
+
+    logger = logging.getLogger('uploader')
+
+    logger.info('Creating body for uploading')
+
+    file = upload_job.file
+    job = upload_job.job
+
+    # Remore the upload flag from the filename
+    # that'll be used as the video title
+    title = get_video_title(job.source)
+
+    # Create a body dictionary containing the
+    # video title, description and category
+    # as well as the privacy status
+    body = dict(
+        snippet=dict(
+            title=title,
+            description='Icon & outro by @Stardust_Buckethead',
+            categoryId='20'
+        ),
+        status=dict(
+            privacyStatus='private'
+        )
+    )
+
+    # Create an insert_request object used
+    # to upload the video, with the body dictonary as the body
+    # that is resumeable. The first chunk is the smallest allowed,
+    # and resumable_upload resizes the following chunks based on the upload speed
+    logger.info('Creating insert request')
+    if upload_job.streaming:
+        media_body = get_growing_file_upload_class()(upload_job, values.upload_chunk_min, values)
+    else:
+        media_body = MediaFileUpload(file, chunksize=values.upload_chunk_min, resumable=True)
+
+    insert_request = youtube.videos().insert(
+        part=','.join(body.keys()),
+        body=body,
+        media_body=media_body
+    )
+
+    with timed('upload', job.source.name):
+        video_id = resumable_upload(file, insert_request, values, position)
+
+    # The upload was cancelled
+    if video_id is None:
+        return
+
+    # Remember the upload, so the channel doesn't have to be searched for it next time
+    values.channel_index.add(title, video_id)
+    values.state_index.set(job.source, job.size, job.mtime_ns, get_encode_settings(values),
+                           uploaded=True, video_id=video_id)
+    values.state_index.set_fingerprint(get_fingerprint(job), video_id=video_id)
+
+    # Use one of the thumbnails made while converting the clip, if there are any.
+    # Custom thumbnails require a verified channel, so failing to set it isn't treated as a failed upload
+    thumbnail = get_youtube_thumbnail(job.output)
+    if thumbnail is not None:
+        logger.info(f'Setting the thumbnail of {video_id} to {thumbnail.name}')
+        try:
+            youtube.thumbnails().set(
+                videoId=video_id,
+                media_body=MediaFileUpload(thumbnail, mimetype='image/jpeg')
+            ).execute()
+        except HttpError as e:
+            logger.warning(f'Failed to set the thumbnail of {video_id}: {e}')
+
+
+def resumable_upload(filename, insert_request, values: Values, position: int = 0):
+    from googleapiclient.errors import HttpError
+
+    logger = logging.getLogger('resumeable_uploader')
+
+    response = None
+    retry = 0
+
+    # Get the size of the file in bytes, and use it as the "goal" in tqdm.
+    # A file that's still being converted has no size yet, and may not even exist yet
+    file_size = insert_request.resumable.size()
+    streaming = file_size is None
+    stat = None if streaming else os.stat(filename)
+    progress_bar = tqdm(total=file_size, unit='bytes', unit_scale=True, desc='Uploading', position=position)
+    logger.info(f'Uploading {Path(filename).stem}')
+
+    # If a previous run was interrupted while uploading this file, continue its upload session.
+    # Putting the request in its error state makes it ask YouTube how much
+    # was actually received before sending the next chunk.
+    # A file that's still being converted changes between runs, so its session can't be continued
+    session = None
+    if not streaming:
+        session = values.state_index.get_upload_session(filename, file_size, stat.st_mtime_ns)
+
+    if session is not None:
+        logger.info(f'Resuming upload of {Path(filename).stem} from byte {session["progress"]}')
+        insert_request.resumable_uri = session['resumable_uri']
+        insert_request.resumable_progress = session['progress']
+        insert_request._in_error_state = True
+        progress_bar.update(session['progress'])
+
+    # response will be None until upload is complete
+    while response is None:
+        error = None
+
+        # Give up on the upload if we're stopping early.
+        # The session is kept, so the next run can continue it
+        if values.stop_event.is_set():
+            progress_bar.close()
+            values.metrics.remove_upload(Path(filename).name)
+            logger.info(f'Cancelled uploading {Path(filename).stem} with reason: Stopping')
+            return None
+
+        # Wait for the upload speed limit to allow the next chunk
+        chunk_size = insert_request.resumable.chunksize()
+        if values.upload_bucket is not None:
+            values.upload_bucket.consume(chunk_size)
+
+        try:
+            started = time.monotonic()
+            previous_progress = insert_request.resumable_progress
+
+            # While in its error state, the request only asks YouTube for the progress
+            # instead of uploading, which says nothing about the upload speed
+            resyncing = insert_request._in_error_state
+            status, response = insert_request.next_chunk()
+            elapsed = time.monotonic() - started
+
+            if status:
+
+                # status.resumable_progress returns the total uploaded bytes so far.
+                # By subtracting it from the current progress bar's progress, we add only
+                # the newly uploaded chunk.
+                with values.thread_lock:
+                    progress_bar.update(status.resumable_progress - progress_bar.n)
+
+                # Report the upload speed of the chunk, and size the next chunk after it,
+                # so fast connections don't wait on a round trip for every small chunk
+                uploaded = status.resumable_progress - previous_progress
+                if not resyncing and uploaded > 0 and elapsed > 0:
+                    values.metrics.increment('bytes_uploaded', uploaded)
+                    values.metrics.set_upload(Path(filename).name, bytes_per_second=round(uploaded / elapsed),
+                                              progress_bytes=status.resumable_progress, size_bytes=file_size,
+                                              chunk_size_bytes=chunk_size)
+                    insert_request.resumable._chunksize = get_chunk_size(uploaded / elapsed, values)
+
+                # Save the session after every chunk, so it can be continued after a restart
+                if not streaming:
+                    values.state_index.set_upload_session(filename, file_size, stat.st_mtime_ns,
+                                                          insert_request.resumable_uri, status.resumable_progress)
+
+            if response is not None:
+
+                # When upload is complete, no status is returned, so the last
+                # bit of progress gets handled here, where we instead use
+                # the filesize of the file, to add the remaining progress
+                with values.thread_lock:
+                    progress_bar.update(insert_request.resumable.size() - progress_bar.n)
+
+                progress_bar.close()
+                values.state_index.clear_upload_session(filename)
+                values.metrics.remove_upload(Path(filename).name)
+
+                if 'id' in response:
+                    values.metrics.increment('videos_uploaded')
+                    print(f"Successfully uploaded {Path(filename).stem}\nWith ID {response['id']}\nAt https://studio.youtube.com/video/{response['id']}/edit")
+                    return response['id']
+                else:
+                    raise UploadError("The upload failed with an unexpected response: %s" % response)
+
+        except HttpError as e:
+            if e.resp.status in values.RETRIABLE_STATUS_CODES:
+                error = "A retriable HTTP error %d occurred:\n%s" % (e.resp.status,
+                                                                     e.content)
+
+            # YouTube forgets upload sessions after a while.
+            # If the saved one is gone, start over with a new session
+            elif e.resp.status in (404, 410) and session is not None:
+                logger.info(f'Upload session for {Path(filename).stem} has expired. Starting over')
+                values.state_index.clear_upload_session(filename)
+                session = None
+                insert_request.resumable_uri = None
+                insert_request.resumable_progress = 0
+                insert_request._in_error_state = False
+                with values.thread_lock:
+                    progress_bar.reset()
+                continue
+
+            else:
+                progress_bar.close()
+                values.metrics.remove_upload(Path(filename).name)
+                raise
+        except values.RETRIABLE_EXCEPTIONS as e:
+            error = f"A retriable error occurred: {e}"
+
+        if error is not None:
+            print(error)
+            retry += 1
+            if retry > values.MAX_RETRIES:
+                progress_bar.close()
+                values.metrics.remove_upload(Path(filename).name)
+                raise UploadError("No longer attempting to retry.")
+
+            max_sleep = 2 ** retry
+            sleep_seconds = random.random() * max_sleep
+            print(f"Sleeping {sleep_seconds} seconds and then retrying...")
+            time.sleep(sleep_seconds)
+
+
+# Local copy of the titles and IDs of every video uploaded to the channel.
+# The first refresh pages through the channel's uploads playlist,
+# and later refreshes only fetch the pages until the newest video of the previous listing is found,
+# which costs a few list calls instead of one search per clip.
+# Videos we upload ourselves are added right away, but don't count as listed,
+# so videos uploaded by hand before them are still found by the next refresh.
+# connect is called to get the youtube object when the index is refreshed,
+# and returns None if YouTube can't be reached, in which case only the saved copy is used
+class ChannelIndex:
+    def __init__(self, filename: str, connect, refresh_seconds: float = None, max_retries: int = Values.MAX_RETRIES):
+        self.logger = logging.getLogger('channel_index')
+
+        self.filename = filename
+        self.connect = connect
+        self.lock = threading.Lock()
+
+        # Number of times a failing list call is tried again before the saved copy is used instead
+        self.max_retries = max_retries
+
+        # When the index was last refreshed, and how often it's refreshed.
+        # None means it's only refreshed the first time it's used
+        self.refreshed = None
+        self.refresh_seconds = refresh_seconds
+
+        # Maps video titles to video IDs
+        self.videos = {}
+        self.playlist_id = None
+
+        # ID of the newest video found by the last listing of the playlist.
+        # Without one, the whole playlist is listed
+        self.newest_listed = None
+
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = load(f)
+            self.videos = data.get('videos', {})
+            self.playlist_id = data.get('playlist_id')
+            self.newest_listed = data.get('newest_listed')
+
+    # Fetches the videos uploaded since the last refresh
+    def refresh(self):
+        with self.lock:
+            self.refreshed = time.monotonic()
+
+            youtube = self.connect()
+            if youtube is None:
+                self.logger.warning('Could not connect to YouTube. Using the saved copy of the channel\'s videos')
+                return
+
+            # Only imported once connecting has shown the Google API client is installed
+            from googleapiclient.errors import HttpError
+
+            # Errors that are still failing after retrying leave the saved copy as it is
+            try:
+                new_videos, newest = self._list_new_videos(youtube)
+            except (HttpError, *Values.RETRIABLE_EXCEPTIONS) as e:
+                self.logger.warning(f'Could not list the channel\'s videos: {e}. Using the saved copy')
+                return
+
+            # Older videos are added first, so the newest video wins if titles are shared
+            self.videos.update(dict(reversed(list(new_videos.items()))))
+            if newest is not None:
+                self.newest_listed = newest
+            self._save()
+
+        self.logger.info(f'Found {len(new_videos)} new videos on the channel, {len(self.videos)} in total')
+
+    # Lists the videos uploaded since the last listing.
+    # Returns them as a dictionary of titles and IDs, newest first, and the ID of the newest one
+    def _list_new_videos(self, youtube) -> tuple:
+        # Every channel has a playlist containing all of its uploads
+        if self.playlist_id is None:
+            response = self._execute(youtube.channels().list(part='contentDetails', mine=True))
+            self.playlist_id = response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
+
+        new_videos = {}
+        newest = None
+        page_token = None
+
+        # The playlist is ordered from newest to oldest,
+        # so we can stop as soon as we reach the newest video of the last listing.
+        # If that video has been deleted, the whole playlist is listed again
+        while True:
+            response = self._execute(youtube.playlistItems().list(
+                part='snippet',
+                playlistId=self.playlist_id,
+                maxResults=50,
+                pageToken=page_token
+            ))
+
+            reached_listed = False
+            for item in response.get('items', []):
+                video_id = item['snippet']['resourceId']['videoId']
+                if video_id == self.newest_listed:
+                    reached_listed = True
+                    break
+                if newest is None:
+                    newest = video_id
+                new_videos[item['snippet']['title']] = video_id
+
+            page_token = response.get('nextPageToken')
+            if reached_listed or page_token is None:
+                return new_videos, newest
+
+    # Runs a request, retrying retriable errors with the same backoff as uploads
+    def _execute(self, request) -> dict:
+        from googleapiclient.errors import HttpError
+
+        retry = 0
+        while True:
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status not in Values.RETRIABLE_STATUS_CODES:
+                    raise
+                error = e
+            except Values.RETRIABLE_EXCEPTIONS as e:
+                error = e
+
+            retry += 1
+            if retry > self.max_retries:
+                raise error
+
+            sleep_seconds = random.random() * 2 ** retry
+            self.logger.warning(f'Listing the channel\'s videos failed with {error}. Retrying in {sleep_seconds:.1f} seconds')
+            time.sleep(sleep_seconds)
+
+    # Returns the ID of the video with the given title, or None if there isn't one.
+    # The index is refreshed the first time it's used, and then every refresh_seconds
+    def get(self, title: str) -> str:
+        if self.refreshed is None or (self.refresh_seconds is not None
+                                      and time.monotonic() - self.refreshed >= self.refresh_seconds):
+            self.refresh()
+
+        with self.lock:
+            return self.videos.get(title)
+
+    # Adds a video we've just uploaded ourselves
+    def add(self, title: str, video_id: str):
+        with self.lock:
+            self.videos[title] = video_id
+            self._save()
+
+    # Writes the index to a temporary file first, so a crash can't leave it half-written
+    def _save(self):
+        temp_filename = f'{self.filename}.tmp'
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            dump(dict(playlist_id=self.playlist_id, newest_listed=self.newest_listed, videos=self.videos), f)
+        os.replace(temp_filename, self.filename)
+
+
+# Function for getting the title a clip is uploaded with
+def get_video_title(filename: str) -> str:
+    # Remove the upload flag from the filename,
+    # so both new and old videos are matched
+    return Path(str(filename).replace(' ytupload', '')).stem
+
+
+# Returns the ID of the video on the channel with the clip's title, or None if there isn't one
+def get_channel_video_id(filename: str, values: Values) -> str:
+    return values.channel_index.get(get_video_title(filename))
+
+
+# Container for everything a worker needs to know to convert a single clip
+class EncodeJob:
+    def __init__(self, source: Path, output: Path, size: int, mtime_ns: int, upload: bool = False):
+        # Path of the lossless clip we're converting
+        self.source = source
+
+        # Size and modification time of the clip when it was found,
+        # used to identify it in the state index
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+        # Path of the AV1 MP4 we're converting into
+        self.output = output
+
+        # The clip is converted into a temporary file next to the output,
+        # which is only renamed to the output once it's been verified.
+        # That way a file with the output's name is always complete
+        self.partial = output.with_name(f'{output.stem}.part{output.suffix}')
+
+        # Whether the clip should be uploaded alongside being converted
+        self.upload = upload
+
+        # Set once the encode has finished, and whether it was converted and verified successfully.
+        # Used by uploads streaming the converted clip while it's being written
+        self.encoded = threading.Event()
+        self.encode_succeeded = False
+
+        # Whether the converted clip is uploaded while it's being converted
+        self.streamed = False
+
+        # Fingerprint of the original's content. Only computed when it's needed, by get_fingerprint
+        self.fingerprint = None
+
+        # Copy of the original in the staging folder, which is converted instead of the original if it's set
+        self.staged = None
+
+        # Path of the preview, and the temporary file it's written to like the converted clip
+        self.preview = output.with_name(f'{output.stem} preview{output.suffix}')
+        self.preview_partial = output.with_name(f'{output.stem} preview.part{output.suffix}')
+
+        # Filename pattern of the temporary files the thumbnails are written to
+        self.thumbnail_partial = output.with_name(f'{output.stem} thumbnail %02d.part.jpg')
+
+
+# Returns the file a clip is converted from, which is its copy in the staging folder if it has one
+def get_encode_input(job: EncodeJob) -> Path:
+    return job.staged or job.source
+
+
+# Returns the path of the manifest describing a converted clip
+def get_manifest_path(output: Path) -> Path:
+    return output.with_name(f'{output.name}.json')
+
+
+# Returns a SHA-256 hash of the file's size and a sample from its start, middle and end.
+# Reading a few MiB is enough to tell a multi-GB original apart from others of the same size
+def get_sampled_hash(path: Path, sample_size: int = 1024 * 1024) -> str:
+    size = os.path.getsize(path)
+    sha = hashlib.sha256(str(size).encode())
+
+    with open(path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)):
+            f.seek(offset)
+            sha.update(f.read(sample_size))
+
+    return sha.hexdigest()
+
+
+# Returns the fingerprint identifying a clip by its content instead of its name,
+# which is the sampled hash of the original. It's computed once per job
+def get_fingerprint(job: EncodeJob) -> str:
+    if job.fingerprint is None:
+        job.fingerprint = get_sampled_hash(job.source)
+    return job.fingerprint
+
+
+# Returns the ID of the video a clip with the same content was uploaded as, or None if there isn't one
+def get_duplicate_upload(job: EncodeJob, values: Values) -> str:
+    try:
+        entry = values.state_index.get_fingerprint(get_fingerprint(job))
+    except OSError:
+        return None
+
+    return entry['video_id'] if entry is not None else None
+
+
+# Function for reusing the conversion of a clip with the same content, like a renamed clip
+# or a copy in another "lossless" folder, instead of converting it again.
+# Returns whether a conversion was reused
+def reuse_duplicate_conversion(job: EncodeJob, values: Values) -> bool:
+    logger = logging.getLogger('converter')
+
+    try:
+        fingerprint = get_fingerprint(job)
+    except OSError as e:
+        logger.exception(e)
+        return False
+
+    entry = values.state_index.get_fingerprint(fingerprint)
+    if entry is None or entry['output'] is None or entry['settings'] != get_encode_settings(values):
+        return False
+
+    existing = Path(entry['output'])
+    if existing == job.output:
+        return False
+
+    # Only reuse a conversion that's still complete, according to its manifest
+    manifest = read_manifest(existing)
+    try:
+        if manifest is None or manifest.get('source_hash') != fingerprint or manifest.get('output_size') != os.path.getsize(existing):
+            return False
+    except OSError:
+        return False
+
+    # A hard link takes no extra space, but only works on the same drive
+    try:
+        os.link(existing, job.partial)
+    except OSError:
+        shutil.copyfile(existing, job.partial)
+
+    commit_output(job)
+    write_manifest(job, manifest['frames'], values)
+    values.state_index.set(job.source, job.size, job.mtime_ns, get_encode_settings(values), converted=True, verified=True)
+    job.encode_succeeded = True
+    logger.info(f'Reused the conversion {existing} for {job.source.name} with reason: Same content')
+
+    return True
+
+
+# Returns a SHA-256 hash of the whole file
+def get_file_hash(path: Path) -> str:
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+# Function for writing the manifest of a converted clip, once it's been verified.
+# The manifest is written after the output has been renamed, so if it exists the output is complete
+def write_manifest(job: EncodeJob, frames: int, values: Values):
+    manifest = dict(
+        source=str(job.source),
+        source_size=job.size,
+        source_mtime_ns=job.mtime_ns,
+        source_hash=get_fingerprint(job),
+        settings=get_encode_settings(values),
+        frames=frames,
+        output_size=os.path.getsize(job.output),
+        output_hash=get_file_hash(job.output),
+        created=time.time()
+    )
+
+    manifest_path = get_manifest_path(job.output)
+    with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as f:
+        dump(manifest, f, indent=4)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+# Returns the manifest of a converted clip, or None if it doesn't have one
+def read_manifest(output: Path) -> dict:
+    try:
+        with open(get_manifest_path(output), 'r', encoding='utf-8') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Function for checking if a converted clip's manifest matches the original and the converted clip,
+# so the converted clip can be trusted without probing either of them
+def is_output_trusted(job: EncodeJob, manifest: dict) -> bool:
+    try:
+        output_size = os.path.getsize(job.output)
+    except OSError:
+        return False
+
+    return (manifest.get('source_size') == job.size and manifest.get('source_mtime_ns') == job.mtime_ns
+            and manifest.get('output_size') == output_size)
+
+
+# Function for renaming a verified conversion to its final name.
+# On Windows a file can't be renamed while it's open, which an upload streaming it may briefly have it,
+# so the rename is retried a few times
+def commit_output(job: EncodeJob):
+    partial = move_next_to(job.partial, job.output)
+
+    for attempt in range(10):
+        try:
+            os.replace(partial, job.output)
+            break
+        except PermissionError:
+            if attempt == 9:
+                raise
+            time.sleep(0.5)
+
+    # The conversion in the staging folder is only removed once the output is complete
+    if partial != job.partial:
+        os.remove(job.partial)
+
+
+# Function for copying a file converted in the staging folder to a temporary file next to its final name,
+# as a rename can't move a file to another drive. Returns the file to rename
+def move_next_to(partial: Path, output: Path) -> Path:
+    if partial.parent == output.parent:
+        return partial
+
+    local = output.with_name(f'{output.stem}.part{output.suffix}')
+    shutil.copyfile(partial, local)
+    return local
+
+
+# Returns the ffmpeg options for encoding the video with SVT-AV1.
+# "lp" limits the number of threads the encoder uses
+def get_video_encode_args(preset: int, crf: int, threads: int) -> list:
+    return ['-c:v', 'libsvtav1', '-preset', str(preset), '-crf', str(crf), '-b:v', '0',
+            '-svtav1-params', f'lp={threads}']
+
+
+# Function for calculating how many threads each encode may use.
+# Every worker gets an equal share of the CPU, so that the pool
+# as a whole fills the machine without oversubscribing it
+def get_threads_per_job(values: Values) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, values.jobs))
+
+
+# Returns the number of this machine's encode workers that aren't converting a clip.
+# Clips leased to remote workers are in the scheduler as well, so they're not counted
+def get_idle_encoders(values: Values) -> int:
+    if values.encode_queue is None:
+        return 0
+
+    busy = values.encode_queue.running_count()
+    if values.coordinator is not None:
+        busy -= values.coordinator.lease_count()
+
+    return max(0, values.jobs - busy)
+
+
+# Returns the key the encode speed is stored under. The speed of a single encode
+# depends on the encode settings and the number of threads it gets
+def get_encode_speed_key(values: Values) -> str:
+    return f'{get_encode_settings(values)} threads={get_threads_per_job(values)}'
+
+
+# Function for predicting how many seconds converting a clip will take,
+# from its number of pixels and the speed of earlier conversions with the same settings
+def predict_encode_seconds(job: EncodeJob, values: Values) -> float:
+    try:
+        metadata = values.metadata.get(job.source)
+
+    # A clip that can't be probed is skipped by the encoder right away
+    except (CalledProcessError, OSError):
+        return 0.0
+
+    pixels = (metadata['frames'] or 0) * (metadata['width'] or 0) * (metadata['height'] or 0)
+    speed = values.state_index.get_encode_speed(get_encode_speed_key(values)) or values.default_encode_speed
+    return pixels / speed
+
+
+# Queue for the encode workers, handing out clips in order of priority instead of the order they were found.
+# Clips marked for upload go first, and after that the clips predicted to convert the quickest.
+# Waiting lowers a clip's predicted time by values.schedule_aging per second,
+# which gives long clips their turn even while new, shorter clips keep being added.
+# Has the put, get and qsize methods of the Queue it replaces, and None is still used to stop a worker
+class EncodeScheduler:
+    def __init__(self, values: Values):
+        self.values = values
+        self.condition = threading.Condition()
+
+        # Heap of (class, priority, order, predicted seconds, job) tuples.
+        # Clips marked for upload are in class 0 and the rest in class 1.
+        # The order breaks ties, so clips with the same priority go in the order they were queued
+        self.heap = []
+        self.order = count()
+
+        # Number of workers told to stop
+        self.stops = 0
+
+        # Predicted seconds of the queued clips,
+        # and the predicted seconds and start time of the clips being converted
+        self.queued_seconds = 0.0
+        self.running = {}
+
+    def put(self, job: EncodeJob):
+        if job is None:
+            with self.condition:
+                self.stops += 1
+                self.condition.notify()
+            return
+
+        # The probe is waited for before taking the lock, so it doesn't hold up the workers
+        predicted = predict_encode_seconds(job, self.values)
+
+        # Aging every queued clip by the time it has waited is the same as
+        # giving clips queued later a worse priority, which keeps the heap in order
+        priority = predicted + time.monotonic() * self.values.schedule_aging
+
+        with self.condition:
+            heappush(self.heap, (0 if job.upload else 1, priority, next(self.order), predicted, job))
+            self.queued_seconds += predicted
+            self.condition.notify()
+
+    # Returns the clip to convert next, waiting for one if none are queued.
+    # Returns None once the worker should stop, which is when no clips are left,
+    # or right away when stopping early.
+    # Without blocking, None is returned right away if no clips are queued
+    def get(self, block: bool = True) -> EncodeJob:
+        with self.condition:
+            while True:
+                if not block and (not self.heap or self.values.stop_event.is_set()):
+                    return None
+
+                if self.stops and (not self.heap or self.values.stop_event.is_set()):
+                    self.stops -= 1
+                    return None
+
+                if self.heap:
+                    *_, predicted, job = heappop(self.heap)
+                    self.queued_seconds -= predicted
+                    self.running[job] = (predicted, time.monotonic())
+                    return job
+
+                self.condition.wait()
+
+    # Tells the scheduler a clip from get has finished converting
+    def done(self, job: EncodeJob):
+        with self.condition:
+            self.running.pop(job, None)
+
+    def qsize(self) -> int:
+        with self.condition:
+            return len(self.heap)
+
+    # Returns the number of clips taken with get that haven't been marked done
+    def running_count(self) -> int:
+        with self.condition:
+            return len(self.running)
+
+    # Returns the next clips get would return, in order, without taking them off the queue
+    def peek(self, amount: int) -> list:
+        with self.condition:
+            return [job for *_, job in nsmallest(amount, self.heap)]
+
+    # Returns the predicted seconds until every queued clip has been converted,
+    # assuming the clips are spread evenly over the local and remote workers
+    def eta(self) -> float:
+        workers = self.values.jobs
+        if self.values.coordinator is not None:
+            workers += self.values.coordinator.worker_count()
+
+        now = time.monotonic()
+        with self.condition:
+            remaining = sum(max(0.0, predicted - (now - started)) for predicted, started in self.running.values())
+            return (self.queued_seconds + remaining) / max(1, workers)
+
+
+# Copies the next clips in the encode queue to the staging folder while the current ones are converting.
+# Copying a whole clip with large reads keeps the recordings drive reading sequentially,
+# instead of seeking back and forth between ffmpeg and the uploads reading it at the same time.
+# A copy is removed once its clip has been converted, or to make room once it's no longer among the next clips
+class SourceStager:
+    def __init__(self, values: Values):
+        self.values = values
+        self.folder = Path(values.staging_folder, 'clip converter staging')
+        self.condition = threading.Condition()
+
+        # Copies of the clips that have been copied, and the clip being copied
+        self.staged = {}
+        self.copying = None
+
+        # Clips picked up by an encode worker, whose copies are kept until they're released,
+        # and clips that couldn't be copied, which are converted from the original instead
+        self.acquired = set()
+        self.skipped = set()
+
+        # Bytes taken up by the copies, including the one being copied
+        self.used = 0
+
+        # Copies are numbered, so clips with the same name in different folders don't overwrite each other
+        self.names = count()
+        self.stopped = False
+
+        # Copies left behind by an earlier run can't be matched to their clips
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        self.thread = threading.Thread(target=self.run, name='stager')
+        self.thread.start()
+
+    def run(self):
+        logger = logging.getLogger('stager')
+
+        while (job := self.next_job()) is not None:
+            staged = Path(self.folder, f'{next(self.names)} {job.source.name}')
+
+            copied = False
+            try:
+                with timed('stage', job.source.name):
+                    copied = copy_sequentially(job.source, staged, self.values)
+
+                # A clip that changed while it was copied is converted from the original
+                copied = copied and os.path.getsize(staged) == job.size
+
+            except OSError as e:
+                logger.exception(e)
+
+            finally:
+                with self.condition:
+                    self.copying = None
+                    if copied:
+                        self.staged[job] = staged
+                    else:
+                        self.used -= job.size
+                        self.skipped.add(job)
+                        if staged.exists():
+                            os.remove(staged)
+                    self.condition.notify_all()
+
+            if copied:
+                logger.info(f'Copied {job.source.name} to the staging folder')
+
+    # Waits until the first of the next clips in the queue that hasn't been copied fits in the budget,
+    # and returns it. Returns None once stopped
+    def next_job(self) -> EncodeJob:
+        budget = self.values.staging_budget
+
+        with self.condition:
+            while not self.stopped and not self.values.stop_event.is_set():
+                upcoming = self.values.encode_queue.peek(self.values.staging_ahead)
+                job = next((job for job in upcoming
+                            if job not in self.staged and job not in self.acquired and job not in self.skipped), None)
+
+                if job is not None and job.size > budget:
+                    self.skipped.add(job)
+                    continue
+
+                if job is not None and self.used + job.size > budget:
+                    self.evict(upcoming)
+
+                if job is not None and self.used + job.size <= budget:
+                    self.copying = job
+                    self.used += job.size
+                    return job
+
+                # The queue doesn't tell us when it changes, so it's looked at again every second
+                self.condition.wait(1)
+
+            return None
+
+    # Removes the copies of clips that aren't among the upcoming clips and aren't being converted.
+    # Clips leased to remote workers are no longer in the queue either, so their copies are removed as well
+    def evict(self, upcoming: list):
+        for job in [job for job in self.staged if job not in upcoming and job not in self.acquired]:
+            self.remove(job)
+
+    def remove(self, job: EncodeJob):
+        staged = self.staged.pop(job)
+        self.used -= job.size
+
+        try:
+            os.remove(staged)
+        except OSError as e:
+            logging.getLogger('stager').exception(e)
+
+    # Waits for the clip to finish copying if it's being copied.
+    # If the clip has been copied, it's converted from the copy and into the staging folder
+    def acquire(self, job: EncodeJob):
+        with self.condition:
+            while self.copying is job:
+                self.condition.wait()
+
+            self.acquired.add(job)
+            staged = self.staged.get(job)
+
+        if staged is not None:
+            job.staged = staged
+            job.partial = staged.with_name(f'{staged.stem} AV1.part{job.output.suffix}')
+            job.preview_partial = staged.with_name(f'{staged.stem} preview.part{job.output.suffix}')
+            job.thumbnail_partial = staged.with_name(f'{staged.stem} thumbnail %02d.part.jpg')
+
+    # Removes the clip's copy once it's been converted
+    def release(self, job: EncodeJob):
+        with self.condition:
+            self.acquired.discard(job)
+            self.skipped.discard(job)
+            if job in self.staged:
+                self.remove(job)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        self.thread.join()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+# Function for copying a file with large reads, so the drive it's on reads it in one go.
+# Returns whether the whole file was copied, which it isn't if we're stopping early
+def copy_sequentially(source: Path, destination: Path, values: Values) -> bool:
+    with open(source, 'rb', buffering=0) as src, open(destination, 'wb') as dst:
+        while chunk := src.read(values.staging_read_size):
+            if values.stop_event.is_set():
+                return False
+            dst.write(chunk)
+
+    return True
+
+
+# Returns the filename pattern of a converted clip's thumbnails, numbered from 01
+def get_thumbnail_pattern(output: Path) -> Path:
+    return output.with_name(f'{output.stem} thumbnail %02d.jpg')
+
+
+# Returns the file with the given number of a thumbnail pattern
+def get_thumbnail(pattern: Path, number: int) -> Path:
+    return pattern.with_name(pattern.name.replace('%02d', f'{number:02}'))
+
+
+# Returns the files of a thumbnail pattern that exist, in order.
+# ffmpeg numbers them from 01 without gaps
+def list_thumbnails(pattern: Path) -> list:
+    thumbnails = []
+    for number in count(1):
+        thumbnail = get_thumbnail(pattern, number)
+        if not thumbnail.exists():
+            return thumbnails
+        thumbnails.append(thumbnail)
+
+
+# Returns the middle of a converted clip's thumbnails, for the uploaded video,
+# or None if no thumbnails were made for it
+def get_youtube_thumbnail(output: Path) -> Path:
+    thumbnails = list_thumbnails(get_thumbnail_pattern(output))
+    if not thumbnails:
+        return None
+    return thumbnails[len(thumbnails) // 2]
+
+
+# Function for giving the thumbnails made alongside a verified conversion their final names.
+# Thumbnails of an earlier conversion of the clip are removed first, so none of them are left mixed in
+def commit_thumbnails(job: EncodeJob):
+    pattern = get_thumbnail_pattern(job.output)
+    for thumbnail in list_thumbnails(pattern):
+        os.remove(thumbnail)
+
+    for number, partial in enumerate(list_thumbnails(job.thumbnail_partial), 1):
+        thumbnail = get_thumbnail(pattern, number)
+        os.replace(move_next_to(partial, thumbnail), thumbnail)
+
+
+# Function for removing the unfinished files of a conversion
+def remove_partials(job: EncodeJob):
+    for partial in (job.partial, job.preview_partial, *list_thumbnails(job.thumbnail_partial)):
+        if partial.exists():
+            os.remove(partial)
+
+
+# Function for building the outputs made alongside the AV1 conversion from the same decoded frames.
+# The split filter copies the decoded video to the AV1 encoder and to a branch for each extra output.
+# Returns the filter graph and the ffmpeg options of the extra outputs,
+# or None and an empty list if only the AV1 conversion is made
+def get_extra_outputs(job: EncodeJob, threads: int, values: Values) -> tuple:
+    branches = []
+    outputs = []
+
+    if values.preview:
+        branches.append(f'scale=-2:{values.preview_height},format=yuv420p[preview]')
+        outputs += ['-map', '[preview]', '-map', '0:a:0?', '-threads', str(threads),
+                    '-c:v', 'libx264', '-preset', values.preview_preset, '-crf', str(values.preview_crf),
+                    '-c:a', 'aac', '-b:a', values.preview_audio_bitrate,
+                    '-movflags', '+faststart', '-f', 'mp4', str(job.preview_partial)]
+
+    if values.thumbnail_count:
+        # Take the first keyframe, and then the first keyframe after each interval.
+        # Keyframes are picked because they're never in the middle of a transition or blurry from motion
+        interval = values.metadata.get(job.source)['duration'] / values.thumbnail_count
+        branches.append(f"select='eq(pict_type,I)*(isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f}))',"
+                        f'scale={values.thumbnail_width}:-2[thumbnails]')
+        outputs += ['-map', '[thumbnails]', '-fps_mode', 'vfr', '-frames:v', str(values.thumbnail_count),
+                    '-q:v', '2', '-f', 'image2', str(job.thumbnail_partial)]
+
+    if not branches:
+        return None, []
+
+    labels = [f'[split{index}]' for index in range(len(branches))]
+    graph = f'[0:v]split={len(branches) + 1}[av1]{"".join(labels)};'
+    graph += ';'.join(label + branch for label, branch in zip(labels, branches))
+    return graph, outputs
+
+
+# Function for converting clip to AV1
+def convert_to_av1(values: Values):
+    logger = logging.getLogger('converter')
+
+    # Create the queues the workers pull jobs from
+    # and the event used to tell them to stop early
+    values.encode_queue = EncodeScheduler(values)
+    values.upload_queue = Queue(maxsize=values.max_pending_uploads)
+    values.stop_event = threading.Event()
+
+    # Copy the next clips to the staging folder while converting, if configured
+    if values.staging_folder is not None:
+        values.stager = SourceStager(values)
+
+    # Start a worker for each concurrent upload.
+    # Uploading is kept separate from converting, so a slow upload never holds up an encode
+    upload_workers = []
+    for worker_id in range(values.upload_jobs):
+        worker = threading.Thread(target=upload_worker, args=(worker_id, values), name=f'uploader-{worker_id}')
+        worker.start()
+        upload_workers.append(worker)
+
+    # Start a worker for each concurrent encode.
+    # Each worker gets its own progress bar, below the upload bars
+    workers = []
+    for worker_id in range(values.jobs):
+        worker = threading.Thread(target=encode_worker, args=(worker_id, values), name=f'encoder-{worker_id}')
+        worker.start()
+        workers.append(worker)
+
+    logger.info(f'Started {values.jobs} encode workers with {get_threads_per_job(values)} threads each')
+    logger.info(f'Started {values.upload_jobs} upload workers')
+
+    # Let remote workers lease clips from the same queue, if configured
+    coordinator_server = None
+    if values.coordinator_port is not None:
+        coordinator_server = start_coordinator(values)
+        logger.info(f'Coordinating remote workers on {values.coordinator_address}:{values.coordinator_port}')
+
+    try:
+        # Go through everything already in the recordings folders
+        lossless_folders = scan_for_clips(values)
+
+        # Keep running and convert new clips as they are recorded, until interrupted
+        if values.watch:
+            watch_for_clips(lossless_folders, values)
+
+        # Wait for the clips to finish converting, including the clips leased to remote workers,
+        # and then for the uploads the encode workers queued up to finish
+        stop_workers(workers, values.encode_queue)
+        if values.coordinator is not None:
+            values.coordinator.wait()
+        stop_workers(upload_workers, values.upload_queue)
+
+    # Reading from the pipes happens in the worker threads,
+    # so the interrupt is caught here and passed on to them instead
+    except KeyboardInterrupt:
+        print('Keyboard interrupt received. Quitting...')
+        values.stop_event.set()
+
+        stop_workers(workers, values.encode_queue)
+        stop_workers(upload_workers, values.upload_queue)
+        exit()
+
+    finally:
+        if coordinator_server is not None:
+            values.coordinator.close()
+            coordinator_server.shutdown()
+        if values.stager is not None:
+            values.stager.close()
+
+
+# Function for checking if a file or folder name matches any of the exclude patterns
+def is_excluded(name: str, values: Values) -> bool:
+    return any(fnmatch(name.casefold(), pattern.casefold()) for pattern in values.exclude_patterns)
+
+
+# Function for checking if a filename should be converted
+def is_included(name: str, values: Values) -> bool:
+    return (any(fnmatch(name.casefold(), pattern.casefold()) for pattern in values.include_patterns)
+            and not is_excluded(name, values))
+
+
+# Generator yielding the "lossless" folders below a folder.
+# Output folders and excluded folders are skipped without being listed,
+# and "lossless" folders aren't searched any further
+def find_lossless_folders(folder: str, values: Values):
+    logger = logging.getLogger('scanner')
+
+    try:
+        with os.scandir(folder) as it:
+            entries = [entry for entry in it if entry.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        logger.exception(e)
+        return
+
+    for entry in entries:
+        if entry.name == values.output_folder or is_excluded(entry.name, values):
+            logger.debug(f'Ignoring folder {entry.path}.')
+
+        elif entry.name == 'lossless':
+            yield Path(entry.path)
+
+        else:
+            yield from find_lossless_folders(entry.path, values)
+
+
+# Generator yielding the path, size and modification time of every clip in a "lossless" folder
+def list_lossless_clips(folder: Path, values: Values):
+    logger = logging.getLogger('scanner')
+
+    try:
+        with os.scandir(folder) as it:
+            entries = list(it)
+    except OSError as e:
+        logger.exception(e)
+        return
+
+    for entry in entries:
+        if not entry.is_file():
+            continue
+
+        if not is_included(entry.name, values):
+            logger.info(f'Skipping {entry.name} with reason: Does not match the include patterns')
+            continue
+
+        stat = entry.stat()
+        yield Path(entry.path), stat.st_size, stat.st_mtime_ns
+
+
+# Generator yielding every clip in the recordings folders as soon as it's found.
+# Found "lossless" folders are added to the given list.
+# With more than one scan job, the subfolders of the recordings folders are walked in parallel
+def scan_library(values: Values, lossless_folders: list):
+    logger = logging.getLogger('scanner')
+
+    if values.scan_jobs <= 1:
+        for recordings_folder in values.recordings_folders:
+            for folder in find_lossless_folders(recordings_folder, values):
+                logger.info(f'Found {folder}!')
+                lossless_folders.append(folder)
+                yield from list_lossless_clips(folder, values)
+        return
+
+    results = Queue(maxsize=values.scan_queue_size)
+
+    # Walks a single subfolder of a recordings folder, handing the clips to the generator
+    def scan_subtree(subtree: Path):
+        if subtree.name == 'lossless':
+            folders = [subtree]
+        else:
+            folders = find_lossless_folders(subtree, values)
+
+        for folder in folders:
+            logger.info(f'Found {folder}!')
+            lossless_folders.append(folder)
+            for clip in list_lossless_clips(folder, values):
+                results.put(clip)
+
+    # Adds None to the results once every subfolder has been walked
+    def scan_subtrees(subtrees: list):
+        with ThreadPoolExecutor(max_workers=values.scan_jobs, thread_name_prefix='scanner') as executor:
+            for future in [executor.submit(scan_subtree, subtree) for subtree in subtrees]:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.exception(e)
+        results.put(None)
+
+    subtrees = []
+    for recordings_folder in values.recordings_folders:
+        try:
+            with os.scandir(recordings_folder) as it:
+                subtrees += [Path(entry.path) for entry in it if entry.is_dir(follow_symlinks=False)
+                             and entry.name != values.output_folder and not is_excluded(entry.name, values)]
+        except OSError as e:
+            logger.exception(e)
+
+    threading.Thread(target=scan_subtrees, args=(subtrees,), daemon=True).start()
+
+    while True:
+        clip = results.get()
+        if clip is None:
+            break
+        yield clip
+
+
+# Function for going through the recordings folders and queueing the clips in their "lossless" folders.
+# The scan runs in its own thread, which starts probing the clips it finds, so converting
+# can start on the first clip while the rest of the folders are still being walked.
+# Returns the "lossless" folders it found
+def scan_for_clips(values: Values) -> list:
+    logger = logging.getLogger('scanner')
+
+    lossless_folders = []
+    clips = Queue(maxsize=values.scan_queue_size)
+
+    # Walks the recordings folders, starting probes for
+    # the clips and any previous conversions of them.
+    # Clips the state index already knows are done don't need probing
+    def scan():
+        try:
+            for path, size, mtime_ns in scan_library(values, lossless_folders):
+                if values.stop_event.is_set():
+                    break
+
+                # Converted clips with a manifest are trusted without being probed
+                if not values.state_index.is_verified(path, get_encode_settings(values)):
+                    output = Path(path.parent.parent, values.output_folder, f'{path.stem}.mp4')
+                    values.metadata.prefetch([path] if get_manifest_path(output).exists() else [path, output])
+
+                clips.put(path)
+        finally:
+            clips.put(None)
+
+    started = time.monotonic()
+    scanner = threading.Thread(target=scan, name='scanner', daemon=True)
+    scanner.start()
+
+    while True:
+        path = clips.get()
+        if path is None:
+            break
+
+        # Stop looking for clips if a worker ran into an unrecoverable error
+        if values.stop_event.is_set():
+            continue
+
+        # In watch mode, clips that changed very recently may still be being written.
+        # They're left for the watcher, which queues them once they stop changing
+        if values.watch and is_recently_modified(path, values):
+            continue
+
+        with timed('scan', path.name):
+            queue_clip(path, values)
+
+    logger.info(f'Scanned {len(lossless_folders)} lossless folders in {time.monotonic() - started:.2f} seconds')
+    return lossless_folders
+
+
+# Function for deciding what needs to be done with a clip in a "lossless" folder,
+# and queueing it for converting and/or uploading
+def queue_clip(full_file_path: Path, values: Values):
+    logger = logging.getLogger('converter')
+
+    filename = full_file_path.name
+
+    # I exlusively work with the mp4 and mkv containers.
+    # If the file does not match the include patterns, assume it should be ignored
+    if not is_included(filename, values):
+        logger.info(f'Skipping {filename} with reason: Does not match the include patterns')
+        return
+
+    # Use the folder containing the "lossless" folder to create a variable
+    # containing the path for the converted folder
+    # and a variable containing the path as well as filename
+    # for the new converted file
+    root = full_file_path.parent.parent
+    dirname_converted = Path(root, values.output_folder)
+    full_file_path_converted = Path(root, values.output_folder, f"{full_file_path.stem}.mp4")
+
+    # Check if the folder for converted clips does not exist
+    # and create it, as well as log it, if it does not
+    # If it fails, it will instead log the exception and continue with the next file/folder
+    if not os.path.exists(dirname_converted):
+        try:
+            os.mkdir(dirname_converted)
+            logger.info(f'Created {dirname_converted}.')
+        except OSError as e:
+            logger.exception(e)
+            return
+
+    # Look the clip up in the state index. If it hasn't changed since
+    # last time, we already know what's been done to it
+    try:
+        stat = full_file_path.stat()
+    except OSError as e:
+        logger.exception(e)
+        return
+
+    record = values.state_index.get(full_file_path, stat.st_size, stat.st_mtime_ns)
+    job = EncodeJob(full_file_path, full_file_path_converted, stat.st_size, stat.st_mtime_ns)
+
+    # the phrase "ytupload" in the filename will be used
+    # to tell the script it should upload the video.
+    # If it is not in the filename, then it should not be uploaded
+    if 'ytupload' in filename.casefold():
+        logger.info('Video is marked for upload. Checking if video has been uploaded...')
+
+        # Uploads found below are recorded under the settings the clip was recorded with,
+        # so the conversion states stored alongside them are kept
+        settings = record['settings'] if record is not None else get_encode_settings(values)
+
+        if record is not None and record['uploaded']:
+            logger.info(f'{filename} has aleady been uploaded with ID {record["video_id"]}')
+
+        # The channel index is checked before the fingerprint, as it doesn't have to read the original
+        elif (video_id := get_channel_video_id(filename, values)) is not None:
+            logger.info(f'{filename} has aleady been uploaded with ID {video_id}')
+            values.state_index.set(full_file_path, job.size, job.mtime_ns, settings, uploaded=True, video_id=video_id)
+
+        # The same clip may have been uploaded under another name, like before it was renamed
+        elif (video_id := get_duplicate_upload(job, values)) is not None:
+            logger.info(f'{filename} has aleady been uploaded with ID {video_id} under another name')
+            values.state_index.set(full_file_path, job.size, job.mtime_ns, settings, uploaded=True, video_id=video_id)
+
+        else:
+            logger.info('No matching title found on channel. Uploading...')
+            job.upload = True
+
+    # If the state index says the clip was converted and verified
+    # with the current settings, trust it without probing either file
+    if (record is not None and record['verified'] and record['settings'] == get_encode_settings(values)
+            and os.path.exists(full_file_path_converted)):
+        logger.info(f'Skipping {filename} with reason: Already converted')
+
+        # The clip may still need uploading even though it's been converted
+        if job.upload:
+            values.upload_queue.put(UploadJob(get_upload_file(job, values), job))
+        return
+
+    # If the converted clip has a manifest matching the original and itself,
+    # it was completed and verified when it was converted
+    manifest = read_manifest(full_file_path_converted)
+    if manifest is not None and os.path.exists(full_file_path_converted):
+        if is_output_trusted(job, manifest):
+            logger.info(f'Skipping {filename} with reason: Already converted')
+
+            # A clip converted with other settings, like before the tuner picked new ones, is kept.
+            # It's recorded with the settings it was converted with, so it's never taken for
+            # a conversion with the current settings
+            settings = manifest.get('settings', '')
+            if settings != get_encode_settings(values):
+                logger.info(f'Keeping {filename} converted with different settings: {settings or "unknown"}')
+
+            values.state_index.set(full_file_path, job.size, job.mtime_ns, settings, converted=True, verified=True)
+
+            # Conversions from before fingerprints were stored are added as they're found
+            if 'source_hash' in manifest:
+                job.fingerprint = manifest['source_hash']
+                values.state_index.set_fingerprint(job.fingerprint, output=str(full_file_path_converted),
+                                                   settings=settings)
+
+            # The clip may still need uploading even though it's been converted
+            if job.upload:
+                values.upload_queue.put(UploadJob(get_upload_file(job, values), job))
+            return
+
+        os.remove(full_file_path_converted)
+        os.remove(get_manifest_path(full_file_path_converted))
+        logger.info(f'Removed converted {filename} with reason: The original or converted clip has changed')
+
+    # Check if a file with the same name, but without a manifest, already exists
+    # in the converted folder. It was converted before manifests were written.
+    # If their frame counts do not match
+    # delete, log and convert it.
+    # Otherwise, assume it has aleady been converted, write a manifest for it and log it
+    if os.path.exists(full_file_path_converted):
+        frames = get_video_length(full_file_path, values)
+
+        # If the original can't be probed, converting it would fail as well
+        if frames is None:
+            logger.info(f'Skipping {filename} with reason: Could not get the length of the original')
+            return
+
+        # A converted clip that can't be probed is corrupted or unfinished
+        if frames != get_video_length(full_file_path_converted, values):
+            os.remove(full_file_path_converted)
+            logger.info(f'Removed converted {filename} with reason: Framecount mismatch')
+
+        else:
+            logger.info(f'Skipping {filename} with reason: Already exists')
+            write_manifest(job, frames, values)
+            values.state_index.set(full_file_path, job.size, job.mtime_ns, get_encode_settings(values),
+                                   converted=True, verified=True)
+            values.state_index.set_fingerprint(get_fingerprint(job), output=str(full_file_path_converted),
+                                               settings=get_encode_settings(values))
+
+            # The clip may still need uploading even though it's been converted
+            if job.upload:
+                values.upload_queue.put(UploadJob(get_upload_file(job, values), job))
+            return
+
+    # A clip with the same content as one converted before, under another name or in another folder,
+    # reuses that conversion
+    if reuse_duplicate_conversion(job, values):
+        if job.upload:
+            values.upload_queue.put(UploadJob(get_upload_file(job, values), job))
+        return
+
+    # Hand the clip over to the first free worker
+    logger.info(f'Queueing {filename} for conversion.')
+    values.encode_queue.put(job)
+
+
+# Keeps track of new clips until they stop changing.
+# A clip is only considered finished once its size and modification time
+# have stayed the same for a while, so clips still being written aren't converted
+class StabilityTracker:
+    def __init__(self, stable_seconds: float):
+        self.stable_seconds = stable_seconds
+        self.lock = threading.Lock()
+
+        # Maps clips to their last seen size, modification time,
+        # and the time they were last seen changing
+        self.candidates = {}
+
+    # Adds a clip to be watched, or restarts its timer if it's already watched
+    def touch(self, path: Path):
+        with self.lock:
+            self.candidates[path] = (None, None, time.monotonic())
+
+    # Returns the clips that have stopped changing, and stops watching them
+    def pop_stable(self) -> list:
+        stable = []
+        now = time.monotonic()
+
+        with self.lock:
+            for path, (size, mtime_ns, since) in list(self.candidates.items()):
+                try:
+                    stat = os.stat(path)
+
+                # The clip was deleted or moved before it was finished
+                except OSError:
+                    del self.candidates[path]
+                    continue
+
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                    self.candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+                elif now - since >= self.stable_seconds:
+                    del self.candidates[path]
+                    stable.append(path)
+
+        return stable
+
+
+# Function for checking if a path is a clip in a "lossless" folder
+def is_lossless_clip(path: Path, values: Values) -> bool:
+    return path.parent.name == 'lossless' and is_included(path.name, values)
+
+
+# Function for checking if a file was modified too recently to be sure it's finished being written
+def is_recently_modified(path: Path, values: Values) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) < values.watch_stable_seconds
+    except OSError:
+        return False
+
+
+# Function for running indefinitely, and queueing clips as they are added to the recordings folders.
+# File system events are used if watchdog is installed, otherwise the known "lossless" folders are polled
+def watch_for_clips(lossless_folders: list, values: Values):
+    logger = logging.getLogger('converter')
+
+    tracker = StabilityTracker(values.watch_stable_seconds)
+
+    # The size and modification time of every clip already handed to queue_clip,
+    # so polling only picks up clips that are new or have changed
+    handled = {}
+    for folder in lossless_folders:
+        # A folder removed since the scan has no clips to watch
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            logger.warning(f'Could not list {folder}: {e}')
+            continue
+
+        for entry in entries:
+            path = Path(entry.path)
+            if not entry.is_file() or not is_lossless_clip(path, values):
+                continue
+
+            # Clips skipped by the scan for being too new are watched until they're finished
+            if is_recently_modified(path, values):
+                tracker.touch(path)
+            else:
+                stat = entry.stat()
+                handled[path] = (stat.st_size, stat.st_mtime_ns)
+
+    observer = None
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        # Passes every change to a clip on to the tracker.
+        # Moved clips are tracked under their new name
+        class ClipEventHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+
+                path = Path(getattr(event, 'dest_path', '') or event.src_path)
+                if is_lossless_clip(path, values):
+                    tracker.touch(path)
+
+        observer = Observer()
+        for recordings_folder in values.recordings_folders:
+            observer.schedule(ClipEventHandler(), recordings_folder, recursive=True)
+        observer.start()
+        logger.info('Watching for new clips using file system events')
+
+    except ImportError:
+        logger.info(f'watchdog is not installed. Polling for new clips every {values.watch_poll_interval} seconds. '
+                    'Install the modules in requirements.txt to use file system events instead')
+
+    # A recordings folder that can't be watched, like one that has been removed, falls back to polling as well
+    except OSError as e:
+        logger.warning(f'Could not watch for file system events: {e}. Polling for new clips every '
+                       f'{values.watch_poll_interval} seconds')
+        if observer is not None and observer.is_alive():
+            observer.stop()
+            observer.join()
+        observer = None
+
+    print('Watching for new clips. Press CTRL+C to quit')
+
+    last_poll = time.monotonic()
+    last_rescan = time.monotonic()
+
+    try:
+        while not values.stop_event.is_set():
+            time.sleep(1)
+            now = time.monotonic()
+
+            # Without file system events, the "lossless" folders are listed instead.
+            # Only the folders are listed, and the rest of the tree is only walked
+            # once in a while to find any new "lossless" folders
+            if observer is None and now - last_poll >= values.watch_poll_interval:
+                last_poll = now
+
+                if now - last_rescan >= values.watch_rescan_interval:
+                    last_rescan = now
+                    lossless_folders = [folder for recordings_folder in values.recordings_folders
+                                        for folder in find_lossless_folders(recordings_folder, values)]
+
+                for folder in lossless_folders:
+                    try:
+                        entries = list(os.scandir(folder))
+                    except OSError:
+                        continue
+
+                    for entry in entries:
+                        path = Path(entry.path)
+                        if not entry.is_file() or not is_lossless_clip(path, values):
+                            continue
+
+                        stat = entry.stat()
+                        if handled.get(path) != (stat.st_size, stat.st_mtime_ns):
+                            tracker.touch(path)
+
+            # Queue the clips that have finished being written
+            for path in tracker.pop_stable():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if handled.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                handled[path] = (stat.st_size, stat.st_mtime_ns)
+                logger.info(f'{path.name} has finished being written')
+                with timed('scan', path.name):
+                    queue_clip(path, values)
+
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+# Function for telling a group of workers there's no more work,
+# by adding a None for each of them to their queue, and waiting for them to finish
+def stop_workers(workers: list, work_queue):
+    for _ in workers:
+        work_queue.put(None)
+
+    for worker in workers:
+        worker.join()
+
+
+# Parser for the output of ffmpeg's "-progress" option.
+# ffmpeg writes blocks of key=value lines, each ending with a "progress=continue"
+# or "progress=end" line. Iterating over the parser yields each block as a dictionary
+# until ffmpeg closes its output, after which the exit code can be read with wait().
+# Lines that aren't part of a block, like errors, are kept in messages
+class FFmpegProgressParser:
+    def __init__(self, process: Popen):
+        self.process = process
+        self.messages = []
+        self.ended = False
+
+    def __iter__(self):
+        block = {}
+
+        while True:
+            line = self.process.stdout.readline()
+
+            # An empty read means ffmpeg closed its output, and has exited
+            if not line:
+                return
+
+            line = line.decode(errors='replace').strip()
+            key, separator, value = line.partition('=')
+
+            if not separator or ' ' in key:
+                if line:
+                    self.messages.append(line)
+                continue
+
+            block[key] = value.strip()
+
+            if key == 'progress':
+                self.ended = value == 'end'
+                yield self.parse_block(block)
+                block = {}
+
+    # Converts the values we use to numbers. ffmpeg reports "N/A" for values it doesn't know yet
+    @staticmethod
+    def parse_block(block: dict) -> dict:
+        def number(value, suffix=''):
+            try:
+                return float(value.removesuffix(suffix))
+            except (AttributeError, ValueError):
+                return None
+
+        return dict(
+            frame=int(number(block.get('frame')) or 0),
+            fps=number(block.get('fps')),
+            speed=number(block.get('speed'), 'x'),
+            out_time_us=number(block.get('out_time_us')),
+            total_size=number(block.get('total_size')),
+            bitrate=number(block.get('bitrate'), 'kbits/s'),
+            progress=block.get('progress')
+        )
+
+    # Waits for ffmpeg to exit and returns its exit code
+    def wait(self) -> int:
+        return self.process.wait()
+
+
+# Worker function pulling clips off the encode queue until it receives None
+def encode_worker(worker_id: int, values: Values):
+    logger = logging.getLogger(f'encoder-{worker_id}')
+
+    # Each worker reuses a single progress bar for all of its clips
+    # to stop the bars from jumping around the terminal
+    with values.thread_lock:
+        ffmpeg_progress_bar = tqdm(total=0, unit='frames', desc=f'Worker {worker_id}', position=values.upload_jobs + worker_id)
+
+    while not values.stop_event.is_set():
+        job = values.encode_queue.get()
+
+        # We use None to signal there are no more clips
+        if job is None:
+            break
+
+        logger.info(f'Picked up {job.source.name}. {values.encode_queue.qsize()} clips left in the queue, '
+                    f'done in about {values.encode_queue.eta() / 60:.1f} minutes')
+        try:
+            # Convert from and into the staging folder, if the clip has been copied there
+            if values.stager is not None:
+                values.stager.acquire(job)
+
+            encode_video(job, ffmpeg_progress_bar, values)
+
+        # A clip failing in a way we don't handle, like the disk filling up while committing it,
+        # shouldn't stop the worker from converting the rest of the queue
+        except Exception:
+            logger.exception(f'Failed to convert {job.source.name}')
+            values.metrics.increment('clips_failed')
+
+            # Don't leave an unfinished conversion behind
+            remove_partials(job)
+
+        finally:
+            values.encode_queue.done(job)
+            if values.stager is not None:
+                values.stager.release(job)
+
+    with values.thread_lock:
+        ffmpeg_progress_bar.close()
+
+
+# Function for converting a single clip, and uploading it alongside if requested
+def encode_video(job: EncodeJob, ffmpeg_progress_bar: tqdm, values: Values):
+    try:
+        encode_and_verify(job, ffmpeg_progress_bar, values)
+
+    # Let any upload streaming the converted clip know the encode is over
+    finally:
+        job.encoded.set()
+
+    queue_converted_upload(job, values)
+
+
+# Function for queueing the upload of a converted clip once it's been verified,
+# unless it was streamed while converting or the original was uploaded instead
+def queue_converted_upload(job: EncodeJob, values: Values):
+    logger = logging.getLogger('converter')
+
+    if job.upload and job.encode_succeeded and not values.upload_source and not job.streamed:
+        logger.info(f'Queueing {job.source.name} for uploading.')
+        values.upload_queue.put(UploadJob(job.output, job))
+
+
+# Function for converting a clip and checking the result.
+# Sets encode_succeeded on the job if the converted clip is complete
+def encode_and_verify(job: EncodeJob, ffmpeg_progress_bar: tqdm, values: Values):
+    logger = logging.getLogger('converter')
+
+    filename = job.source.name
+
+    # The original is uploaded while it's being converted, if configured
+    if job.upload and values.upload_source:
+        values.upload_queue.put(UploadJob(job.source, job))
+
+    # Log the file we're about to convert
+    logger.info(f'Converting {filename}.')
+
+    frames = get_video_length(job.source, values)
+
+    if frames is None:
+        logger.info(f'Skipping {filename} with reason: Could not get the length of the original')
+        return
+
+    # Segmented conversions only write the output when joining the segments at the end,
+    # so only single pass conversions can be streamed
+    segmented = values.segmented and values.metadata.get(job.source)['duration'] >= values.segment_min_seconds
+    if segmented and (values.preview or values.thumbnail_count):
+        logger.info(f'Not making a preview or thumbnails of {filename} with reason: Converted in segments')
+    if job.upload and values.stream_upload and not values.upload_source and not segmented:
+        job.streamed = True
+        logger.info(f'Streaming {filename} to YouTube while converting.')
+        values.upload_queue.put(UploadJob(job.partial, job, streaming=True))
+
+    with values.thread_lock:
+        ffmpeg_progress_bar.reset(total=frames)
+        ffmpeg_progress_bar.set_description(f'Converting {job.source.stem}')
+
+    # Long clips are split into segments that are converted at the same time,
+    # everything else is converted by a single ffmpeg
+    started = time.monotonic()
+    try:
+        with timed('encode', filename):
+            if segmented:
+                success = encode_in_segments(job, frames, ffmpeg_progress_bar, values)
+            else:
+                success = encode_in_one_pass(job, frames, ffmpeg_progress_bar, values)
+
+    except FileNotFoundError:
+        logger.exception('Failed to find ffmpeg executable')
+        print('No ffmpeg exectuable was found.')
+        values.stop_event.set()
+        return
+
+    finally:
+        values.metrics.remove_encode(filename)
+
+    encode_seconds = time.monotonic() - started
+
+    if not success and not values.stop_event.is_set():
+        values.metrics.increment('clips_failed')
+
+    if success and not values.stop_event.is_set():
+        verified = verify_conversion(job, frames, values)
+
+        if verified and segmented:
+            remove_segments(job)
+
+        # Remember how fast it was converted, to predict how long the next clips will take.
+        # Segmented conversions use more threads than a single encode, so they aren't counted
+        if verified and not segmented:
+            metadata = values.metadata.get(job.source)
+            values.state_index.add_encode_speed(get_encode_speed_key(values),
+                                                frames * (metadata['width'] or 0) * (metadata['height'] or 0),
+                                                encode_seconds, values.encode_speed_decay)
+
+    # Don't leave an unfinished conversion behind.
+    # The preview and thumbnails are only kept if the conversion they were made alongside was,
+    # and what's left of them after a successful one are the copies in the staging folder
+    remove_partials(job)
+
+
+# Function for recording a finished conversion, and checking that the converted clip is complete
+# so the next run can skip it without probing either file again.
+# Only a conversion with every frame is given its final name and manifest, and sets encode_succeeded on the job
+def verify_conversion(job: EncodeJob, frames: int, values: Values) -> bool:
+    logger = logging.getLogger('converter')
+
+    filename = job.source.name
+
+    values.metrics.increment('clips_converted')
+    values.metrics.increment('frames_encoded', frames)
+    settings = get_encode_settings(values)
+    values.state_index.set(job.source, job.size, job.mtime_ns, settings, converted=True)
+
+    with timed('verify', filename):
+        if get_video_length(job.partial, values) != frames:
+            logger.warning(f'Converted {filename} does not have the same framecount as the original')
+            os.remove(job.partial)
+            return False
+
+        commit_output(job)
+        if job.preview_partial.exists():
+            os.replace(move_next_to(job.preview_partial, job.preview), job.preview)
+        commit_thumbnails(job)
+        write_manifest(job, frames, values)
+        values.state_index.set(job.source, job.size, job.mtime_ns, settings, verified=True)
+        values.state_index.set_fingerprint(get_fingerprint(job), output=str(job.output), settings=settings)
+        job.encode_succeeded = True
+        return True
+
+
+# Function for running ffmpeg with "-progress -" and passing each progress block to on_progress.
+# If we're stopping early, ffmpeg is stopped and None is returned.
+# Otherwise returns ffmpeg's exit code and the lines it printed that weren't progress
+def run_ffmpeg(cmd: list, values: Values, on_progress=None) -> tuple:
+    # Run process and args from above in a non-blocking way
+    # and pipe the stdout and stderr outputs.
+    # Reading the output is blocking, and therefore stderr is piped to stdout
+    # to make sure we're always reading from a pipe that has data
+    # wether it be the progress of the conversion or an error
+    p = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+    parser = FFmpegProgressParser(p)
+
+    for progress in parser:
+        # If the main thread received a keyboard interrupt, stop ffmpeg
+        if values.stop_event.is_set():
+            p.terminate()
+            p.wait()
+            return None, parser.messages
+
+        if on_progress is not None:
+            on_progress(progress)
+
+    returncode = parser.wait()
+
+    # ffmpeg may have exited on its own after the interrupt
+    if values.stop_event.is_set():
+        return None, parser.messages
+
+    return returncode, parser.messages
+
+
+# Function for converting a clip with a single ffmpeg. Returns whether it succeeded
+def encode_in_one_pass(job: EncodeJob, frames: int, ffmpeg_progress_bar: tqdm, values: Values) -> bool:
+    logger = logging.getLogger('converter')
+
+    filename = job.source.name
+
+    # Split the CPU evenly between the workers. "-threads" before the input
+    # limits the decoder, and "lp" limits the SVT-AV1 encoder
+    threads = get_threads_per_job(values)
+
+    # Create a list with ffmpeg and it's paramters, for a high-quality medium-slow AV1 encoding
+    # a CRF of 45 may seem too high, but it's the perfect mix between
+    # low filesize and good-enough quality for online sharing.
+    # A clip that's uploaded while it's being converted is written as a fragmented MP4,
+    # as moving the index to the start with faststart would rewrite the whole file at the end
+    if job.streamed:
+        movflags = '+frag_keyframe+empty_moov+default_base_moof'
+    else:
+        movflags = '+faststart'
+
+    # The temporary file may be left over from a crash, so it's overwritten.
+    # ffmpeg can't tell the format from the temporary name, so it's given explicitly
+    cmd = ['ffmpeg', '-v', 'fatal', '-y', '-threads', str(threads), '-i', str(get_encode_input(job)), '-progress', '-']
+
+    # Previews and thumbnails are made from the same decoded frames, and their outputs follow the AV1 output.
+    # With a filter graph the streams of each output have to be picked explicitly.
+    # The first audio track is the one ffmpeg would pick by itself for a recording
+    graph, extra_outputs = get_extra_outputs(job, threads, values)
+    if graph is not None:
+        cmd += ['-filter_complex', graph, '-map', '[av1]', '-map', '0:a:0?']
+
+    cmd += [*get_video_encode_args(values.preset, values.crf, threads),
+            '-c:a', 'aac', '-b:a', values.audio_bitrate,
+            '-movflags', movflags, '-f', 'mp4', str(job.partial), *extra_outputs]
+
+    started = time.monotonic()
+
+    def on_progress(progress: dict):
+        # Add only the new frames by subtracting the total converted with the total progress
+        with values.thread_lock:
+            ffmpeg_progress_bar.update(max(0, progress['frame'] - ffmpeg_progress_bar.n))
+            if progress['fps'] is not None and progress['speed'] is not None:
+                ffmpeg_progress_bar.set_postfix_str(f"{progress['fps']:.1f} fps, {progress['speed']:.2f}x", refresh=False)
+
+        # The time left is estimated from the frames left at the current encode speed
+        eta = None
+        if progress['fps']:
+            eta = round((frames - progress['frame']) / progress['fps'], 1)
+
+        values.metrics.set_encode(filename, frame=progress['frame'], frames=frames, fps=progress['fps'],
+                                  speed=progress['speed'], eta_seconds=eta, bitrate_kbits=progress['bitrate'],
+                                  total_size_bytes=progress['total_size'],
+                                  elapsed_seconds=round(time.monotonic() - started, 1))
+
+    returncode, messages = run_ffmpeg(cmd, values, on_progress)
+
+    # Remove the unfinished files if we were interrupted
+    if returncode is None:
+        remove_partials(job)
+        logger.info(f'Removed converted {filename} with reason: Keyboard interrupt')
+        return False
+
+    # ffmpeg exited without finishing, for example if the original couldn't be decoded
+    if returncode != 0:
+        logger.error(f'ffmpeg exited with code {returncode} while converting {filename}: {" ".join(messages[-5:])}')
+        return False
+
+    return True
+
+
+# Function for splitting a clip into segments of around segment_seconds, at its keyframes.
+# Returns a list of (start time, frame count) for each segment, so a segment can be converted
+# by seeking straight to its keyframe and converting exactly its frames
+def plan_segments(source: Path, values: Values) -> list:
+    # Listing the packets only requires demuxing the clip, not decoding it
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', str(source)]
+    p = run(cmd, check=True, capture_output=True)
+
+    packets = []
+    for line in p.stdout.decode().splitlines():
+        pts_time, _, flags = line.partition(',')
+        try:
+            packets.append((float(pts_time), 'K' in flags))
+        except ValueError:
+            continue
+
+    # Packets are listed in decoding order, but frames are counted in presentation order
+    packets.sort()
+
+    # Start a new segment at the first keyframe after each segment_seconds
+    starts = []
+    for index, (pts_time, keyframe) in enumerate(packets):
+        if keyframe and (not starts or pts_time - packets[starts[-1]][0] >= values.segment_seconds):
+            starts.append(index)
+
+    if not starts:
+        return [(0.0, len(packets))]
+
+    # Frames before the first keyframe can't be decoded on their own, and are left out just like ffmpeg would
+    ends = starts[1:] + [len(packets)]
+    return [(packets[start][0], end - start) for start, end in zip(starts, ends)]
+
+
+# Function for converting a long clip as segments at the same time, and joining them afterwards.
+# Finished segments are kept in a folder next to the output along with the plan,
+# so an interrupted conversion continues from the segments that are already done.
+# Returns whether it succeeded
+def encode_in_segments(job: EncodeJob, frames: int, ffmpeg_progress_bar: tqdm, values: Values) -> bool:
+    logger = logging.getLogger('converter')
+
+    filename = job.source.name
+    segments_folder = get_segments_folder(job)
+    plan_file = Path(segments_folder, 'plan.json')
+    settings = get_encode_settings(values)
+
+    # Reuse the plan from an interrupted conversion, unless the clip or the settings changed since
+    plan = None
+    if plan_file.exists():
+        with open(plan_file, 'r', encoding='utf-8') as f:
+            plan = load(f)
+
+        if (plan.get('size'), plan.get('mtime_ns'), plan.get('settings')) != (job.size, job.mtime_ns, settings):
+            logger.info(f'Discarding segments of {filename} with reason: The clip or settings have changed')
+            plan = None
+            for file in segments_folder.iterdir():
+                os.remove(file)
+
+    if plan is None:
+        segments_folder.mkdir(exist_ok=True)
+
+        try:
+            segments = plan_segments(get_encode_input(job), values)
+        except CalledProcessError as e:
+            logger.exception(e)
+            return False
+
+        plan = dict(size=job.size, mtime_ns=job.mtime_ns, settings=settings, segments=segments)
+        with open(f'{plan_file}.tmp', 'w', encoding='utf-8') as f:
+            dump(plan, f)
+        os.replace(f'{plan_file}.tmp', plan_file)
+
+    segments = plan['segments']
+    segment_files = [Path(segments_folder, f'{index:05}.mkv') for index in range(len(segments))]
+    audio_file = Path(segments_folder, 'audio.m4a')
+
+    # Each segment file only gets its final name once it's finished,
+    # so the ones that exist don't have to be converted again
+    pending = [index for index, file in enumerate(segment_files) if not file.exists()]
+    done_frames = sum(segments[index][1] for index in range(len(segments)) if index not in pending)
+    logger.info(f'Converting {filename} as {len(segments)} segments, {len(segments) - len(pending)} already done')
+
+    # The CPU available to the clip is split between the segments converted at the same time
+    available = get_threads_per_job(values) * (1 + get_idle_encoders(values))
+    segment_jobs = values.segment_jobs or max(1, available // values.segment_threads)
+    threads = max(1, available // segment_jobs)
+
+    # Frames converted by each segment in progress, for the progress bar and metrics
+    segment_progress = {}
+    progress_lock = threading.Lock()
+    started = time.monotonic()
+
+    def report_progress():
+        with progress_lock:
+            converted = done_frames + sum(segment_progress.values())
+
+        elapsed = time.monotonic() - started
+        fps = (converted - done_frames) / elapsed if elapsed > 0 else None
+        eta = round((frames - converted) / fps, 1) if fps else None
+
+        with values.thread_lock:
+            ffmpeg_progress_bar.update(max(0, converted - ffmpeg_progress_bar.n))
+            if fps is not None:
+                ffmpeg_progress_bar.set_postfix_str(f'{fps:.1f} fps, {len(segment_progress)} segments', refresh=False)
+
+        values.metrics.set_encode(filename, frame=converted, frames=frames, fps=round(fps, 2) if fps else None,
+                                  eta_seconds=eta, elapsed_seconds=round(elapsed, 1))
+
+    # Converts a single segment into a temporary file, which is renamed once it's finished
+    def encode_segment(index: int) -> bool:
+        start, segment_frames = segments[index]
+        part_file = segment_files[index].with_suffix('.part.mkv')
+
+        cmd = ['ffmpeg', '-v', 'fatal', '-y', '-threads', str(threads), '-ss', str(start), '-i', str(get_encode_input(job)),
+               '-progress', '-', '-map', '0:v:0', '-frames:v', str(segment_frames), '-an',
+               *get_video_encode_args(values.preset, values.crf, threads), str(part_file)]
+
+        def on_progress(progress: dict):
+            with progress_lock:
+                segment_progress[index] = progress['frame']
+            report_progress()
+
+        returncode, messages = run_ffmpeg(cmd, values, on_progress)
+
+        if returncode != 0:
+            if part_file.exists():
+                os.remove(part_file)
+            if returncode is not None:
+                logger.error(f'ffmpeg exited with code {returncode} while converting segment {index} '
+                             f'of {filename}: {" ".join(messages[-5:])}')
+            return False
+
+        os.replace(part_file, segment_files[index])
+
+        with progress_lock:
+            segment_progress[index] = segment_frames
+        return True
+
+    with ThreadPoolExecutor(max_workers=segment_jobs, thread_name_prefix='segment') as executor:
+        results = list(executor.map(encode_segment, pending))
+
+    if values.stop_event.is_set():
+        logger.info(f'Stopped converting {filename} with {sum(file.exists() for file in segment_files)} '
+                    f'of {len(segment_files)} segments done. They will be reused next time')
+        return False
+
+    if not all(results):
+        return False
+
+    # The audio is converted on its own, as it's quick compared to the video
+    has_audio = any(stream.get('codec_type') == 'audio' for stream in values.metadata.get(job.source)['streams'])
+
+    if has_audio and not audio_file.exists():
+        cmd = ['ffmpeg', '-v', 'fatal', '-y', '-i', str(get_encode_input(job)), '-progress', '-', '-vn',
+               '-c:a', 'aac', '-b:a', values.audio_bitrate, f'{audio_file}.part.m4a']
+        returncode, messages = run_ffmpeg(cmd, values)
+        if returncode != 0:
+            if returncode is not None:
+                logger.error(f'ffmpeg exited with code {returncode} while converting the audio '
+                             f'of {filename}: {" ".join(messages[-5:])}')
+            return False
+        os.replace(f'{audio_file}.part.m4a', audio_file)
+
+    # Join the segments and the audio without converting them again
+    list_file = Path(segments_folder, 'segments.txt')
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for file in segment_files:
+            escaped = str(file.resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = ['ffmpeg', '-v', 'fatal', '-y', '-f', 'concat', '-safe', '0', '-i', str(list_file)]
+    if has_audio:
+        cmd += ['-i', str(audio_file), '-map', '0:v', '-map', '1:a']
+    cmd += ['-progress', '-', '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', str(job.partial)]
+
+    returncode, messages = run_ffmpeg(cmd, values)
+
+    if returncode != 0:
+        if job.partial.exists():
+            os.remove(job.partial)
+        if returncode is not None:
+            logger.error(f'ffmpeg exited with code {returncode} while joining the segments '
+                         f'of {filename}: {" ".join(messages[-5:])}')
+        return False
+
+    return True
+
+
+# Returns the folder the segments of a clip converted in segments are kept in
+def get_segments_folder(job: EncodeJob) -> Path:
+    return Path(job.output.parent, f'.{job.output.stem}.segments')
+
+
+# Function for removing the segments of a clip once its conversion has been verified.
+# They're kept until then, so a conversion failing verification doesn't lose them
+def remove_segments(job: EncodeJob):
+    segments_folder = get_segments_folder(job)
+    if not segments_folder.exists():
+        return
+
+    for file in segments_folder.iterdir():
+        os.remove(file)
+    segments_folder.rmdir()
+
+
+# A clip leased to a remote worker. The lease lasts as long as the worker keeps sending heartbeats
+class Lease:
+    def __init__(self, lease_id: int, job: EncodeJob, frames: int, worker: str):
+        self.id = lease_id
+        self.job = job
+        self.frames = frames
+        self.worker = worker
+        self.heartbeat = time.monotonic()
+
+        # The conversion sent back by the worker is received into its own file,
+        # so a worker that lost its lease can never overwrite another worker's conversion
+        self.result = job.output.with_name(f'{job.output.stem}.lease{lease_id}.part{job.output.suffix}')
+
+    # Returns what the worker needs to know to convert the clip
+    def describe(self, values: Values) -> dict:
+        return dict(lease=self.id, source=str(self.job.source), size=self.job.size, frames=self.frames,
+                    preset=values.preset, crf=values.crf, audio_bitrate=values.audio_bitrate,
+                    lease_seconds=values.lease_seconds)
+
+
+# Hands out clips from the encode queue to remote workers, alongside the local encode workers.
+# A clip whose worker stops sending heartbeats is put back in the queue for another worker,
+# and a conversion sent back by a worker is verified like a local one before the clip is done
+class Coordinator:
+    # Progress fields accepted from the workers' heartbeats
+    progress_fields = ('frame', 'frames', 'fps', 'speed', 'eta_seconds', 'bitrate_kbits',
+                       'total_size_bytes', 'elapsed_seconds')
+
+    def __init__(self, values: Values):
+        self.logger = logging.getLogger('coordinator')
+
+        self.values = values
+        self.condition = threading.Condition()
+        self.leases = {}
+        self.lease_ids = count(1)
+
+        # Maps worker names to when they were last heard from
+        self.workers = {}
+
+        # Set once the coordinator has no more clips to hand out
+        self.finished = False
+
+    # Leases the next clip to a worker, or returns None if no clips are queued
+    def lease(self, worker: str) -> Lease:
+        with self.condition:
+            self.workers[worker] = time.monotonic()
+
+            while True:
+                job = self.values.encode_queue.get(block=False)
+                if job is None:
+                    return None
+
+                # Probes are cached, so this doesn't hold up the other workers
+                frames = get_video_length(job.source, self.values)
+                if frames is not None:
+                    break
+
+                self.logger.info(f'Skipping {job.source.name} with reason: Could not get the length of the original')
+                self.values.encode_queue.done(job)
+                job.encoded.set()
+
+            lease = Lease(next(self.lease_ids), job, frames, worker)
+            self.leases[lease.id] = lease
+
+        self.logger.info(f'Leased {job.source.name} to {worker} with lease {lease.id}')
+
+        # The original is uploaded while it's being converted, if configured
+        if job.upload and self.values.upload_source:
+            self.values.upload_queue.put(UploadJob(job.source, job))
+
+        return lease
+
+    # Returns the lease with the given ID, or None if it has ended
+    def get(self, lease_id: int) -> Lease:
+        with self.condition:
+            return self.leases.get(lease_id)
+
+    # Extends a lease, and records the worker's progress. Returns False if the lease has ended
+    def heartbeat(self, lease_id: int, progress: dict = None) -> bool:
+        with self.condition:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+
+            lease.heartbeat = time.monotonic()
+            self.workers[lease.worker] = lease.heartbeat
+
+        # Only the fields local encodes report are kept, as they become metric names
+        if isinstance(progress, dict):
+            fields = {key: value for key, value in progress.items()
+                      if key in self.progress_fields and isinstance(value, (int, float)) and not isinstance(value, bool)}
+            self.values.metrics.set_encode(lease.job.source.name, worker=lease.worker, **fields)
+        return True
+
+    # Ends a lease, and returns it. Returns None if it had already ended
+    def release(self, lease_id: int) -> Lease:
+        with self.condition:
+            lease = self.leases.pop(lease_id, None)
+            self.condition.notify_all()
+
+        if lease is not None:
+            self.values.metrics.remove_encode(lease.job.source.name)
+        return lease
+
+    # Ends a lease and puts its clip back in the queue, for when its worker has stopped or died
+    def requeue(self, lease_id: int):
+        lease = self.release(lease_id)
+        if lease is None:
+            return
+
+        self.values.encode_queue.done(lease.job)
+        if not self.values.stop_event.is_set():
+            self.values.encode_queue.put(lease.job)
+
+    # Ends a lease whose worker failed to convert its clip. The clip isn't tried again, like a failed local conversion
+    def fail(self, lease_id: int, reason: str):
+        lease = self.release(lease_id)
+        if lease is None:
+            return
+
+        self.logger.error(f'{lease.worker} failed to convert {lease.job.source.name}: {reason}')
+        self.values.metrics.increment('clips_failed')
+        self.values.encode_queue.done(lease.job)
+        lease.job.encoded.set()
+
+    # Verifies a conversion received from a worker, and finishes the clip like a local conversion.
+    # Returns whether the conversion was complete
+    def finish(self, lease: Lease) -> bool:
+        job = lease.job
+        try:
+            os.replace(lease.result, job.partial)
+            verify_conversion(job, lease.frames, self.values)
+        finally:
+            self.values.encode_queue.done(job)
+            job.encoded.set()
+
+        queue_converted_upload(job, self.values)
+        return job.encode_succeeded
+
+    # Puts the clips of workers that stopped sending heartbeats back in the queue, until the coordinator is closed
+    def expire_leases(self):
+        while not self.finished:
+            now = time.monotonic()
+            with self.condition:
+                expired = [lease for lease in self.leases.values() if now - lease.heartbeat > self.values.lease_seconds]
+
+            for lease in expired:
+                self.logger.warning(f'Lease {lease.id} of {lease.job.source.name} expired. '
+                                    f'{lease.worker} stopped sending heartbeats')
+                self.requeue(lease.id)
+
+            time.sleep(1)
+
+    # Returns the number of clips leased to remote workers
+    def lease_count(self) -> int:
+        with self.condition:
+            return len(self.leases)
+
+    # Returns the number of workers heard from within the last lease
+    def worker_count(self) -> int:
+        now = time.monotonic()
+        with self.condition:
+            return sum(1 for last_seen in self.workers.values() if now - last_seen <= self.values.lease_seconds)
+
+    # Waits until the queue is empty and every leased clip has been sent back or failed
+    def wait(self):
+        with self.condition:
+            while self.leases or self.values.encode_queue.qsize():
+                if self.values.stop_event.is_set():
+                    return
+                self.condition.wait(1)
+
+    # Tells the workers there are no more clips
+    def close(self):
+        self.finished = True
+
+
+# Request handler for the coordinator. Every request and response body is JSON, except for
+# GET /source/<lease>, which returns the original, and PUT /result/<lease>, which receives the conversion
+class CoordinatorRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.is_authorized():
+            return
+
+        coordinator = self.server.values.coordinator
+        body = self.read_json()
+
+        if self.path == '/lease':
+            if coordinator.finished:
+                self.send_json(410, dict(error='No more clips'))
+                return
+
+            lease = coordinator.lease(str(body.get('worker', self.client_address[0])))
+            if lease is None:
+                self.send_response(204)
+                self.end_headers()
+            else:
+                self.send_json(200, lease.describe(self.server.values))
+
+        elif self.path.startswith('/heartbeat/'):
+            if coordinator.heartbeat(self.get_lease_id(), body.get('progress')):
+                self.send_json(200, {})
+            else:
+                self.send_json(410, dict(error='Lease has ended'))
+
+        elif self.path.startswith('/release/'):
+            coordinator.requeue(self.get_lease_id())
+            self.send_json(200, {})
+
+        elif self.path.startswith('/fail/'):
+            coordinator.fail(self.get_lease_id(), str(body.get('reason')))
+            self.send_json(200, {})
+
+        else:
+            self.send_error(404)
+
+    # Sends the original of a leased clip
+    def do_GET(self):
+        if not self.is_authorized():
+            return
+
+        if not self.path.startswith('/source/'):
+            self.send_error(404)
+            return
+
+        lease = self.server.values.coordinator.get(self.get_lease_id())
+        if lease is None:
+            self.send_json(410, dict(error='Lease has ended'))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(lease.job.source)))
+        self.end_headers()
+
+        with open(lease.job.source, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+
+    # Receives the conversion of a leased clip, and verifies it
+    def do_PUT(self):
+        if not self.is_authorized():
+            return
+
+        if not self.path.startswith('/result/'):
+            self.send_error(404)
+            return
+
+        coordinator = self.server.values.coordinator
+        lease = coordinator.get(self.get_lease_id())
+        if lease is None:
+            self.send_json(410, dict(error='Lease has ended'))
+            return
+
+        # Receiving the conversion can take a while, so it counts as heartbeats
+        remaining = int(self.headers.get('Content-Length', 0))
+        with open(lease.result, 'wb') as f:
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+                coordinator.heartbeat(lease.id)
+
+        if remaining or coordinator.release(lease.id) is None:
+            os.remove(lease.result)
+            self.send_json(410, dict(error='Lease has ended or the conversion was incomplete'))
+            return
+
+        self.send_json(200, dict(verified=coordinator.finish(lease)))
+
+    # Checks the worker's token, if one is required.
+    # The comparison takes the same time however much of the token matches, so it can't be guessed bit by bit
+    def is_authorized(self) -> bool:
+        token = self.server.values.coordinator_token
+        if token is not None and not hmac.compare_digest(self.headers.get('X-Worker-Token', '').encode(), token.encode()):
+            self.send_error(403)
+            return False
+        return True
+
+    # Returns the lease ID at the end of the path, like /heartbeat/12, or 0 which is never a lease
+    def get_lease_id(self) -> int:
+        try:
+            return int(self.path.rsplit('/', 1)[1])
+        except ValueError:
+            return 0
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return loads(self.rfile.read(length)) if length else {}
+
+    def send_json(self, status: int, body: dict):
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Requests are logged by the coordinator instead
+    def log_message(self, format, *args):
+        pass
+
+
+# Function for starting the coordinator, and the server remote workers talk to it through
+def start_coordinator(values: Values) -> ThreadingHTTPServer:
+    values.coordinator = Coordinator(values)
+
+    server = ThreadingHTTPServer((values.coordinator_address, values.coordinator_port), CoordinatorRequestHandler)
+    server.values = values
+    threading.Thread(target=server.serve_forever, name='coordinator', daemon=True).start()
+    threading.Thread(target=values.coordinator.expire_leases, name='lease-expiry', daemon=True).start()
+    return server
+
+
+# Function for sending a request to the coordinator.
+# Returns the status code and the JSON response, which is None if there wasn't one
+def request_coordinator(path: str, values: Values, body: dict = None, method: str = 'POST') -> tuple:
+    data = dumps(body or {}).encode()
+    request = urllib.request.Request(f'{values.worker_url.rstrip("/")}{path}', data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    if values.coordinator_token is not None:
+        request.add_header('X-Worker-Token', values.coordinator_token)
+
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            content = response.read()
+            return response.status, loads(content) if content else None
+
+    # Leases that have ended and similar are answered with an error status
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+# Function for running as a remote encode worker, converting clips for the coordinator at values.worker_url
+def run_worker(values: Values):
+    values.stop_event = threading.Event()
+    os.makedirs(values.worker_folder, exist_ok=True)
+
+    workers = []
+    for worker_id in range(values.jobs):
+        worker = threading.Thread(target=remote_encode_worker, args=(worker_id, values), name=f'worker-{worker_id}')
+        worker.start()
+        workers.append(worker)
+
+    try:
+        for worker in workers:
+            worker.join()
+
+    # Leased clips are handed back to the coordinator by the workers as they stop
+    except KeyboardInterrupt:
+        print('Keyboard interrupt received. Quitting...')
+        values.stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+# Worker function leasing clips from the coordinator until it has no more
+def remote_encode_worker(worker_id: int, values: Values):
+    logger = logging.getLogger(f'worker-{worker_id}')
+
+    name = f'{socket.gethostname()}-{os.getpid()}-{worker_id}'
+    failures = 0
+
+    with values.thread_lock:
+        ffmpeg_progress_bar = tqdm(total=0, unit='frames', desc=f'Worker {worker_id}', position=worker_id)
+
+    while not values.stop_event.is_set():
+        try:
+            status, lease = request_coordinator('/lease', values, dict(worker=name))
+
+        # Keep trying for a while if the coordinator can't be reached, as it may be restarting
+        except OSError as e:
+            failures += 1
+            if failures > values.MAX_RETRIES:
+                logger.error(f'Giving up on reaching the coordinator: {e}')
+                print('Could not reach the coordinator. Check logs for details')
+                break
+            values.stop_event.wait(min(60, 2 ** failures))
+            continue
+
+        failures = 0
+
+        # The coordinator has no more clips
+        if status == 410:
+            logger.info('The coordinator has finished')
+            break
+
+        if status != 200:
+            values.stop_event.wait(values.worker_poll_interval)
+            continue
+
+        try:
+            convert_leased_clip(lease, name, ffmpeg_progress_bar, values)
+        except OSError as e:
+            logger.exception(e)
+            print(f'Failed to convert {Path(lease["source"]).name}. Check logs for details')
+
+    with values.thread_lock:
+        ffmpeg_progress_bar.close()
+
+
+# Function for converting a clip leased from the coordinator, and sending the conversion back
+def convert_leased_clip(lease: dict, name: str, ffmpeg_progress_bar: tqdm, values: Values):
+    logger = logging.getLogger('worker')
+
+    lease_id = lease['lease']
+    source = Path(lease['source'])
+    logger.info(f'Leased {source.name} with lease {lease_id}')
+
+    # Each lease is converted with the coordinator's settings, and only the AV1 conversion is made.
+    # It has its own stop event, so it can be stopped if the lease ends
+    lease_values = copy(values)
+    lease_values.preset = lease['preset']
+    lease_values.crf = lease['crf']
+    lease_values.audio_bitrate = lease['audio_bitrate']
+    lease_values.preview = False
+    lease_values.thumbnail_count = 0
+    lease_values.stop_event = threading.Event()
+
+    # Keep the lease while converting, and report the progress along with it
+    lease_lost = threading.Event()
+    converting = threading.Event()
+    converting.set()
+
+    def send_heartbeats():
+        last_heartbeat = time.monotonic()
+        while converting.is_set():
+            if values.stop_event.is_set():
+                lease_values.stop_event.set()
+
+            if time.monotonic() - last_heartbeat >= lease['lease_seconds'] / 3:
+                last_heartbeat = time.monotonic()
+                progress = values.metrics.snapshot()['encodes'].get(source.name)
+                try:
+                    status, _ = request_coordinator(f'/heartbeat/{lease_id}', values, dict(progress=progress))
+                except OSError as e:
+                    logger.warning(f'Failed to send a heartbeat for lease {lease_id}: {e}')
+                    status = None
+
+                if status == 410:
+                    logger.warning(f'Lease {lease_id} of {source.name} has ended. Stopping its conversion')
+                    lease_lost.set()
+                    lease_values.stop_event.set()
+
+            time.sleep(1)
+
+    heartbeats = threading.Thread(target=send_heartbeats, name=f'heartbeat-{lease_id}', daemon=True)
+    heartbeats.start()
+
+    # Use the original directly if this machine can read it at the same path, like a shared folder.
+    # Otherwise it's downloaded from the coordinator.
+    # Everything for the lease is kept in its own folder, which is removed afterwards
+    lease_folder = Path(values.worker_folder, str(lease_id))
+    lease_folder.mkdir(exist_ok=True)
+    downloaded = None
+
+    try:
+        if not (source.is_file() and source.stat().st_size == lease['size']):
+            downloaded = Path(lease_folder, source.name)
+            logger.info(f'Downloading {source.name}')
+
+            request = urllib.request.Request(f'{values.worker_url.rstrip("/")}/source/{lease_id}')
+            if values.coordinator_token is not None:
+                request.add_header('X-Worker-Token', values.coordinator_token)
+            with urllib.request.urlopen(request, timeout=60) as response, open(downloaded, 'wb') as f:
+                shutil.copyfileobj(response, f, 1024 * 1024)
+
+        job = EncodeJob(downloaded or source, Path(lease_folder, f'{source.stem}.mp4'), lease['size'], 0)
+
+        with values.thread_lock:
+            ffmpeg_progress_bar.reset(total=lease['frames'])
+            ffmpeg_progress_bar.set_description(f'Converting {source.stem}')
+
+        try:
+            with timed('encode', source.name):
+                success = encode_in_one_pass(job, lease['frames'], ffmpeg_progress_bar, lease_values)
+        except FileNotFoundError:
+            logger.exception('Failed to find ffmpeg executable')
+            print('No ffmpeg exectuable was found.')
+            values.stop_event.set()
+            success = False
+
+        converting.clear()
+        values.metrics.remove_encode(source.name)
+
+        if lease_lost.is_set():
+            return
+
+        # Hand the clip back to the coordinator if we're stopping, so another worker can convert it right away
+        if values.stop_event.is_set():
+            request_coordinator(f'/release/{lease_id}', values)
+            return
+
+        if not success:
+            request_coordinator(f'/fail/{lease_id}', values, dict(reason='ffmpeg failed to convert the clip'))
+            return
+
+        # Send the conversion back, which the coordinator verifies before the clip is done
+        logger.info(f'Sending the conversion of {source.name} back')
+        with open(job.partial, 'rb') as f:
+            request = urllib.request.Request(f'{values.worker_url.rstrip("/")}/result/{lease_id}', data=f, method='PUT',
+                                             headers={'Content-Length': str(os.path.getsize(job.partial)),
+                                                      'Content-Type': 'video/mp4'})
+            if values.coordinator_token is not None:
+                request.add_header('X-Worker-Token', values.coordinator_token)
+
+            try:
+                with urllib.request.urlopen(request, timeout=600) as response:
+                    verified = loads(response.read())['verified']
+            except urllib.error.HTTPError as e:
+                logger.warning(f'The coordinator did not accept the conversion of {source.name}: {e}')
+                return
+
+        if verified:
+            logger.info(f'{source.name} was converted and verified')
+        else:
+            logger.warning(f'The conversion of {source.name} failed verification on the coordinator')
+
+    finally:
+        converting.clear()
+        shutil.rmtree(lease_folder, ignore_errors=True)
+
+
+# Service probing clips with ffprobe on a pool of threads.
+# Each file is probed once for everything we need, and the results are kept
+# in a bounded LRU cache, keyed by path, size and modification time,
+# so a file is never probed twice unless it changes
+class MetadataService:
+    def __init__(self, workers: int, cache_size: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ffprobe')
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Returns the future for a file's metadata, starting the probe if it isn't cached
+    def _submit(self, filename: Path):
+        stat = os.stat(filename)
+        key = (str(filename), stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            future = self.executor.submit(self._timed_probe, filename)
+            self.cache[key] = future
+
+            # Forget the least recently used file once the cache is full
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+            return future
+
+    # Starts probing the files in the background, so the results
+    # are ready by the time they are needed
+    def prefetch(self, filenames: list):
+        for filename in filenames:
+            try:
+                self._submit(filename)
+            except OSError:
+                pass
+
+    # Returns the metadata of a file, waiting for the probe to finish if needed
+    def get(self, filename: Path) -> dict:
+        return self._submit(filename).result()
+
+    # Probes a file on one of the workers, logging how long it took
+    def _timed_probe(self, filename: Path) -> dict:
+        with timed('probe', Path(filename).name):
+            return self.probe(filename)
+
+    # Probes a single file for its duration, container, streams and frame count
+    @staticmethod
+    def probe(filename: Path) -> dict:
+        cmd = ['ffprobe', '-v', 'error', '-show_entries',
+               'format=format_name,duration:stream=index,codec_type,codec_name,width,height,avg_frame_rate,channels,nb_frames',
+               '-of', 'json', str(filename)]
+
+        # ffprobe outputs the file metadata in json format
+        p = run(cmd, check=True, capture_output=True)
+        info = loads(p.stdout)
+
+        streams = info.get('streams', [])
+        video_streams = [stream for stream in streams if stream.get('codec_type') == 'video']
+
+        metadata = dict(
+            container=info.get('format', {}).get('format_name'),
+            duration=float(info.get('format', {}).get('duration', 0)),
+            streams=streams,
+            width=video_streams[0].get('width') if video_streams else None,
+            height=video_streams[0].get('height') if video_streams else None,
+            frames=None
+        )
+
+        if not video_streams:
+            return metadata
+
+        # Containers like MKV don't store the frame count in the header.
+        # For those we instead have ffprobe count the packets of the video stream,
+        # which only requires demuxing and not decoding the file
+        if 'nb_frames' in video_streams[0]:
+            metadata['frames'] = int(video_streams[0]['nb_frames'])
+
+        else:
+            cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+                   '-show_entries', 'stream=nb_read_packets', '-of', 'json', str(filename)]
+            p = run(cmd, check=True, capture_output=True)
+            packets = loads(p.stdout)['streams'][0].get('nb_read_packets')
+
+            if packets is not None:
+                metadata['frames'] = int(packets)
+
+        return metadata
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Function for getting the length of the original and converted video, in frames.
+# Returns None if the length could not be found
+def get_video_length(filename: str, values: Values) -> int:
+    logger = logging.getLogger('video_length')
+
+    if not os.path.exists(filename):
+        logger.error(f'Could not get the length of {filename} with reason: File does not exist')
+        return None
+
+    try:
+        frames = values.metadata.get(filename)['frames']
+
+    except CalledProcessError as e:
+        logger.exception(e)
+        print('Error getting video durations. Check logs for details')
+        return None
+
+    except FileNotFoundError:
+        logger.exception('Failed to find ffprobe executable')
+        print('No ffprobe exectuable was found.')
+        values.stop_event.set()
+        return None
+
+    if frames is None:
+        logger.error(f'Could not find any frames metadata in {filename}')
+        print('Could not find any frames metadata in the video')
+
+    return frames
+
+
+# Function for encoding a segment of a clip with the given settings, for the tuner.
+# Returns the seconds it took, and the number of frames encoded
+def encode_sample(source: Path, start: float, output: Path, preset: int, crf: int, values: Values) -> tuple:
+    threads = get_threads_per_job(values)
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-threads', str(threads),
+           '-ss', str(start), '-t', str(values.tune_segment_seconds), '-i', str(source),
+           '-an', *get_video_encode_args(preset, crf, threads), '-progress', '-', str(output)]
+
+    started = time.monotonic()
+    p = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+    parser = FFmpegProgressParser(p)
+
+    frames = 0
+    for progress in parser:
+        frames = progress['frame']
+
+    if parser.wait() != 0:
+        raise CalledProcessError(p.returncode, cmd, output='\n'.join(parser.messages))
+
+    return time.monotonic() - started, frames
+
+
+# Function for comparing an encoded segment with the same segment of the original,
+# using ffmpeg's SSIM filter. Returns the average SSIM of all planes, where 1 is identical
+def measure_ssim(encoded: Path, source: Path, start: float, values: Values) -> float:
+    cmd = ['ffmpeg', '-v', 'info', '-nostats', '-i', str(encoded),
+           '-ss', str(start), '-t', str(values.tune_segment_seconds), '-i', str(source),
+           '-lavfi', '[0:v][1:v]ssim', '-f', 'null', '-']
+
+    p = run(cmd, check=True, capture_output=True)
+
+    # The filter logs a summary like "SSIM Y:0.98 (17.2) U:0.99 (20.1) V:0.99 (20.4) All:0.985 (18.3)"
+    for line in p.stderr.decode(errors='replace').splitlines():
+        if 'SSIM' in line and 'All:' in line:
+            return float(line.split('All:')[1].split()[0])
+
+    raise ValueError(f'ffmpeg did not report an SSIM for {encoded}')
+
+
+# Function for finding the fastest encode settings that keep the size and quality
+# close to the current settings. Segments of a few real clips are encoded
+# with every combination of the tune presets and CRFs, and the chosen settings
+# are written to the encode profile, which is used for converting from then on
+def tune_encoder(values: Values):
+    logger = logging.getLogger('tuner')
+
+    values.stop_event = threading.Event()
+
+    # Pick clips spread evenly over the library, so the samples aren't all from the same recording
+    clips = sorted(path for path, size, mtime_ns in scan_library(values, []))
+    if not clips:
+        print('No clips were found to tune with')
+        return
+
+    step = max(1, len(clips) // values.tune_samples)
+    samples = []
+    for clip in clips[::step][:values.tune_samples]:
+        try:
+            duration = values.metadata.get(clip)['duration']
+        except (CalledProcessError, OSError) as e:
+            logger.exception(e)
+            continue
+
+        # Take the segment from the middle of the clip, where the gameplay usually is
+        start = max(0.0, duration / 2 - values.tune_segment_seconds / 2)
+        samples.append((clip, start))
+
+    if not samples:
+        print('None of the clips could be probed. Check logs for details')
+        return
+
+    # The current settings are always tried, so there's something to compare with
+    presets = sorted(set(values.tune_presets) | {values.preset})
+    crfs = sorted(set(values.tune_crfs) | {values.crf})
+
+    logger.info(f'Tuning with {len(samples)} samples, presets {presets} and CRFs {crfs}')
+    print(f'Tuning with {len(samples)} samples of {values.tune_segment_seconds} seconds. This may take a while')
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_folder:
+        for preset in presets:
+            for crf in crfs:
+                total_seconds = 0
+                total_frames = 0
+                total_size = 0
+                ssims = []
+
+                for index, (clip, start) in enumerate(samples):
+                    output = Path(temp_folder, f'sample {index} preset {preset} crf {crf}.mp4')
+
+                    try:
+                        seconds, frames = encode_sample(clip, start, output, preset, crf, values)
+                        ssims.append(measure_ssim(output, clip, start, values))
+                    except (CalledProcessError, ValueError) as e:
+                        logger.exception(e)
+                        continue
+
+                    total_seconds += seconds
+                    total_frames += frames
+                    total_size += os.path.getsize(output)
+                    os.remove(output)
+
+                if not ssims:
+                    continue
+
+                result = dict(preset=preset, crf=crf,
+                              fps=round(total_frames / total_seconds, 2) if total_seconds else 0,
+                              size=total_size, ssim=round(sum(ssims) / len(ssims), 5))
+                results.append(result)
+                logger.info(f'Tuning result: {result}')
+                print(f"Preset {preset:>2} CRF {crf}: {result['fps']:>7.2f} fps, "
+                      f"{total_size / 1024 / 1024:>8.2f} MiB, SSIM {result['ssim']:.5f}")
+
+    baseline = next((result for result in results
+                     if result['preset'] == values.preset and result['crf'] == values.crf), None)
+    if baseline is None:
+        print('The current settings could not be measured. Check logs for details')
+        return
+
+    # Out of the settings that are close enough in quality and size, pick the fastest
+    candidates = [result for result in results
+                  if result['ssim'] >= baseline['ssim'] - values.tune_ssim_tolerance
+                  and result['size'] <= baseline['size'] * (1 + values.tune_size_tolerance)]
+    chosen = max(candidates, key=lambda result: result['fps'])
+
+    with open(values.encode_profile_file, 'w', encoding='utf-8') as f:
+        dump(dict(preset=chosen['preset'], crf=chosen['crf'], baseline=baseline,
+                  results=results, tuned=time.time()), f, indent=4)
+
+    logger.info(f'Chose preset {chosen["preset"]} and CRF {chosen["crf"]}')
+    print(f"Chose preset {chosen['preset']} and CRF {chosen['crf']} "
+          f"at {chosen['fps']:.2f} fps, compared to {baseline['fps']:.2f} fps with the current settings")
+
+
+# Function for loading the preset and CRF chosen by the tuner, if it has been run
+def load_encode_profile(values: Values):
+    if not os.path.exists(values.encode_profile_file):
+        return
+
+    with open(values.encode_profile_file, 'r', encoding='utf-8') as f:
+        profile = load(f)
+
+    values.preset = profile['preset']
+    values.crf = profile['crf']
+
+
+# Function for checking if an address can only be reached from this machine
+def is_loopback_address(address: str) -> bool:
+    if address == 'localhost':
+        return True
+
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+# Function for parsing the command line arguments
+def parse_arguments(values: Values):
+    parser = argparse.ArgumentParser(description='Convert lossless clips to AV1 and upload them to YouTube')
+    parser.add_argument('-r', '--root', action='append', dest='roots', metavar='FOLDER',
+                        help='Folder to search for "lossless" folders. Can be given multiple times '
+                             f'(default: {", ".join(values.recordings_folders)})')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help='Filename pattern of clips to convert. Can be given multiple times '
+                             f'(default: {" ".join(values.include_patterns)})')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='Filename or folder name pattern to ignore. Can be given multiple times')
+    parser.add_argument('--scan-jobs', type=int, default=values.scan_jobs,
+                        help=f'Number of subfolders to search at the same time (default: {values.scan_jobs})')
+    parser.add_argument('--segmented', action='store_true',
+                        help=f'Convert clips longer than {values.segment_min_seconds} seconds in segments at the same time, '
+                             'and continue interrupted conversions from the last finished segment')
+    parser.add_argument('--segment-seconds', type=float, default=values.segment_seconds,
+                        help=f'Length of each segment in seconds (default: {values.segment_seconds})')
+    parser.add_argument('--segment-jobs', type=int, default=values.segment_jobs, metavar='COUNT',
+                        help='Number of segments of a clip converted at the same time (default: one per '
+                             f'{values.segment_threads} threads available, including those of idle workers)')
+    parser.add_argument('--tune', action='store_true',
+                        help='Measure encode speed, size and quality of different presets and CRFs '
+                             'on samples of the clips, and save the best settings for future runs')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep running and convert new clips as they are added')
+    parser.add_argument('--stable-seconds', type=float, default=values.watch_stable_seconds,
+                        help='Seconds a new clip must stay unchanged before it is converted in watch mode '
+                             f'(default: {values.watch_stable_seconds})')
+    parser.add_argument('-j', '--jobs', type=int, default=values.jobs,
+                        help=f'Number of clips to convert at the same time (default: {values.jobs})')
+    parser.add_argument('--upload-jobs', type=int, default=values.upload_jobs,
+                        help=f'Number of videos to upload at the same time (default: {values.upload_jobs})')
+    parser.add_argument('--metrics-port', type=int, default=values.metrics_port,
+                        help='Serve live metrics on this port of localhost, at /metrics and /stats (default: off)')
+    parser.add_argument('--preview', action='store_true',
+                        help=f'Also make a {values.preview_height}p H.264 preview of each clip while converting it')
+    parser.add_argument('--thumbnails', type=int, default=values.thumbnail_count, metavar='COUNT',
+                        help='Number of thumbnails to take from each clip while converting it. '
+                             'The middle one is used for the uploaded video (default: none)')
+    parser.add_argument('--staging', metavar='FOLDER', default=values.staging_folder,
+                        help='Fast folder to copy the next clips to and convert them in, '
+                             'so the recordings drive is only read sequentially (default: off)')
+    parser.add_argument('--staging-ahead', type=int, default=values.staging_ahead, metavar='COUNT',
+                        help=f'Number of queued clips to copy to the staging folder ahead of time (default: {values.staging_ahead})')
+    parser.add_argument('--staging-budget', type=float, default=values.staging_budget / 1024 ** 3, metavar='GIB',
+                        help=f'Space the copies in the staging folder may use, in GiB (default: {values.staging_budget / 1024 ** 3:g})')
+    parser.add_argument('--upload-source', action='store_true',
+                        help='Upload the lossless original instead of the converted clip')
+    parser.add_argument('--stream-upload', action='store_true',
+                        help='Start uploading converted clips while they are still being converted')
+    parser.add_argument('--upload-limit', type=float, default=None, metavar='MBPS',
+                        help='Combined upload speed limit in megabits per second (default: no limit)')
+    parser.add_argument('--serve', type=int, default=values.coordinator_port, metavar='PORT',
+                        help='Let remote workers convert clips as well, by coordinating them on this port. '
+                             'Use --jobs 0 to only convert on remote workers (default: off)')
+    parser.add_argument('--serve-address', default=values.coordinator_address,
+                        help='Address the coordinator listens on. Use 0.0.0.0 to let other machines connect, '
+                             f'which requires --token (default: {values.coordinator_address})')
+    parser.add_argument('--worker', metavar='URL',
+                        help='Convert clips for the coordinator at URL, like http://host:port, '
+                             'instead of looking for clips')
+    parser.add_argument('--token', default=values.coordinator_token,
+                        help='Token remote workers need to send to the coordinator (default: none)')
+
+    args = parser.parse_args()
+
+    # The coordinator can leave all the converting to remote workers
+    if args.jobs < (0 if args.serve is not None else 1):
+        parser.error('--jobs must be at least 1, or 0 with --serve')
+
+    if args.serve is not None and args.worker is not None:
+        parser.error('--serve and --worker can not be used together')
+
+    # Anyone who can reach the coordinator can download the originals and hand in conversions
+    if args.serve is not None and args.token is None and not is_loopback_address(args.serve_address):
+        parser.error('--token is required when --serve-address is reachable from other machines')
+
+    if args.upload_jobs < 1:
+        parser.error('--upload-jobs must be at least 1')
+
+    if args.thumbnails < 0:
+        parser.error('--thumbnails must be at least 0')
+
+    if args.upload_limit is not None and args.upload_limit <= 0:
+        parser.error('--upload-limit must be above 0')
+
+    if args.staging is not None and not os.path.isdir(args.staging):
+        parser.error(f'{args.staging} is not a folder')
+
+    if args.staging_ahead < 1:
+        parser.error('--staging-ahead must be at least 1')
+
+    if args.staging_budget <= 0:
+        parser.error('--staging-budget must be above 0')
+
+    if args.roots is not None:
+        for root in args.roots:
+            if not os.path.isdir(root):
+                parser.error(f'{root} is not a folder')
+        values.recordings_folders = args.roots
+
+    if args.scan_jobs < 1:
+        parser.error('--scan-jobs must be at least 1')
+
+    if args.include is not None:
+        values.include_patterns = args.include
+
+    values.exclude_patterns = args.exclude
+    values.scan_jobs = args.scan_jobs
+    if args.segment_seconds <= 0:
+        parser.error('--segment-seconds must be above 0')
+
+    if args.segment_jobs is not None and args.segment_jobs < 1:
+        parser.error('--segment-jobs must be at least 1')
+
+    values.segmented = args.segmented
+    values.segment_seconds = args.segment_seconds
+    values.segment_jobs = args.segment_jobs
+    values.tune = args.tune
+    values.watch = args.watch
+    values.watch_stable_seconds = args.stable_seconds
+    values.jobs = args.jobs
+    values.upload_jobs = args.upload_jobs
+    values.metrics_port = args.metrics_port
+    values.preview = args.preview
+    values.thumbnail_count = args.thumbnails
+    values.coordinator_port = args.serve
+    values.coordinator_address = args.serve_address
+    values.coordinator_token = args.token
+    values.worker_url = args.worker
+    values.upload_source = args.upload_source
+    values.stream_upload = args.stream_upload
+    values.staging_folder = args.staging
+    values.staging_ahead = args.staging_ahead
+    values.staging_budget = int(args.staging_budget * 1024 ** 3)
+
+    if args.upload_limit is not None:
+        values.upload_bandwidth_limit = args.upload_limit * 1000 * 1000 / 8
+
+
+if __name__ == '__main__':
+    # Instance an object of our values class for easier passing and workflow
+    values = Values()
+
+    # Apply any options given on the command line
+    parse_arguments(values)
+
+    # Use the settings chosen by the tuner, if it has been run
+    load_encode_profile(values)
+
+    # Create and add a queue for the log records to our values object
+    values.queue = Queue()
+
+    # Create and add a threading lock to our values object
+    values.thread_lock = threading.Lock()
+
+    # Open the index of previously converted and uploaded clips
+    values.state_index = StateIndex(values.state_index_file)
+
+    # Start the service used for probing clips
+    values.metadata = MetadataService(values.probe_jobs, values.probe_cache_size)
+
+    # Start collecting metrics, and serve them if a port was given
+    values.metrics = Metrics(values)
+    if values.metrics_port is not None:
+        start_metrics_server(values)
+
+    # Create the bucket shared by the upload workers, if the upload speed is limited
+    if values.upload_bandwidth_limit is not None:
+        values.upload_bucket = TokenBucket(values.upload_bandwidth_limit)
+
+    # Set up logging, and start the thread writing the logs
+    log_listener = setup_logging(values)
+
+    # Set the name of the program the logs will appear under.
+    # This will make it easier to see which section of the
+    # script the log appeared from
+    logger = logging.getLogger('main')
+
+    logger.info('#Starting script#')
+    logger.info(f'Converting with preset {values.preset} and CRF {values.crf}')
+
+    try:
+        # Tuning doesn't need YouTube, so it's done before authenticating
+        if values.tune:
+            tune_encoder(values)
+
+        # Remote workers only convert, and the coordinator uploads the clips
+        elif values.worker_url is not None:
+            run_worker(values)
+
+        else:
+            # Load the local copy of the channel's videos. It's refreshed the first time it's used
+            # and then every channel_refresh_seconds. The first refresh
+            # is also when we first authenticate with YouTube
+            values.channel_index = ChannelIndex(values.channel_index_file, lambda: get_youtube(values),
+                                                values.channel_refresh_seconds)
+
+            # Later versions do not seem to play nice with the Google API modules
+            # resulting in uploads failing with an error resembling
+            # "Redirected but the response is missing a Location: header"
+            # if a chunksize is specified in MediaFileUpload.
+            # External sources say 0.15.0 and down work, but as I haven't tested this
+            # we will assume only 0.15.0 works, but still allow the script to run
+            if httplib2.__version__ != '0.15.0':
+                logger.warning(f'httplib2 version 0.15.0 is specifically required, but {httplib2.__version__} is installed')
+
+            convert_to_av1(values)
+
+        values.metadata.close()
+        values.state_index.close()
+
+    # Stop the logger thread once it has written the remaining logs,
+    # also when quitting early or after an error
+    finally:
+        log_listener.stop()
@@ -0,0 +1,110 @@
+# Tests for the local copy of the channel's videos, against the fake YouTube API used by the benchmark
+
+# Import required modules
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+from benchmark import FakeYouTube
+from main import ChannelIndex
+
+
+class ChannelIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.youtube = FakeYouTube(latency=0)
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'channel uploads.json')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def open_index(self, refresh_seconds: float = None) -> ChannelIndex:
+        return ChannelIndex(self.filename, lambda: self.youtube, refresh_seconds)
+
+    def test_first_refresh_lists_every_page(self):
+        for number in range(120):
+            self.youtube.add_video(f'Clip {number}')
+
+        index = self.open_index()
+
+        self.assertEqual(index.get('Clip 0'), 'fake0000000')
+        self.assertEqual(index.get('Clip 119'), 'fake0000119')
+        self.assertEqual(len(index.videos), 120)
+
+    def test_refresh_only_lists_new_videos(self):
+        for number in range(120):
+            self.youtube.add_video(f'Clip {number}')
+        self.open_index().refresh()
+
+        self.youtube.add_video('New clip')
+        calls = self.youtube.counters['api_calls']
+
+        index = self.open_index()
+        self.assertIsNotNone(index.get('New clip'))
+        self.assertIsNotNone(index.get('Clip 0'))
+
+        # A single page is enough to reach the newest video of the previous listing
+        self.assertEqual(self.youtube.counters['api_calls'] - calls, 1)
+
+    def test_own_uploads_do_not_hide_manual_uploads(self):
+        self.youtube.add_video('Old clip')
+        index = self.open_index()
+        index.refresh()
+
+        # A video uploaded by hand, followed by one uploaded by the script
+        manual_id = self.youtube.add_video('Manual')
+        index.add('Scripted', self.youtube.add_video('Scripted'))
+
+        index = self.open_index()
+        self.assertEqual(index.get('Manual'), manual_id)
+        self.assertIsNotNone(index.get('Scripted'))
+        self.assertIsNotNone(index.get('Old clip'))
+
+    def test_refreshes_on_interval(self):
+        index = self.open_index(refresh_seconds=0)
+        self.assertIsNone(index.get('Later clip'))
+
+        self.youtube.add_video('Later clip')
+        self.assertIsNotNone(index.get('Later clip'))
+
+    def test_refreshes_once_without_interval(self):
+        index = self.open_index()
+        self.assertIsNone(index.get('Later clip'))
+
+        self.youtube.add_video('Later clip')
+        self.assertIsNone(index.get('Later clip'))
+
+    def test_offline_uses_saved_copy(self):
+        self.youtube.add_video('Saved clip')
+        self.open_index().refresh()
+
+        index = ChannelIndex(self.filename, lambda: None)
+        self.assertEqual(index.get('Saved clip'), 'fake0000000')
+
+    def test_failing_api_uses_saved_copy(self):
+        self.youtube.add_video('Saved clip')
+        self.open_index().refresh()
+
+        self.youtube.add_video('Unlisted clip')
+        self.youtube.failure_rate = 1.0
+
+        with mock.patch.object(main.time, 'sleep'):
+            index = self.open_index()
+            self.assertEqual(index.get('Saved clip'), 'fake0000000')
+            self.assertIsNone(index.get('Unlisted clip'))
+
+        # The listing was retried before giving up
+        self.assertEqual(self.youtube.counters['failures'], main.Values.MAX_RETRIES + 1)
+
+    def test_retries_failing_listing(self):
+        self.youtube.add_video('Clip')
+        self.youtube.failure_rate = 0.5
+
+        with mock.patch.object(main.time, 'sleep'):
+            self.assertEqual(self.open_index().get('Clip'), 'fake0000000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# Tests for handing out clips to remote workers, and taking them back from workers that stopped
+
+# Import required modules
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from queue import Queue
+from unittest import mock
+
+import main
+from main import Coordinator, EncodeJob, EncodeScheduler, Metrics, StateIndex
+
+
+# Metadata service returning the same length for every clip
+class FakeMetadata:
+    def get(self, filename: Path) -> dict:
+        return dict(frames=100, width=1, height=1)
+
+
+class CoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+        self.values = main.Values()
+        self.values.stop_event = threading.Event()
+        self.values.metadata = FakeMetadata()
+        self.values.metrics = Metrics(self.values)
+        self.values.upload_queue = Queue()
+        self.values.state_index = StateIndex(os.path.join(self.folder.name, 'state.sqlite3'))
+        self.values.encode_queue = EncodeScheduler(self.values)
+        self.coordinator = Coordinator(self.values)
+
+        source = Path(self.folder.name, 'clip.mkv')
+        source.write_bytes(b'clip')
+        self.job = EncodeJob(source, Path(self.folder.name, 'clip.mp4'), 4, 1)
+        self.values.encode_queue.put(self.job)
+
+    def tearDown(self):
+        self.values.state_index.connection.close()
+        self.folder.cleanup()
+
+    # Runs a single pass of expire_leases
+    def expire_leases(self):
+        def finish(seconds):
+            self.coordinator.finished = True
+
+        with mock.patch.object(main.time, 'sleep', side_effect=finish):
+            self.coordinator.expire_leases()
+
+    def test_leases_queued_clips(self):
+        lease = self.coordinator.lease('worker')
+
+        self.assertIs(lease.job, self.job)
+        self.assertEqual(lease.frames, 100)
+        self.assertEqual(self.coordinator.lease_count(), 1)
+        self.assertEqual(self.coordinator.worker_count(), 1)
+        self.assertIsNone(self.coordinator.lease('other worker'))
+
+    def test_expired_lease_is_requeued(self):
+        lease = self.coordinator.lease('worker')
+        lease.heartbeat -= self.values.lease_seconds + 1
+
+        self.expire_leases()
+
+        self.assertIsNone(self.coordinator.get(lease.id))
+        self.assertEqual(self.values.encode_queue.qsize(), 1)
+        self.assertEqual(self.values.encode_queue.running_count(), 0)
+        self.assertFalse(self.job.encoded.is_set())
+
+        # Another worker gets the clip under a new lease, and the old lease can't be extended
+        new_lease = self.coordinator.lease('other worker')
+        self.assertIs(new_lease.job, self.job)
+        self.assertNotEqual(new_lease.id, lease.id)
+        self.assertFalse(self.coordinator.heartbeat(lease.id))
+
+    def test_heartbeat_extends_the_lease(self):
+        lease = self.coordinator.lease('worker')
+        lease.heartbeat -= self.values.lease_seconds + 1
+
+        self.assertTrue(self.coordinator.heartbeat(lease.id, dict(frame=50, worker='spoofed', fps=True)))
+        self.expire_leases()
+
+        self.assertIs(self.coordinator.get(lease.id), lease)
+        self.assertEqual(self.values.metrics.encodes['clip.mkv'], dict(worker='worker', frame=50))
+
+    def test_requeue_while_stopping_drops_the_clip(self):
+        lease = self.coordinator.lease('worker')
+        self.values.stop_event.set()
+
+        self.coordinator.requeue(lease.id)
+
+        self.assertEqual(self.coordinator.lease_count(), 0)
+        self.assertEqual(self.values.encode_queue.qsize(), 0)
+
+    def test_failed_clip_is_not_requeued(self):
+        lease = self.coordinator.lease('worker')
+
+        self.coordinator.fail(lease.id, 'ffmpeg failed')
+
+        self.assertEqual(self.coordinator.lease_count(), 0)
+        self.assertEqual(self.values.encode_queue.qsize(), 0)
+        self.assertTrue(self.job.encoded.is_set())
+        self.assertEqual(self.values.metrics.counters['clips_failed'], 1)
+
+        # Ending a lease twice does nothing
+        self.coordinator.fail(lease.id, 'ffmpeg failed')
+        self.assertEqual(self.values.metrics.counters['clips_failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
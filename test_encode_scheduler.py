@@ -0,0 +1,169 @@
+# Tests for the order the encode workers get clips in
+
+# Import required modules
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import main
+from main import EncodeJob, EncodeScheduler, StateIndex
+
+
+# Metadata service returning the given number of frames for each clip, at a single pixel per frame
+class FakeMetadata:
+    def __init__(self, frames: dict):
+        self.frames = frames
+
+    def get(self, filename: Path) -> dict:
+        return dict(frames=self.frames[Path(filename).name], width=1, height=1)
+
+
+class EncodeSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.frames = {}
+
+        # With a speed of a pixel per second, a clip is predicted to take as many seconds as it has frames
+        self.values = main.Values()
+        self.values.jobs = 2
+        self.values.default_encode_speed = 1
+        self.values.stop_event = threading.Event()
+        self.values.metadata = FakeMetadata(self.frames)
+        self.values.state_index = StateIndex(os.path.join(self.folder.name, 'state.sqlite3'))
+        self.scheduler = EncodeScheduler(self.values)
+
+    def tearDown(self):
+        self.values.state_index.connection.close()
+        self.folder.cleanup()
+
+    def make_job(self, name: str, frames: int, upload: bool = False) -> EncodeJob:
+        self.frames[name] = frames
+        return EncodeJob(Path(self.folder.name, name), Path(self.folder.name, f'{name}.mp4'), 1, 1, upload)
+
+    def test_quickest_clips_go_first(self):
+        long = self.make_job('long', 300)
+        short = self.make_job('short', 10)
+        medium = self.make_job('medium', 100)
+        for job in (long, short, medium):
+            self.scheduler.put(job)
+
+        self.assertEqual(self.scheduler.peek(3), [short, medium, long])
+        self.assertEqual([self.scheduler.get() for _ in range(3)], [short, medium, long])
+
+    def test_uploads_go_first(self):
+        short = self.make_job('short', 10)
+        upload = self.make_job('upload', 300, upload=True)
+        self.scheduler.put(short)
+        self.scheduler.put(upload)
+
+        self.assertIs(self.scheduler.get(), upload)
+
+    def test_equal_clips_keep_their_order(self):
+        jobs = [self.make_job(f'clip {number}', 10) for number in range(5)]
+        with mock.patch.object(main.time, 'monotonic', return_value=0.0):
+            for job in jobs:
+                self.scheduler.put(job)
+
+        self.assertEqual([self.scheduler.get() for _ in jobs], jobs)
+
+    def test_waiting_clips_age(self):
+        long = self.make_job('long', 100)
+        short = self.make_job('short', 10)
+
+        # The long clip has waited longer than the difference between the two
+        with mock.patch.object(main.time, 'monotonic', return_value=0.0):
+            self.scheduler.put(long)
+        with mock.patch.object(main.time, 'monotonic', return_value=200.0):
+            self.scheduler.put(short)
+
+        self.assertIs(self.scheduler.get(), long)
+
+    def test_without_aging_short_clips_keep_going_first(self):
+        self.values.schedule_aging = 0
+        long = self.make_job('long', 100)
+        short = self.make_job('short', 10)
+
+        with mock.patch.object(main.time, 'monotonic', return_value=0.0):
+            self.scheduler.put(long)
+        with mock.patch.object(main.time, 'monotonic', return_value=200.0):
+            self.scheduler.put(short)
+
+        self.assertIs(self.scheduler.get(), short)
+
+    def test_stops_once_the_queue_is_empty(self):
+        job = self.make_job('clip', 10)
+        self.scheduler.put(job)
+        self.scheduler.put(None)
+
+        # Clips queued before the stop are still converted
+        self.assertIs(self.scheduler.get(), job)
+        self.assertIsNone(self.scheduler.get())
+
+    def test_each_stop_stops_one_worker(self):
+        self.scheduler.put(None)
+        self.scheduler.put(None)
+
+        self.assertIsNone(self.scheduler.get())
+        self.assertIsNone(self.scheduler.get())
+        self.assertEqual(self.scheduler.stops, 0)
+
+    def test_stopping_early_leaves_the_queue(self):
+        self.scheduler.put(self.make_job('clip', 10))
+        self.scheduler.put(None)
+        self.values.stop_event.set()
+
+        self.assertIsNone(self.scheduler.get())
+        self.assertEqual(self.scheduler.qsize(), 1)
+
+    def test_get_without_blocking(self):
+        self.assertIsNone(self.scheduler.get(block=False))
+
+        job = self.make_job('clip', 10)
+        self.scheduler.put(job)
+        self.assertIs(self.scheduler.get(block=False), job)
+
+    def test_get_waits_for_a_clip(self):
+        job = self.make_job('clip', 10)
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.scheduler.get()))
+        worker.start()
+
+        self.scheduler.put(job)
+        worker.join(5)
+        self.assertEqual(results, [job])
+
+    def test_unprobed_clips_are_predicted_instantly(self):
+        job = self.make_job('clip', 10)
+
+        with mock.patch.object(self.values.metadata, 'get', side_effect=OSError):
+            self.assertEqual(main.predict_encode_seconds(job, self.values), 0.0)
+
+    def test_eta_spreads_clips_over_the_workers(self):
+        self.scheduler.put(self.make_job('short', 10))
+        self.scheduler.put(self.make_job('long', 30))
+
+        self.assertEqual(self.scheduler.eta(), 20)
+
+    def test_eta_counts_the_rest_of_running_clips(self):
+        with mock.patch.object(main.time, 'monotonic', return_value=0.0):
+            self.scheduler.put(self.make_job('short', 10))
+            self.scheduler.put(self.make_job('long', 30))
+            job = self.scheduler.get()
+
+        self.assertEqual(self.scheduler.running_count(), 1)
+        with mock.patch.object(main.time, 'monotonic', return_value=4.0):
+            self.assertEqual(self.scheduler.eta(), (30 + 6) / 2)
+
+        # A clip running longer than predicted doesn't count as negative time left
+        with mock.patch.object(main.time, 'monotonic', return_value=100.0):
+            self.assertEqual(self.scheduler.eta(), 30 / 2)
+
+        self.scheduler.done(job)
+        self.assertEqual(self.scheduler.running_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
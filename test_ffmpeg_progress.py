@@ -0,0 +1,58 @@
+# Tests for reading the progress ffmpeg reports with its "-progress" option
+
+# Import required modules
+import io
+import unittest
+from unittest import mock
+
+from main import FFmpegProgressParser
+
+
+class FFmpegProgressParserTest(unittest.TestCase):
+    def parse(self, output: bytes) -> tuple:
+        process = mock.Mock(stdout=io.BytesIO(output))
+        parser = FFmpegProgressParser(process)
+        return parser, list(parser)
+
+    def test_yields_each_block(self):
+        parser, blocks = self.parse(b'frame=10\nfps=25.0\nspeed=1.5x\nbitrate=1200.5kbits/s\nprogress=continue\n'
+                                    b'frame=20\nfps=25.0\nspeed=1.4x\nprogress=end\n')
+
+        self.assertEqual([block['frame'] for block in blocks], [10, 20])
+        self.assertEqual(blocks[0]['speed'], 1.5)
+        self.assertEqual(blocks[0]['bitrate'], 1200.5)
+        self.assertEqual(blocks[1]['progress'], 'end')
+        self.assertTrue(parser.ended)
+
+    def test_unknown_values(self):
+        _, blocks = self.parse(b'frame=0\nfps=N/A\nspeed=N/A\nout_time_us=N/A\nprogress=continue\n')
+
+        self.assertEqual(blocks[0]['frame'], 0)
+        self.assertIsNone(blocks[0]['fps'])
+        self.assertIsNone(blocks[0]['speed'])
+        self.assertIsNone(blocks[0]['out_time_us'])
+        self.assertIsNone(blocks[0]['total_size'])
+
+    def test_keeps_other_lines_as_messages(self):
+        parser, blocks = self.parse(b'frame=10\nError while decoding stream #0:0: Invalid data\n\n'
+                                    b'[libsvtav1 @ 0x1] key = value\nprogress=continue\n')
+
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(parser.messages, ['Error while decoding stream #0:0: Invalid data',
+                                           '[libsvtav1 @ 0x1] key = value'])
+
+    def test_stops_when_ffmpeg_exits_early(self):
+        parser, blocks = self.parse(b'frame=10\nprogress=continue\nframe=15\n')
+
+        # The unfinished block is dropped, and the encode isn't taken as having ended
+        self.assertEqual([block['frame'] for block in blocks], [10])
+        self.assertFalse(parser.ended)
+
+    def test_invalid_bytes(self):
+        _, blocks = self.parse(b'frame=1\xff0\nprogress=continue\n')
+
+        self.assertEqual(blocks[0]['frame'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Tests for waiting until new clips have stopped changing before they're converted
+
+# Import required modules
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import main
+from main import StabilityTracker
+
+
+class StabilityTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.clip = Path(self.folder.name, 'clip.mkv')
+        self.clip.write_bytes(b'start')
+        self.tracker = StabilityTracker(10)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    # Checks for stable clips as if the given number of seconds had passed
+    def pop_stable_at(self, seconds: float) -> list:
+        with mock.patch.object(main.time, 'monotonic', return_value=seconds):
+            return self.tracker.pop_stable()
+
+    def test_unchanged_clip_becomes_stable(self):
+        with mock.patch.object(main.time, 'monotonic', return_value=0.0):
+            self.tracker.touch(self.clip)
+
+        # The first check only records the size and modification time
+        self.assertEqual(self.pop_stable_at(0), [])
+        self.assertEqual(self.pop_stable_at(5), [])
+        self.assertEqual(self.pop_stable_at(10), [self.clip])
+
+        # Stable clips are no longer watched
+        self.assertEqual(self.pop_stable_at(20), [])
+
+    def test_growing_clip_restarts_the_timer(self):
+        self.tracker.touch(self.clip)
+        self.pop_stable_at(0)
+
+        with open(self.clip, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(self.pop_stable_at(10), [])
+        self.assertEqual(self.pop_stable_at(15), [])
+        self.assertEqual(self.pop_stable_at(20), [self.clip])
+
+    def test_touch_restarts_the_timer(self):
+        self.tracker.touch(self.clip)
+        self.pop_stable_at(0)
+
+        self.tracker.touch(self.clip)
+        self.pop_stable_at(10)
+        self.assertEqual(self.pop_stable_at(15), [])
+        self.assertEqual(self.pop_stable_at(20), [self.clip])
+
+    def test_deleted_clip_is_forgotten(self):
+        self.tracker.touch(self.clip)
+        self.pop_stable_at(0)
+
+        self.clip.unlink()
+        self.assertEqual(self.pop_stable_at(10), [])
+        self.assertEqual(self.tracker.candidates, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Tests for the SQLite index of what's been done to each clip
+
+# Import required modules
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from main import StateIndex
+
+
+class StateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.index = StateIndex(os.path.join(self.folder.name, 'state.sqlite3'))
+        self.source = Path(self.folder.name, 'clip.mkv')
+
+    def tearDown(self):
+        self.index.connection.close()
+        self.folder.cleanup()
+
+    def set_done(self):
+        self.index.set(self.source, 100, 1, 'crf=30', converted=True, verified=True, uploaded=True, video_id='video')
+
+    def test_unknown_clip(self):
+        self.assertIsNone(self.index.get(self.source, 100, 1))
+
+    def test_keeps_earlier_states(self):
+        self.index.set(self.source, 100, 1, 'crf=30', converted=True, verified=True)
+        self.index.set(self.source, 100, 1, 'crf=30', uploaded=True, video_id='video')
+
+        row = self.index.get(self.source, 100, 1)
+        self.assertEqual((row['converted'], row['verified'], row['uploaded'], row['video_id']), (1, 1, 1, 'video'))
+
+    def test_changed_settings_forget_the_conversion(self):
+        self.set_done()
+        self.index.set(self.source, 100, 1, 'crf=40')
+
+        # The clip is still on the channel, so it isn't uploaded again
+        row = self.index.get(self.source, 100, 1)
+        self.assertEqual((row['converted'], row['verified'], row['uploaded'], row['video_id']), (0, 0, 1, 'video'))
+        self.assertEqual(row['settings'], 'crf=40')
+
+    def test_changed_clip_forgets_everything(self):
+        self.set_done()
+        self.index.set(self.source, 200, 1, 'crf=30')
+
+        row = self.index.get(self.source, 200, 1)
+        self.assertEqual((row['converted'], row['verified'], row['uploaded'], row['video_id']), (0, 0, 0, None))
+
+    def test_changed_clip_is_unknown(self):
+        self.set_done()
+
+        self.assertIsNone(self.index.get(self.source, 200, 1))
+        self.assertIsNone(self.index.get(self.source, 100, 2))
+
+    def test_is_verified(self):
+        self.source.write_bytes(b'clip')
+        stat = os.stat(self.source)
+        self.index.set(self.source, stat.st_size, stat.st_mtime_ns, 'crf=30', converted=True, verified=True)
+
+        self.assertTrue(self.index.is_verified(self.source, 'crf=30'))
+        self.assertFalse(self.index.is_verified(self.source, 'crf=40'))
+
+        self.source.unlink()
+        self.assertFalse(self.index.is_verified(self.source, 'crf=30'))
+
+
+if __name__ == '__main__':
+    unittest.main()
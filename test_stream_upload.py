@@ -0,0 +1,80 @@
+# Tests for uploading a converted clip while it's still being converted, with the real Google API client
+
+# Import required modules
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import main
+
+try:
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import HttpMockSequence
+except ImportError:
+    build_from_document = None
+
+
+@unittest.skipIf(build_from_document is None, 'The Google API client is not installed')
+class StreamUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.values = main.Values()
+        self.values.stop_event = threading.Event()
+
+        output = Path(self.folder.name, 'clip.mp4')
+        self.job = main.EncodeJob(Path(self.folder.name, 'clip.mkv'), output, 1, 1, upload=True)
+        self.upload_job = main.UploadJob(self.job.partial, self.job, streaming=True)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def build(self, http):
+        return build_from_document(get_static_doc('youtube', 'v3'), http=http)
+
+    def insert(self, youtube, chunksize: int):
+        media_body = main.get_growing_file_upload_class()(self.upload_job, chunksize, self.values)
+        return youtube.videos().insert(part='snippet', body=dict(snippet=dict(title='clip')), media_body=media_body)
+
+    def test_client_accepts_the_upload(self):
+        request = self.insert(self.build(httplib2.Http()), 256 * 1024)
+
+        self.assertTrue(request.resumable.resumable())
+        self.assertIsNone(request.resumable.size())
+
+    def test_uploads_until_the_encode_has_finished(self):
+        http = HttpMockSequence([
+            ({'status': '200', 'location': 'https://upload.example/session'}, ''),
+            ({'status': '308', 'range': 'bytes=0-9'}, ''),
+            ({'status': '200'}, '{"id": "video"}'),
+        ])
+        request = self.insert(self.build(http), 10)
+
+        # The first chunk is written while the clip is converting, and the rest once it has been verified
+        self.job.partial.write_bytes(b'0123456789')
+        status, response = request.next_chunk()
+        self.assertEqual(status.resumable_progress, 10)
+        self.assertIsNone(response)
+
+        os.replace(self.job.partial, self.job.output)
+        with open(self.job.output, 'ab') as f:
+            f.write(b'abcde')
+        self.job.encode_succeeded = True
+        self.job.encoded.set()
+
+        status, response = request.next_chunk()
+        self.assertEqual(response, {'id': 'video'})
+
+    def test_failed_encode_stops_the_upload(self):
+        request = self.insert(self.build(httplib2.Http()), 10)
+        self.job.encoded.set()
+
+        with self.assertRaises(main.UploadError):
+            request.resumable.getbytes(0, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
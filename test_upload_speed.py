@@ -0,0 +1,68 @@
+# Tests for limiting the upload speed and sizing the upload chunks
+
+# Import required modules
+import unittest
+from unittest import mock
+
+import main
+from main import TokenBucket, get_chunk_size
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        mock.patch.object(main.time, 'monotonic', side_effect=lambda: self.now).start()
+        self.sleep = mock.patch.object(main.time, 'sleep').start()
+        self.addCleanup(mock.patch.stopall)
+        self.bucket = TokenBucket(100)
+
+    def test_full_bucket_does_not_wait(self):
+        self.bucket.consume(100)
+        self.sleep.assert_not_called()
+
+    def test_waits_for_missing_tokens(self):
+        self.bucket.consume(150)
+        self.sleep.assert_called_once_with(0.5)
+
+    def test_debt_is_paid_by_the_next_caller(self):
+        self.bucket.consume(150)
+        self.sleep.reset_mock()
+
+        self.now = 0.5
+        self.bucket.consume(50)
+        self.sleep.assert_called_once_with(0.5)
+
+    def test_refills_over_time(self):
+        self.bucket.consume(100)
+
+        self.now = 0.5
+        self.bucket.consume(50)
+        self.sleep.assert_not_called()
+
+    def test_refills_up_to_the_rate(self):
+        self.now = 60.0
+        self.bucket.consume(150)
+        self.sleep.assert_called_once_with(0.5)
+
+
+class ChunkSizeTest(unittest.TestCase):
+    def setUp(self):
+        self.values = main.Values()
+
+    def test_uploads_for_the_configured_seconds(self):
+        self.assertEqual(get_chunk_size(1024 * 1024, self.values), self.values.upload_chunk_seconds * 1024 * 1024)
+
+    def test_rounds_down_to_256_kib(self):
+        chunk_size = get_chunk_size(1000 * 1000, self.values)
+
+        self.assertEqual(chunk_size % (256 * 1024), 0)
+        self.assertLessEqual(chunk_size, 1000 * 1000 * self.values.upload_chunk_seconds)
+        self.assertGreater(chunk_size, 1000 * 1000 * self.values.upload_chunk_seconds - 256 * 1024)
+
+    def test_stays_within_the_configured_sizes(self):
+        self.assertEqual(get_chunk_size(0, self.values), self.values.upload_chunk_min)
+        self.assertEqual(get_chunk_size(10 ** 12, self.values), self.values.upload_chunk_max)
+
+
+if __name__ == '__main__':
+    unittest.main()